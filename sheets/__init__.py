@@ -1,5 +1,5 @@
-from .workbook import Workbook
+from .workbook import Workbook, CalculationMode
 from .error import CellError, CellErrorType
 
-__all__ = ["Workbook", "CellError", "CellErrorType"]
+__all__ = ["Workbook", "CalculationMode", "CellError", "CellErrorType"]
 version = '1.4'
@@ -1,5 +1,5 @@
 import enum
-from typing import Optional, Set, Any
+from typing import Optional, Any, Tuple
 
 
 class CellType(enum.Enum):
@@ -16,15 +16,27 @@ class CellType(enum.Enum):
 class Cell:
     """Cell class."""
 
+    __slots__ = ("loc", "contents", "val", "val_type", "sheet_name",
+                 "template", "id", "range_refs", "order")
+
     def __init__(self, col: int, row: int, contents: Optional[str], val: Any,
-                 val_type: CellType, sheet_name: str, pt):
+                 val_type: CellType, sheet_name: str, template):
         """Initialize a new cell.
         Attributes:
             col (int): The column the cell is located at.
             row (int): The row the cell is located at.
 
-            children (Set[Cell]): The list of cells that depend on this cell.
-            parents (Set[Cell]): The list of cells that this cell depends on.
+            id (int): The cell's id in the workbook's dependency graph, which
+            holds the cells it depends on and the cells depending on it.
+            range_refs (Tuple[Tuple[RangeIndex, Rect], ...]): The cell ranges
+            this cell depends on, and the index of the sheet each is recorded
+            in.
+            order (int): The cell's position in the workbook's topological
+            order of cells; every cell comes after the cells it depends on,
+            unless they are in a cycle. It is set when the cell is added to
+            the order.
+            template (Optional[FormulaTemplate]): The parsed formula, shared
+            with every cell holding the same formula relative to its location.
         """
 
         self.loc = (col, row)
@@ -32,17 +44,16 @@ class Cell:
         self.val = val
         self.val_type = val_type
         self.sheet_name = sheet_name
-        self.pt = pt
-        self.children: Set[Cell] = set()
-        self.parents: Set[Cell] = set()
-        self.invalid_sheet_refs: Set[str] = set()
+        self.template = template
+        self.id = -1
+        self.range_refs: Tuple[Tuple[Any, Tuple[int, int, int, int]],
+                               ...] = ()
+        self.order = 0
 
-    def make_empty(self) -> None:
+    def make_empty(self, graph) -> None:
         self.contents = None
         self.val = None
         self.val_type = CellType.NONE
-        self.pt = None
-        while self.parents:
-            p = self.parents.pop()
-            p.children.remove(self)
-        self.invalid_sheet_refs.clear()
+        self.template = None
+        graph.set_parents(self, ())
+        graph.set_range_refs(self, ())
@@ -0,0 +1,379 @@
+from .error import CellError, CellErrorType, error_desc
+from .graph import Rect
+from . import util
+from . import functions
+from . import operators
+from decimal import Decimal
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from lark import Transformer, Tree
+
+
+class EvalContext:
+    """The state a compiled formula reads while it is being evaluated: the
+    workbook, the sheet holding the cell, how far the cell is from its
+    template's anchor, the names of any sheets the formula referenced
+    that could not be found, and the (sheet name, location) of the cells it
+    read through INDIRECT.
+
+    names holds the values of the names LET has bound while the formula is
+    evaluated, keyed on their lower-case names.
+
+    While the workbook recalculates, range_values holds the values of the
+    cell ranges read so far, keyed on the sheet name and the range's
+    (left, top, right, bottom) bounds, so formulas reading the same range
+    share them. Otherwise it is None.
+    """
+
+    def __init__(self, wb):
+        self.workbook = wb
+        self.sheet_name: Optional[str] = None
+        self.d_cols = 0
+        self.d_rows = 0
+        self.invalid_sheet_refs: Set[str] = set()
+        self.dynamic_refs: Set[Tuple[str, str]] = set()
+        self.names: Dict[str, Any] = {}
+        self.range_values: Optional[Dict[Tuple[str, Rect], Any]] = None
+
+    def set_sheet_name(self, sheet_name):
+        self.sheet_name = sheet_name
+
+    def set_offset(self, d_cols, d_rows):
+        self.d_cols = d_cols
+        self.d_rows = d_rows
+
+
+# A compiled formula takes the evaluation context and returns the cell value.
+CompiledFormula = Callable[[EvalContext], Any]
+
+
+class Constant:
+    """A compiled formula that doesn't read any cells, whose value was worked
+    out when it was compiled."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __call__(self, ctx: EvalContext) -> Any:
+        return self.value
+
+
+def fold(evaluate: Callable[..., Any], *args: Any) -> Optional[Constant]:
+    """Returns a Constant holding the value of evaluate on the values of
+    the args, if all are Constants. Returns None if any isn't, or if
+    evaluate raises, leaving the error to be reported when the formula is
+    evaluated.
+    """
+
+    if not all(isinstance(a, Constant) for a in args):
+        return None
+    try:
+        return Constant(evaluate(*(a.value for a in args)))
+    except Exception:
+        return None
+
+
+class Name:
+    """A compiled reference to a name bound by LET, whose value is looked up
+    in the context's names when it is evaluated."""
+
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name.lower()
+
+    def __call__(self, ctx: EvalContext) -> Any:
+        if self.name in ctx.names:
+            return ctx.names[self.name]
+        return CellError(CellErrorType.BAD_NAME,
+                         error_desc.get(CellErrorType.BAD_NAME))
+
+
+class FormulaCompiler(Transformer):
+    """A Lark Transformer that turns a formula parse tree into a Python
+    closure. Each rule returns a function of the evaluation context, so the
+    tree is walked once at compile time rather than on every recalculation.
+
+    Literals are converted when the formula is compiled, and subexpressions
+    that don't read any cells, including calls of functions other than the
+    volatile ones and INDIRECT, are folded into Constants.
+
+    Relative references are resolved against the context's offset, so one
+    compiled template serves every cell that shares it.
+
+    Evaluation mirrors EvalExpressions exactly: operands are evaluated left to
+    right, operators are shared through the operators module, errors are
+    returned or raised in the same places, and the lazy arguments of
+    functions are passed as functions of no arguments.
+    """
+
+    def number(self, args):
+        return Constant(operators.number(args[0]))
+
+    def string(self, args):
+        return Constant(operators.string(args[0]))
+
+    def bool(self, args):
+        return Constant(operators.boolean(args[0]))
+
+    def error(self, args):
+        return Constant(operators.error(args[0]))
+
+    def name(self, args):
+        return Name(str(args[0]))
+
+    def parens(self, args):
+        return args[0]
+
+    @staticmethod
+    def chain(apply: Callable[[Any, str, Any], Any], args: List[Any]):
+        """Compiles a chain of operators at one precedence level, given as
+        the operands and operators [x, op, y, op, z, ...], into one function
+        applying them from left to right in a loop. Leading operands are
+        folded for as long as they are Constants, as a left-deep tree of
+        binary operators would be."""
+
+        val = args[0]
+        steps = [(str(args[i]), args[i + 1]) for i in range(1, len(args), 2)]
+        n = 0
+        while n < len(steps):
+            op, operand = steps[n]
+            constant = fold(lambda x, y: apply(x, op, y), val, operand)
+            if constant is None:
+                break
+            val, n = constant, n + 1
+        first, steps = val, steps[n:]
+
+        if not steps:
+            return first
+        if len(steps) == 1:
+            op, rhs = steps[0]
+            return lambda ctx: apply(first(ctx), op, rhs(ctx))
+
+        def evaluate(ctx):
+            val = first(ctx)
+            for op, operand in steps:
+                val = apply(val, op, operand(ctx))
+            return val
+        return evaluate
+
+    def add_expr(self, args):
+        return self.chain(operators.add_expr, args)
+
+    def mul_expr(self, args):
+        return self.chain(operators.mul_expr, args)
+
+    def unary_op(self, args):
+        op, operand = str(args[0]), args[1]
+        unary = operators.unary_op
+        return fold(lambda x: unary(op, x), operand) or \
+            (lambda ctx: unary(op, operand(ctx)))
+
+    def concat_expr(self, args):
+        concat = operators.concat_expr
+        args = [args[0]] + [a for arg in args[1:] for a in ("&", arg)]
+        return self.chain(lambda x, op, y: concat(x, y), args)
+
+    def compare_expr(self, args):
+        return self.chain(operators.compare_expr, args)
+
+    def cell(self, args):
+        sheet_name = str(args[0]) if len(args) == 2 else None
+        location = str(args[-1])
+        col, row, abs_col, abs_row = util.split_cell_ref(location)
+
+        def lookup(ctx):
+            try:
+                loc = location
+                if ctx.d_cols or ctx.d_rows:
+                    loc = util.stringify_cell_loc(
+                        col if abs_col else col + ctx.d_cols,
+                        row if abs_row else row + ctx.d_rows)
+                return ctx.workbook.get_cell_value(
+                    sheet_name or ctx.sheet_name, loc)
+            except KeyError as e:
+                ctx.invalid_sheet_refs.add(str(args[0]))
+                return CellError(CellErrorType.BAD_REFERENCE,
+                                 error_desc.get(CellErrorType.BAD_REFERENCE),
+                                 e)
+            except ValueError as e:
+                return CellError(CellErrorType.BAD_REFERENCE,
+                                 error_desc.get(CellErrorType.BAD_REFERENCE),
+                                 e)
+        return lookup
+
+    def cell_range(self, args):
+        sheet_name = str(args[0]) if len(args) == 3 else None
+        start_location, end_location = str(args[-2]), str(args[-1])
+
+        def values(ctx):
+            wb = ctx.workbook
+            sht_name = (sheet_name or ctx.sheet_name).translate({39: None})
+            if sht_name.lower() not in wb.sheet_names_lower_to_orig:
+                ctx.invalid_sheet_refs.add(str(args[0]))
+                return CellError(CellErrorType.BAD_REFERENCE,
+                                 error_desc.get(CellErrorType.BAD_REFERENCE))
+            sht_name = wb.sheet_names_lower_to_orig[sht_name.lower()]
+
+            start_loc = util.quantify_cell_loc(util.shift_cell_ref(
+                start_location, ctx.d_cols, ctx.d_rows))
+            end_loc = util.quantify_cell_loc(util.shift_cell_ref(
+                end_location, ctx.d_cols, ctx.d_rows))
+            tl = (min(start_loc[0], end_loc[0]),
+                  min(start_loc[1], end_loc[1]))
+            br = (max(start_loc[0], end_loc[0]),
+                  max(start_loc[1], end_loc[1]))
+
+            cache = ctx.range_values
+            if cache is not None:
+                vals = cache.get((sht_name, tl + br))
+                if vals is not None:
+                    return vals
+            vals = [[wb.get_cell_value(sht_name,
+                                       util.stringify_cell_loc(c, r))
+                     for c in range(tl[0], br[0] + 1)]
+                    for r in range(tl[1], br[1] + 1)]
+            if cache is not None:
+                cache[(sht_name, tl + br)] = vals
+            return vals
+        return values
+
+    def func(self, args):
+        name, inputs = args[0].upper(), args[1:]
+        func = functions.function_dict.get(name)
+        eager = functions.lazy_functions.get(name, len(inputs))
+        eager_inputs, lazy_inputs = inputs[:eager], inputs[eager:]
+        if name == "LET":
+            # The names LET binds are passed as strings
+            lazy_inputs = [i.name if isinstance(i, Name) and n % 2 == 0 and
+                           n < len(inputs) - 1 else i
+                           for n, i in enumerate(inputs)]
+
+        if func is not None and name not in functions.impure_functions:
+            def evaluate(*vals):
+                return func(list(vals[:eager]) +
+                            [partial(i, None) for i in lazy_inputs])
+            constant = fold(evaluate, *inputs)
+            if constant is not None:
+                return constant
+
+        def call(ctx):
+            vals = [i(ctx) for i in eager_inputs]
+            vals.extend(i if isinstance(i, str) else partial(i, ctx)
+                        for i in lazy_inputs)
+            try:
+                if func is None:
+                    raise KeyError(name)
+                if name == "INDIRECT":
+                    return func(vals, ctx.sheet_name, ctx.workbook,
+                                ctx.dynamic_refs)
+                if name == "LET":
+                    return func(vals, ctx.names)
+                return func(vals)
+            except KeyError as e:
+                return CellError(CellErrorType.BAD_NAME,
+                                 error_desc.get(CellErrorType.BAD_NAME), e)
+        return call
+
+
+_compiler = FormulaCompiler()
+
+
+def compile_formula(pt: Tree) -> CompiledFormula:
+    """Compiles a formula parse tree into a function of an EvalContext."""
+
+    return _compiler.transform(pt)
+
+
+def evaluate_template(template, ctx: EvalContext) -> Any:
+    """Evaluates a formula template's compiled formula in the context,
+    compiling it on first use. The context's sheet name and offset must
+    already be set.
+    """
+
+    if template.compiled is None:
+        template.compiled = compile_formula(template.tree)
+    try:
+        return template.compiled(ctx)
+    except Exception as e:
+        # Lark wraps exceptions raised while transforming in a VisitError,
+        # which is reported as a type error; compiled formulas do the same.
+        return CellError(CellErrorType.TYPE_ERROR,
+                         error_desc[CellErrorType.TYPE_ERROR], e)
+
+
+# A cell in a compiled function is keyed on its lower-case sheet name and
+# (col, row) location.
+CellKey = Tuple[str, Tuple[int, int]]
+
+
+class FunctionValues:
+    """Stands in for the workbook in the context of a compiled function:
+    cell values are read from a dictionary keyed on each cell's CellKey,
+    and sheet names are looked up in a copy of the workbook's names, so
+    evaluating doesn't read the workbook. The formulas read the same
+    references on every call, so the key of each is only worked out once.
+    """
+
+    def __init__(self, sheet_names: Dict[str, str],
+                 values: Dict[CellKey, Any]):
+        self.sheet_names_lower_to_orig = sheet_names
+        self.values = values
+        self.keys: Dict[Tuple[str, str], CellKey] = {}
+
+    def get_cell_value(self, sheet_name: str, location: str) -> Any:
+        key = self.keys.get((sheet_name, location))
+        if key is None:
+            name = sheet_name.translate({39: None}).lower()
+            if name not in self.sheet_names_lower_to_orig:
+                raise KeyError("Sheet name not found.")
+            key = self.keys[(sheet_name, location)] = \
+                (name, util.quantify_cell_loc(location))
+        return self.values.get(key)
+
+
+class CompiledFunction:
+    """A function from the values of some input cells to the values of some
+    output cells. Calling it evaluates the compiled formulas of the cells
+    between them in a fixed topological order, against the values the other
+    cells they read had when it was compiled.
+
+    Numbers passed in are converted to Decimal, as the workbook stores them.
+    The outputs are returned as a list, in order.
+    """
+
+    def __init__(self, inputs: List[CellKey], outputs: List[CellKey],
+                 steps: List[Tuple[CellKey, str, Tuple[int, int], Any]],
+                 sheet_names: Dict[str, str], values: Dict[CellKey, Any]):
+        """Initialize a function whose steps give, in order, the key of each
+        cell to evaluate, its sheet name, its offset from its template's
+        anchor and its template. values holds the other cells read."""
+
+        self.inputs = inputs
+        self.outputs = outputs
+        self.steps = steps
+        for _, _, _, template in steps:
+            if template.compiled is None:
+                template.compiled = compile_formula(template.tree)
+        self.context = EvalContext(FunctionValues(sheet_names, values))
+
+    def __call__(self, *args) -> List[Any]:
+        if len(args) != len(self.inputs):
+            raise TypeError(f"Expected {len(self.inputs)} input values, got "
+                            f"{len(args)}.")
+
+        ctx = self.context
+        values = ctx.workbook.values
+        for key, val in zip(self.inputs, args):
+            if isinstance(val, (int, float)) and not isinstance(val, bool):
+                val = Decimal(str(val))
+            values[key] = val
+        for key, sheet_name, (d_cols, d_rows), template in self.steps:
+            ctx.sheet_name = sheet_name
+            ctx.d_cols = d_cols
+            ctx.d_rows = d_rows
+            values[key] = evaluate_template(template, ctx)
+        ctx.invalid_sheet_refs.clear()
+        return [values.get(key) for key in self.outputs]
@@ -1,8 +1,11 @@
 from .error import CellError, CellErrorType
 import sheets
+import random
 import re
+from datetime import datetime
 from decimal import Decimal
-from typing import List, Any
+from functools import lru_cache
+from typing import List, Any, Dict, Optional, Set, Tuple
 import sys
 
 
@@ -16,40 +19,52 @@ error_desc = {
 }
 
 
+# Stands in for the value of a name LET hasn't bound.
+UNBOUND = object()
+
+
 def bool_and(args: List[Any]) -> Any:
     """Evaluates to TRUE if all arguments are TRUE.
     This function requires one or more arguments.
     All arguments are converted to Boolean values.
+
+    The arguments are lazy, and those after the first FALSE one are not
+    evaluated.
     """
 
     if len(args) == 0:
         return CellError(CellErrorType.TYPE_ERROR,
                          error_desc.get(CellErrorType.TYPE_ERROR))
-    res = True
-    for a in args:
+    for arg in args:
+        a = arg()
         if isinstance(a, list):
             return CellError(CellErrorType.TYPE_ERROR,
                              error_desc.get(CellErrorType.TYPE_ERROR))
-        res = res and bool(a)
-    return res
+        if not a:
+            return False
+    return True
 
 
 def bool_or(args: List[Any]) -> Any:
     """Evaluates to TRUE if any argument is TRUE.
     This function requires one or more arguments.
     All arguments are converted to Boolean values.
+
+    The arguments are lazy, and those after the first TRUE one are not
+    evaluated.
     """
 
     if len(args) == 0:
         return CellError(CellErrorType.TYPE_ERROR,
                          error_desc.get(CellErrorType.TYPE_ERROR))
-    res = False
-    for a in args:
+    for arg in args:
+        a = arg()
         if isinstance(a, list):
             return CellError(CellErrorType.TYPE_ERROR,
                              error_desc.get(CellErrorType.TYPE_ERROR))
-        res = res or bool(a)
-    return res
+        if a:
+            return True
+    return False
 
 
 def bool_not(args: List[Any]) -> Any:
@@ -105,6 +120,8 @@ def conditional_if(args: List[Any]) -> Any:
     is not specified, the function evalutes to the FALSE Boolean value.
     This function requires 2 or 3 arguments. The first argument is converted to
     a Boolean value; the other arguments are not converted.
+
+    The values are lazy, and only the one returned is evaluated.
     """
 
     if len(args) < 2 or len(args) > 3 or isinstance(args[0], list):
@@ -112,10 +129,12 @@ def conditional_if(args: List[Any]) -> Any:
                          error_desc.get(CellErrorType.TYPE_ERROR))
 
     if bool(args[0]):
-        return args[1] if args[1] is not None else Decimal("0")
+        val = args[1]()
+        return val if val is not None else Decimal("0")
     else:
         if len(args) == 3:
-            return args[2] if args[2] is not None else Decimal("0")
+            val = args[2]()
+            return val if val is not None else Decimal("0")
         return False
 
 
@@ -124,18 +143,23 @@ def conditional_iferror(args: List[Any]) -> Any:
     value2 is specified, the function evaluates to value2. If value1 is an
     error and value2 is not specified, the function evaluates to an empty
     string ““. This function requires 1 or 2 arguments.
+
+    value2 is lazy, and only evaluated if value1 is an error.
     """
 
-    if len(args) < 1 or len(args) > 2 or isinstance(args[0], list) or \
-            isinstance(args[1], list):
+    if len(args) < 1 or len(args) > 2 or isinstance(args[0], list):
         return CellError(CellErrorType.TYPE_ERROR,
                          error_desc.get(CellErrorType.TYPE_ERROR))
 
-    if args[0] in error_desc:
+    if isinstance(args[0], CellError):
         if len(args) == 1:
             return ""
-        return args[1] if args[1] is not None else Decimal("0")
-    return False
+        val = args[1]()
+        if isinstance(val, list):
+            return CellError(CellErrorType.TYPE_ERROR,
+                             error_desc.get(CellErrorType.TYPE_ERROR))
+        return val if val is not None else Decimal("0")
+    return args[0] if args[0] is not None else Decimal("0")
 
 
 def conditional_choose(args: List[Any]) -> Any:
@@ -145,6 +169,8 @@ def conditional_choose(args: List[Any]) -> Any:
     The first argument is converted to a number. If index is not an integer,
     or is 0 or less, or is beyond the end of the value list, then a TYPE_ERROR
     is produced.
+
+    The values are lazy, and only the one returned is evaluated.
     """
 
     if len(args) < 2 or isinstance(args[0], list):
@@ -156,7 +182,42 @@ def conditional_choose(args: List[Any]) -> Any:
             or index >= len(args):
         return CellError(CellErrorType.TYPE_ERROR,
                          error_desc.get(CellErrorType.TYPE_ERROR))
-    return args[int(index)] if args[int(index)] is not None else Decimal("0")
+    val = args[int(index)]()
+    return val if val is not None else Decimal("0")
+
+
+def let(args: List[Any], names: Dict[str, Any]) -> Any:
+    """Binds each name to the value following it, and evaluates to the last
+    argument, which can use the names, as can the values bound after them.
+    This function requires an odd number of at least 3 arguments, and each
+    argument before a value must be a name.
+
+    The names are passed as lower-case strings and the values are lazy, so
+    each value is evaluated once, when it is bound. names holds the values
+    of the names bound while the last argument is evaluated.
+    """
+
+    if len(args) < 3 or len(args) % 2 == 0:
+        return CellError(CellErrorType.TYPE_ERROR,
+                         error_desc.get(CellErrorType.TYPE_ERROR))
+
+    shadowed = []
+    try:
+        for i in range(0, len(args) - 1, 2):
+            name = args[i]
+            if not isinstance(name, str):
+                return CellError(CellErrorType.TYPE_ERROR,
+                                 error_desc.get(CellErrorType.TYPE_ERROR))
+            shadowed.append((name, names.get(name, UNBOUND)))
+            names[name] = args[i + 1]()
+        val = args[-1]()
+        return val if val is not None else Decimal("0")
+    finally:
+        for name, val in reversed(shadowed):
+            if val is UNBOUND:
+                del names[name]
+            else:
+                names[name] = val
 
 
 def informational_isblank(args: List[Any]) -> Any:
@@ -195,7 +256,53 @@ def informational_version(args: List[Any]) -> Any:
     return sheets.version
 
 
-def indirect(args: List[Any], sheet_name: str, workbook: Any) -> Any:
+def informational_now(args: List[Any]) -> Any:
+    """Takes no arguments, and returns the current date and time as a number
+    of days since December 30, 1899, with the time of day as the fraction.
+    """
+
+    if len(args) > 0:
+        return CellError(CellErrorType.TYPE_ERROR,
+                         error_desc.get(CellErrorType.TYPE_ERROR))
+    elapsed = datetime.now() - datetime(1899, 12, 30)
+    return Decimal(str(elapsed.total_seconds() / 86400))
+
+
+def math_rand(args: List[Any]) -> Any:
+    """Takes no arguments, and returns a random number greater than or equal
+    to 0 and less than 1.
+    """
+
+    if len(args) > 0:
+        return CellError(CellErrorType.TYPE_ERROR,
+                         error_desc.get(CellErrorType.TYPE_ERROR))
+    return Decimal(str(random.random()))
+
+
+# A cell reference as INDIRECT reads it, possibly on another sheet
+REFERENCE = re.compile(r"(?:(?P<sheet_name>[A-Za-z_][A-Za-z0-9_]*|'[^']*')!)?"
+                       r"(?P<cell_ref>\$?[A-Za-z]+\$?[1-9][0-9]*)")
+
+
+@lru_cache(maxsize=4096)
+def parse_reference(text: str) -> Optional[Tuple[Optional[str], str]]:
+    """Splits a reference string into its unquoted sheet name, or None if it
+    has none, and its cell reference. Returns None if the string isn't a
+    reference. Strings built for INDIRECT tend to repeat, so the results are
+    cached.
+    """
+
+    groups = REFERENCE.fullmatch(text)
+    if not groups:
+        return None
+    sheet_name = groups.group("sheet_name")
+    if sheet_name and sheet_name[0] == "'":
+        sheet_name = sheet_name[1:-1]
+    return sheet_name, groups.group("cell_ref")
+
+
+def indirect(args: List[Any], sheet_name: str, workbook: Any,
+             refs: Set[Tuple[str, str]]) -> Any:
     """Parses its string argument as a cell-reference (possibly including a
     sheet name and absolute/relative modifiers), and returns the value of the
     specified cell. This function always takes exactly one argument. The
@@ -205,23 +312,26 @@ def indirect(args: List[Any], sheet_name: str, workbook: Any) -> Any:
     or if the argument can be parsed as a cell reference, but the
     cell-reference is invalid for some reason (other than creating a circular
     reference in the workbook), this function returns a BAD_REFERENCE error.
+
+    The (sheet name, location) of the cell read is added to refs, so the
+    workbook can record that the formula depends on it.
     """
 
     if len(args) != 1:
         return CellError(CellErrorType.TYPE_ERROR,
                          error_desc.get(CellErrorType.TYPE_ERROR))
 
-    sht_ptrn = r"[A-Za-z_][A-Za-z0-9_]*"
-    quoted_sht_ptrn = r"\'[^']*\'"
-    cellref_ptrn = r"[\$]?[A-Za-z]+[\$]?[1-9][0-9]*"
-    groups = re.match(fr"^(?:(?P<sheet_name>{sht_ptrn}|{quoted_sht_ptrn}) \
-            \!)?(?P<cell_ref>{cellref_ptrn})$", args[0])
-
-    if not groups or not groups.group("cell_ref"):
+    ref = parse_reference(args[0]) if isinstance(args[0], str) else None
+    if ref is None:
         return CellError(CellErrorType.TYPE_ERROR,
                          error_desc.get(CellErrorType.TYPE_ERROR))
-    sheet_name = groups.group("sheet_name") or sheet_name
-    return workbook.get_cell_value(sheet_name, groups.group("cell_ref"))
+    sheet_name = ref[0] or sheet_name
+    refs.add((sheet_name, ref[1]))
+    try:
+        return workbook.get_cell_value(sheet_name, ref[1])
+    except (KeyError, ValueError) as e:
+        return CellError(CellErrorType.BAD_REFERENCE,
+                         error_desc.get(CellErrorType.BAD_REFERENCE), e)
 
 
 def flatten(arr):
@@ -400,7 +510,7 @@ def hlookup(args: List[Any]) -> Any:
 
     for row in range(len(values)):
         for col in range(len(values[0])):
-            if type(values[row][col]) == type(key) and values[row][col] == key:
+            if type(values[row][col]) is type(key) and values[row][col] == key:
                 return values[int(index) - 1][col]
 
     return CellError(CellErrorType.TYPE_ERROR,
@@ -426,7 +536,7 @@ def vlookup(args: List[Any]) -> Any:
 
     for col in range(len(values[0])):
         for row in range(len(values)):
-            if type(values[row][col]) == type(key) and values[row][col] == key:
+            if type(values[row][col]) is type(key) and values[row][col] == key:
                 return values[row][int(index) - 1]
 
     return CellError(CellErrorType.TYPE_ERROR,
@@ -442,14 +552,32 @@ function_dict = {
     "IF": conditional_if,
     "IFERROR": conditional_iferror,
     "CHOOSE": conditional_choose,
+    "LET": let,
     "ISBLANK": informational_isblank,
     "ISERROR": informational_iserror,
     "VERSION": informational_version,
+    "NOW": informational_now,
     "INDIRECT": indirect,
     "MIN": math_min,
     "MAX": math_max,
     "SUM": math_sum,
     "AVERAGE": math_avg,
+    "RAND": math_rand,
     "HLOOKUP": hlookup,
     "VLOOKUP": vlookup
 }
+
+# Functions whose value can change without any cell changing, so the cells
+# calling them are only brought up to date by Workbook.recalculate_volatile
+volatile_functions = {"NOW", "RAND"}
+
+# Functions whose value depends on more than their arguments, so calls with
+# constant arguments can't be evaluated when the formula is compiled
+impure_functions = volatile_functions | {"INDIRECT"}
+
+# Functions with lazy arguments, and how many of their leading arguments are
+# evaluated before they are called. The rest are passed as functions of no
+# arguments that evaluate the argument, so those a function doesn't need,
+# such as the branch IF doesn't take, are never evaluated
+lazy_functions = {"IF": 1, "IFERROR": 1, "CHOOSE": 1, "AND": 0, "OR": 0,
+                  "LET": 0}
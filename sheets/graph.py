@@ -0,0 +1,705 @@
+from __future__ import annotations
+from .cell import Cell
+from . import util
+from array import array
+from collections import OrderedDict
+from heapq import heapify, heappush, heappop
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, \
+    Sequence, Tuple, Union
+
+
+# A rectangle of cells (left col, top row, right col, bottom row), inclusive.
+Rect = Tuple[int, int, int, int]
+
+# Every span of rows or columns is covered by blocks of 2 ** level rows or
+# columns for levels up to these, so a lookup checks one block per level.
+ROW_LEVELS = util.MAX_ROW.bit_length() + 1
+COL_LEVELS = util.MAX_COL.bit_length() + 1
+
+
+def span_blocks(first: int, last: int) -> Iterator[Tuple[int, int]]:
+    """Yields the (level, index) blocks that exactly cover the rows or columns
+    first through last, where block (level, i) holds i * 2 ** level up to but
+    not including (i + 1) * 2 ** level. At most two blocks are used per level,
+    so the number of blocks doesn't depend on the length of the span.
+    """
+
+    lo, hi, level = first, last + 1, 0
+    while lo < hi:
+        if lo & 1:
+            yield (level, lo)
+            lo += 1
+        if hi & 1:
+            hi -= 1
+            yield (level, hi)
+        lo >>= 1
+        hi >>= 1
+        level += 1
+
+
+class Adjacency:
+    """The edges out of each node of a graph on integer ids, stored in
+    compressed sparse row form: the nodes adjacent to node i are
+    ids[offsets[i]:offsets[i + 1]]. Edges added and removed since the arrays
+    were built are kept in small overlay sets until the next compaction.
+    """
+
+    def __init__(self):
+        self.offsets = array("q", [0])
+        self.ids = array("q")
+        self.added: Dict[int, Set[int]] = {}
+        self.removed: Dict[int, Set[int]] = {}
+        self.edits = 0
+
+    def get(self, i: int) -> Sequence[int]:
+        """Returns the nodes adjacent to node i."""
+
+        base: Sequence[int] = ()
+        offsets = self.offsets
+        if i + 1 < len(offsets) and offsets[i] != offsets[i + 1]:
+            base = self.ids[offsets[i]:offsets[i + 1]]
+        if not self.removed and not self.added:
+            return base
+        removed, added = self.removed.get(i), self.added.get(i)
+        if not removed and not added:
+            return base
+        adjacent = [j for j in base if j not in removed] if removed \
+            else list(base)
+        if added:
+            adjacent.extend(added)
+        return adjacent
+
+    def add(self, i: int, j: int) -> None:
+        removed = self.removed.get(i)
+        if removed and j in removed:
+            removed.remove(j)
+            if not removed:
+                del self.removed[i]
+        else:
+            self.added.setdefault(i, set()).add(j)
+        self.edits += 1
+
+    def remove(self, i: int, j: int) -> None:
+        added = self.added.get(i)
+        if added and j in added:
+            added.remove(j)
+            if not added:
+                del self.added[i]
+        else:
+            self.removed.setdefault(i, set()).add(j)
+        self.edits += 1
+
+    def compact(self, n: int) -> None:
+        """Rebuilds the arrays for nodes 0 through n - 1 with the overlay
+        merged in."""
+
+        offsets, ids = array("q", [0]), array("q")
+        for i in range(n):
+            ids.extend(self.get(i))
+            offsets.append(len(ids))
+        self.offsets, self.ids = offsets, ids
+        self.added.clear()
+        self.removed.clear()
+        self.edits = 0
+
+
+class DependencyGraph:
+    """The cells of a workbook and the cells each one references directly,
+    kept in compact arrays indexed by integer cell ids rather than in sets on
+    every cell.
+
+    Each edge is stored in both directions, as a child of the cell that is
+    referenced and as a parent of the cell referencing it. Edits go to the
+    overlays, which are merged into the arrays once they have grown by a
+    fraction of the graph's size, so each edit costs amortized constant time.
+
+    An empty location that formulas reference has no Cell, but it is given an
+    id to hold the edges to them, with no cell under it in cells. A cell put
+    at the location takes over the id and its edges, and an emptied cell
+    with dependents leaves its id to the location. The id is released once
+    nothing references the location, and released ids are given out again
+    before new ones, so the arrays don't grow as cells come and go.
+
+    The generation counts the changes to the graph's edges and cells, so
+    orders worked out from the graph can tell whether they are still valid.
+
+    The sheet of every id is kept too, and the edges and cell ranges that
+    cross from one sheet to another are counted in the sheet graph.
+    """
+
+    def __init__(self, min_edits: int = 4096):
+        self.cells: List[Optional[Cell]] = []
+        self.sheets: List[object] = []
+        self.sheet_graph = SheetGraph()
+        self.child_adj = Adjacency()
+        self.parent_adj = Adjacency()
+        self.min_edits = min_edits
+        self.location_ids: Dict[Tuple[object, Tuple[int, int]], int] = {}
+        self.locations: Dict[int, Tuple[object, Tuple[int, int]]] = {}
+        self.free_ids: List[int] = []
+        self.generation = 0
+
+    def new_id(self, sheet: object) -> int:
+        """Returns a released id, or else the next id, for a cell or empty
+        location in sheet."""
+
+        if self.free_ids:
+            i = self.free_ids.pop()
+            self.sheets[i] = sheet
+            return i
+        self.cells.append(None)
+        self.sheets.append(sheet)
+        return len(self.cells) - 1
+
+    def release_id(self, i: int) -> None:
+        """Frees an id that has no edges left, so it can be given out
+        again."""
+
+        self.cells[i] = None
+        self.sheets[i] = None
+        self.free_ids.append(i)
+
+    def add_cell(self, cell: Cell, sheet: object = None) -> None:
+        """Gives a new cell the id of its location in sheet, if formulas
+        reference it, and otherwise a free id."""
+
+        self.generation += 1
+        i = self.location_ids.pop((sheet, cell.loc), None)
+        if i is None:
+            i = self.new_id(sheet)
+        else:
+            del self.locations[i]
+        cell.id = i
+        self.cells[i] = cell
+
+    def remove_cell(self, cell: Cell, sheet: object = None) -> None:
+        """Forgets a cell that has no parents left. If it still has children,
+        its location in sheet keeps its id, and otherwise the id is
+        released."""
+
+        self.generation += 1
+        if sheet is not None and self.has_children(cell):
+            self.cells[cell.id] = None
+            self.location_ids[(sheet, cell.loc)] = cell.id
+            self.locations[cell.id] = (sheet, cell.loc)
+        else:
+            self.release_id(cell.id)
+
+    def location_id(self, sheet: object, loc: Tuple[int, int]) -> int:
+        """Returns the id of the empty location loc in sheet, giving it a
+        free id if it has none."""
+
+        i = self.location_ids.get((sheet, loc))
+        if i is None:
+            i = self.location_ids[(sheet, loc)] = self.new_id(sheet)
+            self.locations[i] = (sheet, loc)
+        return i
+
+    def sheet_locations(self, sheet: object) -> List[int]:
+        """Returns the ids of the empty locations in sheet."""
+
+        return [i for (s, _), i in self.location_ids.items() if s is sheet]
+
+    def cell(self, i: int) -> Cell:
+        """Returns the cell with id i, which must not be an empty
+        location."""
+
+        cell = self.cells[i]
+        if cell is None:
+            raise KeyError(f"No cell has id {i}.")
+        return cell
+
+    def child_ids(self, i: int) -> Sequence[int]:
+        return self.child_adj.get(i)
+
+    def parent_ids(self, i: int) -> Sequence[int]:
+        return self.parent_adj.get(i)
+
+    def children_of(self, i: int) -> Set[Cell]:
+        """Returns the cells referencing the cell or empty location with id
+        i."""
+
+        cells = self.cells
+        return {c for c in (cells[j] for j in self.child_adj.get(i))
+                if c is not None}
+
+    def children(self, cell: Cell) -> Set[Cell]:
+        """Returns the cells referencing the cell."""
+
+        return self.children_of(cell.id)
+
+    def parents(self, cell: Cell) -> Set[Cell]:
+        """Returns the cells the cell references, leaving out the empty
+        locations."""
+
+        cells = self.cells
+        return {c for c in (cells[j] for j in self.parent_adj.get(cell.id))
+                if c is not None}
+
+    def has_children(self, cell: Cell) -> bool:
+        return len(self.child_adj.get(cell.id)) > 0
+
+    def set_parents(self, cell: Cell, parents: Iterable[Cell]) -> None:
+        """Replaces the cells the cell references."""
+
+        self.set_parent_ids(cell, {p.id for p in parents})
+
+    def set_parent_ids(self, cell: Cell, new: Set[int]) -> None:
+        """Replaces the ids of the cells and empty locations the cell
+        references."""
+
+        i = cell.id
+        old = set(self.parent_adj.get(i))
+        if old == new:
+            return
+        self.generation += 1
+        sheets, sheet = self.sheets, self.sheets[i]
+        for j in old - new:
+            self.parent_adj.remove(i, j)
+            self.child_adj.remove(j, i)
+            self.sheet_graph.remove(sheets[j], sheet)
+            if j in self.locations and not self.child_adj.get(j):
+                del self.location_ids[self.locations.pop(j)]
+                self.release_id(j)
+        for j in new - old:
+            self.parent_adj.add(i, j)
+            self.child_adj.add(j, i)
+            self.sheet_graph.add(sheets[j], sheet)
+
+        size = len(self.cells) + len(self.child_adj.ids)
+        if self.child_adj.edits > max(self.min_edits, size // 4):
+            self.child_adj.compact(len(self.cells))
+            self.parent_adj.compact(len(self.cells))
+
+    def set_range_refs(self, cell: Cell,
+                       range_refs: Tuple[Tuple[RangeIndex, Rect], ...]) \
+            -> None:
+        """Replaces the cell ranges the cell reads, given with the index of
+        the sheet each is in, and records the cell in those indexes."""
+
+        if range_refs == cell.range_refs:
+            return
+        self.generation += 1
+        sheet = self.sheets[cell.id]
+        for index, rect in cell.range_refs:
+            index.remove(rect, cell)
+            self.sheet_graph.remove(index.sheet, sheet)
+        for index, rect in range_refs:
+            index.add(rect, cell)
+            self.sheet_graph.add(index.sheet, sheet)
+        cell.range_refs = range_refs
+
+
+class SheetGraph:
+    """The references between sheets: for each sheet, how many edges and
+    cell ranges formulas on each other sheet read from it, and the other way
+    around. It tells which sheets an edit can reach without going through
+    their cells.
+    """
+
+    def __init__(self):
+        self.children: Dict[object, Dict[object, int]] = {}
+        self.parents: Dict[object, Dict[object, int]] = {}
+
+    def add(self, parent: object, child: object) -> None:
+        """Counts a reference from a formula on child to parent."""
+
+        if parent is child or parent is None or child is None:
+            return
+        counts = self.children.setdefault(parent, {})
+        counts[child] = counts.get(child, 0) + 1
+        counts = self.parents.setdefault(child, {})
+        counts[parent] = counts.get(parent, 0) + 1
+
+    def remove(self, parent: object, child: object) -> None:
+        if parent is child or parent is None or child is None:
+            return
+        for edges, a, b in ((self.children, parent, child),
+                            (self.parents, child, parent)):
+            counts = edges[a]
+            counts[b] -= 1
+            if not counts[b]:
+                del counts[b]
+                if not counts:
+                    del edges[a]
+
+    def reachable(self, sheet: object) -> Set[object]:
+        """Returns the sheet and the sheets with formulas that depend on it,
+        directly or through other sheets."""
+
+        found = {sheet}
+        stack = [sheet]
+        while stack:
+            for child in self.children.get(stack.pop(), ()):
+                if child not in found:
+                    found.add(child)
+                    stack.append(child)
+        return found
+
+
+class RangeIndex:
+    """A spatial index of the cell ranges that formulas on any sheet read
+    from one sheet, used to find the formulas that depend on a cell through a
+    range without storing an edge per cell in the range.
+
+    Each range is split into the row blocks covering it, and each of those
+    into the column blocks covering it. Looking up a cell checks the one row
+    block per level holding it, and within those the one column block per
+    level, so adding a range and looking up a cell both take time independent
+    of the range's area and of the other ranges in the sheet.
+    """
+
+    def __init__(self, cells: Optional[Dict[Tuple[int, int], Cell]] = None,
+                 sheet: object = None):
+        """Initialize an empty index over the cells of sheet, keyed on their
+        (col, row) location."""
+
+        self.sheet = sheet
+        self.cells = cells if cells is not None else {}
+        self.dependents: Dict[Rect, Set[Cell]] = {}
+        self.blocks: Dict[Tuple[int, int],
+                          Dict[Tuple[int, int], Set[Rect]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.dependents)
+
+    @staticmethod
+    def rect_blocks(rect: Rect) \
+            -> Iterator[Tuple[Tuple[int, int], Tuple[int, int]]]:
+        for row_block in span_blocks(rect[1], rect[3]):
+            for col_block in span_blocks(rect[0], rect[2]):
+                yield row_block, col_block
+
+    def add(self, rect: Rect, cell: Cell) -> None:
+        """Records that the cell's formula reads the range rect."""
+
+        if rect not in self.dependents:
+            self.dependents[rect] = set()
+            for row_block, col_block in self.rect_blocks(rect):
+                self.blocks.setdefault(row_block, {}) \
+                    .setdefault(col_block, set()).add(rect)
+        self.dependents[rect].add(cell)
+
+    def remove(self, rect: Rect, cell: Cell) -> None:
+        """Records that the cell's formula no longer reads the range rect."""
+
+        cells = self.dependents.get(rect)
+        if cells is None:
+            return
+        cells.discard(cell)
+        if cells:
+            return
+
+        del self.dependents[rect]
+        for row_block, col_block in self.rect_blocks(rect):
+            cols = self.blocks[row_block]
+            cols[col_block].discard(rect)
+            if not cols[col_block]:
+                del cols[col_block]
+                if not cols:
+                    del self.blocks[row_block]
+
+    def ranges_at(self, col: int, row: int) -> Iterator[Rect]:
+        """Yields the ranges formulas read that contain the cell at
+        (col, row)."""
+
+        for row_level in range(ROW_LEVELS):
+            cols = self.blocks.get((row_level, row >> row_level))
+            if not cols:
+                continue
+            for col_level in range(COL_LEVELS):
+                yield from cols.get((col_level, col >> col_level), ())
+
+    def lookup(self, col: int, row: int) -> Set[Cell]:
+        """Returns the cells with formulas reading a range containing the cell
+        at (col, row)."""
+
+        found: Set[Cell] = set()
+        for rect in self.ranges_at(col, row):
+            found.update(self.dependents[rect])
+        return found
+
+    def cells_in(self, rect: Rect) -> Iterator[Cell]:
+        """Yields the existing cells in the range rect, checking whichever is
+        smaller of the range's locations and the sheet's cells."""
+
+        left, top, right, bottom = rect
+        if (right - left + 1) * (bottom - top + 1) <= len(self.cells):
+            for row in range(top, bottom + 1):
+                for col in range(left, right + 1):
+                    cell = self.cells.get((col, row))
+                    if cell is not None:
+                        yield cell
+        else:
+            for (col, row), cell in list(self.cells.items()):
+                if left <= col <= right and top <= row <= bottom:
+                    yield cell
+
+    def all_dependents(self) -> Set[Cell]:
+        """Returns every cell with a formula reading a range in the sheet."""
+
+        found: Set[Cell] = set()
+        for cells in self.dependents.values():
+            found.update(cells)
+        return found
+
+
+class Condensation:
+    """The cells that depend on a cell, with the strongly connected
+    components among them condensed into single nodes: the components that
+    are cycles, whose cells are circular references, and the other cells in
+    a topological order of the components. Editing a cell near a cycle can
+    reuse it for as long as the edges are unchanged, rather than looking for
+    the cycles again.
+    """
+
+    def __init__(self, components: List[List[int]],
+                 children: Callable[[int], Iterable[int]],
+                 cell: Callable[[int], Cell]):
+        """Initialize the condensation of the components, given by the ids of
+        their cells, that children gives the edges between and cell gives the
+        cells of."""
+
+        component_of = {i: n for n, component in enumerate(components)
+                        for i in component}
+        edges: List[Set[int]] = [set() for _ in components]
+        parents = [0] * len(components)
+        on_cycle = [False] * len(components)
+        for n, component in enumerate(components):
+            for i in component:
+                for child in children(i):
+                    m = component_of[child]
+                    if m == n:
+                        # A cell reading a range containing itself is a cycle
+                        on_cycle[n] = True
+                    elif m not in edges[n]:
+                        edges[n].add(m)
+                        parents[m] += 1
+        self.cycles: List[List[Cell]] = [
+            [cell(i) for i in component]
+            for n, component in enumerate(components) if on_cycle[n]]
+
+        # Order the components with Kahn's algorithm, keeping only the cells
+        # that are not on cycles
+        self.cells: List[Cell] = []
+        ready = [n for n, count in enumerate(parents) if not count]
+        while ready:
+            n = ready.pop()
+            if not on_cycle[n]:
+                self.cells.append(cell(components[n][0]))
+            for m in edges[n]:
+                parents[m] -= 1
+                if not parents[m]:
+                    ready.append(m)
+
+
+class OrderCache:
+    """A bounded, least-recently-used cache of the cells to recalculate when
+    a cell changes: the cell and every cell depending on it, in topological
+    order, or their Condensation if they contain cycles. Each order is
+    stamped with the generation of the dependency graph it was read from,
+    and is only used while the graph's edges are unchanged, so cells that
+    are edited over and over skip the search.
+    """
+
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self.orders: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, cell: Cell, generation: int) \
+            -> Optional[Union[List[Cell], Condensation]]:
+        """Returns the order for the cell if it was stored at the given
+        generation. The list is shared, and must not be changed."""
+
+        entry = self.orders.get(cell)
+        if entry is not None and entry[0] == generation:
+            self.hits += 1
+            self.orders.move_to_end(cell)
+            return entry[1]
+        self.misses += 1
+        if entry is not None:
+            del self.orders[cell]
+        return None
+
+    def put(self, cell: Cell, generation: int,
+            cells: Union[List[Cell], Condensation]) -> None:
+        if self.maxsize <= 0:
+            return
+        self.orders[cell] = (generation, cells)
+        self.orders.move_to_end(cell)
+        if len(self.orders) > self.maxsize:
+            self.orders.popitem(last=False)
+            self.evictions += 1
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self) -> None:
+        self.orders.clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+class OrphanIndex:
+    """The cells whose formulas reference sheets that don't exist, indexed
+    on the lowercase names of the missing sheets, so a sheet that is created
+    or renamed finds the cells referencing its name without checking every
+    cell that references a missing sheet.
+    """
+
+    def __init__(self):
+        self.cells: Dict[str, Set[Cell]] = {}
+        self.names: Dict[Cell, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, cell: Cell) -> bool:
+        return cell in self.names
+
+    def add(self, cell: Cell, sheet_names: Iterable[str]) -> None:
+        """Records that the cell's formula references the missing sheets,
+        named as written in the formula."""
+
+        for name in sheet_names:
+            name = name.translate({39: None}).lower()
+            self.cells.setdefault(name, set()).add(cell)
+            self.names.setdefault(cell, set()).add(name)
+
+    def remove(self, cell: Cell) -> None:
+        """Forgets the missing sheets the cell's formula referenced."""
+
+        for name in self.names.pop(cell, ()):
+            cells = self.cells[name]
+            cells.discard(cell)
+            if not cells:
+                del self.cells[name]
+
+    def pop(self, sheet_name: str) -> Set[Cell]:
+        """Returns the cells referencing the sheet name, in any case, and
+        forgets that they do."""
+
+        name = sheet_name.lower()
+        cells = self.cells.pop(name, set())
+        for cell in cells:
+            names = self.names[cell]
+            names.discard(name)
+            if not names:
+                del self.names[cell]
+        return cells
+
+
+class TopologicalOrder:
+    """Keeps each cell's position in a topological order of the dependency
+    graph (cell.order, lower first) as formulas change, so recalculating a
+    cell's dependents doesn't need a cycle check and a sort of its own.
+
+    Edges are added with the Pearce-Kelly algorithm: edges that already go
+    forward in the order cost nothing, and otherwise only the cells between
+    the edge's ends in the order are searched and given each other's
+    positions. An edge that closes a cycle can't be put in order and is left
+    going backward; any recalculation that runs into such an edge falls back
+    to finding the cycles in its cells.
+    """
+
+    def __init__(self, children: Callable[[Cell], Set[Cell]],
+                 parents: Callable[[Cell], Set[Cell]]):
+        """Initialize an order over the graph whose edges run from each cell
+        to its children, and from each cell to its parents in reverse."""
+
+        self.children = children
+        self.parents = parents
+        self.lowest = 0
+        self.highest = 0
+
+    def add_cell(self, cell: Cell) -> None:
+        """Puts a new cell, which has no parents yet, first in the order."""
+
+        self.lowest -= 1
+        cell.order = self.lowest
+
+    def add_edges(self, cell: Cell, parents: Iterable[Cell]) -> bool:
+        """Reorders cells so that the cell comes after each of its parents.
+        Returns False if an edge from the parents closes a cycle.
+        """
+
+        if not self.children(cell):
+            # Nothing depends on the cell, so it can go last
+            self.highest += 1
+            cell.order = self.highest
+            return cell not in parents
+
+        parents = set(parents)
+        behind = [p for p in parents if p.order >= cell.order]
+        if not behind:
+            return True
+
+        # Cells after the cell that come before the furthest parent; reaching
+        # a parent means there's a cycle
+        upper = max(p.order for p in behind)
+        forward = self.search([cell], self.children,
+                              lambda c: c.order <= upper)
+        if forward & parents:
+            return False
+        # Cells before the parents that come after the cell
+        lower = cell.order
+        backward = self.search(behind, self.parents,
+                               lambda c: c.order > lower)
+        if forward & backward:
+            return False
+
+        # Move the parents' ancestors ahead of the cell's descendants, using
+        # the positions they already had between them
+        cells = sorted(backward, key=lambda c: c.order) + \
+            sorted(forward, key=lambda c: c.order)
+        for c, order in zip(cells, sorted(c.order for c in cells)):
+            c.order = order
+        return True
+
+    @staticmethod
+    def search(start: Iterable[Cell], edges: Callable[[Cell], Set[Cell]],
+               keep: Callable[[Cell], bool]) -> Set[Cell]:
+        """Returns the cells reachable from start along edges, only going
+        through cells for which keep returns True."""
+
+        found = set(start)
+        stack = list(found)
+        while stack:
+            for c in edges(stack.pop()):
+                if c not in found and keep(c):
+                    found.add(c)
+                    stack.append(c)
+        return found
+
+    def cone(self, start: Iterable[Cell]) -> Optional[List[Cell]]:
+        """Returns the cells in start and every cell that depends on them, in
+        order. Returns None if an edge between them goes backward in the
+        order, which happens when they may contain a cycle.
+        """
+
+        seen = set(start)
+        heap = [(c.order, c) for c in seen]
+        heapify(heap)
+        cells = []
+        while heap:
+            order, c = heappop(heap)
+            cells.append(c)
+            for child in self.children(c):
+                if child.order <= order:
+                    return None
+                if child not in seen:
+                    seen.add(child)
+                    heappush(heap, (child.order, child))
+        return cells
+
+    def repair(self, cells: Iterable[Cell]) -> None:
+        """Puts back in order any edges out of the given cells that go
+        backward, once the cycles they closed have been broken."""
+
+        for c in cells:
+            for child in list(self.children(c)):
+                if child.order <= c.order:
+                    self.add_edges(child, [c])
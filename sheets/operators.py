@@ -0,0 +1,168 @@
+from .error import CellError, CellErrorType, error_str, error_desc
+from . import util
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Callable, List, Optional
+import re
+
+
+NUMBER_REGEX = re.compile(r'^[+-]?((\d+(\.\d*)?)|(\.\d+))$')
+
+
+def to_decimal(val: Any) -> Optional[Decimal]:
+    """Converts an arithmetic operand to a decimal. Empty and falsy operands
+    count as 0; returns None if the operand cannot be converted.
+    """
+
+    val = val if val else Decimal("0")
+    if type(val) is Decimal:
+        return val
+    # Use regex to check if the expression can be converted into a decimal.
+    if type(val) is str and NUMBER_REGEX.match(val.strip()):
+        return Decimal(val.strip())
+    return None
+
+
+@lru_cache(maxsize=4096)
+def number(text: str) -> Decimal:
+    return util.strip_trailing_zeroes(Decimal(text))
+
+
+def string(text: str) -> Any:
+    s = text[1:-1]
+    error_type = error_str.get(s)
+    if error_type is not None:
+        return CellError(error_type, error_desc[error_type])
+    return s
+
+
+def boolean(text: str) -> bool:
+    return text.lower() == "true"
+
+
+def error(text: str) -> CellError:
+    # Error literals in formulas are matched in any case
+    error_type = error_str[text.upper()]
+    return CellError(error_type, error_desc[error_type])
+
+
+def apply_chain(apply: Callable[[Any, str, Any], Any],
+                args: List[Any]) -> Any:
+    """Applies a chain of operators at one precedence level, given as the
+    operands and operators [x, op, y, op, z, ...], from left to right."""
+
+    val = args[0]
+    for i in range(1, len(args), 2):
+        val = apply(val, str(args[i]), args[i + 1])
+    return val
+
+
+def add_expr(lhs: Any, op: str, rhs: Any) -> Any:
+    if isinstance(lhs, CellError):
+        return lhs
+    if isinstance(rhs, CellError):
+        return rhs
+
+    lhs, rhs = to_decimal(lhs), to_decimal(rhs)
+    if lhs is None or rhs is None:
+        # Can't be parsed if it isn't a decimal and can't be converted.
+        return CellError(CellErrorType.TYPE_ERROR,
+                         error_desc.get(CellErrorType.TYPE_ERROR))
+
+    if op == "+":
+        return lhs + rhs
+    return lhs - rhs
+
+
+def mul_expr(lhs: Any, op: str, rhs: Any) -> Any:
+    if isinstance(lhs, CellError):
+        return lhs
+    if isinstance(rhs, CellError):
+        return rhs
+
+    lhs, rhs = to_decimal(lhs), to_decimal(rhs)
+    if lhs is None or rhs is None:
+        return CellError(CellErrorType.TYPE_ERROR,
+                         error_desc.get(CellErrorType.TYPE_ERROR))
+
+    if op == "*":
+        return lhs * rhs
+    elif rhs == 0:
+        return CellError(CellErrorType.DIVIDE_BY_ZERO,
+                         error_desc.get(CellErrorType.DIVIDE_BY_ZERO))
+    return lhs / rhs
+
+
+def unary_op(op: str, val: Any) -> Any:
+    if isinstance(val, CellError):
+        return val
+
+    if op == "-":
+        return -val
+    return val
+
+
+def concat_expr(lhs: Any, rhs: Any) -> Any:
+    if isinstance(lhs, CellError):
+        return lhs
+    if isinstance(rhs, CellError):
+        return rhs
+
+    lhs = str(lhs) if lhs else ""
+    rhs = str(rhs) if rhs else ""
+
+    # Boolean to string conversion
+    if isinstance(lhs, bool):
+        lhs = str(lhs).upper()
+    if isinstance(rhs, bool):
+        rhs = str(rhs).upper()
+
+    return lhs + rhs
+
+
+def compare_expr(lhs: Any, op: str, rhs: Any) -> Any:
+    if isinstance(lhs, CellError):
+        return lhs
+    if isinstance(rhs, CellError):
+        return rhs
+
+    if lhs is None and rhs is None:
+        return op in ["=", "==", ">=", "<="]
+    elif lhs is None:
+        if isinstance(rhs, str):
+            lhs = ""
+        elif isinstance(rhs, Decimal):
+            lhs = Decimal("0")
+        elif isinstance(rhs, bool):
+            lhs = False
+    elif rhs is None:
+        if isinstance(lhs, str):
+            rhs = ""
+        elif isinstance(lhs, Decimal):
+            rhs = Decimal("0")
+        elif isinstance(lhs, bool):
+            rhs = False
+
+    if isinstance(lhs, str):
+        lhs = lhs.lower()
+    if isinstance(rhs, str):
+        rhs = rhs.lower()
+
+    if op in ["=", "=="]:
+        return lhs == rhs and isinstance(lhs, type(rhs))
+    elif op in ["<>", "!="]:
+        return lhs != rhs or not isinstance(lhs, type(rhs))
+
+    priorities = {bool: 3, str: 2, Decimal: 1}
+    if not isinstance(lhs, type(rhs)):
+        lhs = priorities[type(lhs)]
+        rhs = priorities[type(rhs)]
+
+    if op == "<":
+        return lhs < rhs
+    elif op == ">":
+        return lhs > rhs
+    elif op == "<=":
+        return lhs <= rhs
+    elif op == ">=":
+        return lhs >= rhs
@@ -0,0 +1,187 @@
+from __future__ import annotations
+from .cell import Cell, CellType
+from .compiler import EvalContext, evaluate_template
+from .error import CellError
+from .template import template_cache
+from . import util
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+
+# Functions that pick the cells they read while being evaluated, so the
+# values they read can't be shipped to a worker ahead of time.
+DYNAMIC_FUNCTIONS = {"INDIRECT"}
+
+# A cell's (sheet name, col, row), as the values shipped to workers are keyed.
+CellKey = Tuple[str, int, int]
+
+# A formula for a worker to evaluate: (sheet name, col, row, formula).
+Task = Tuple[str, int, int, str]
+
+
+class Snapshot:
+    """The values of the cells a group of formulas reads, standing in for the
+    workbook while the formulas are evaluated in a worker process."""
+
+    def __init__(self, sheet_names: Dict[str, str],
+                 values: Dict[CellKey, Any]):
+        self.sheet_names_lower_to_orig = sheet_names
+        self.values = values
+
+    def get_cell_value(self, sheet_name: str, location: str) -> Any:
+        sheet_name = sheet_name.translate({39: None}).lower()
+        if sheet_name not in self.sheet_names_lower_to_orig:
+            raise KeyError("Sheet name not found.")
+        col, row = util.quantify_cell_loc(location)
+        return self.values.get(
+            (self.sheet_names_lower_to_orig[sheet_name], col, row))
+
+
+def evaluate_tasks(tasks: List[Task], sheet_names: Dict[str, str],
+                   values: Dict[CellKey, Any]) \
+        -> List[Tuple[Any, Set[str]]]:
+    """Evaluates formulas in a worker process, returning the value of each
+    and the names of the missing sheets it referenced. Closures can't be
+    pickled, so each worker compiles formulas itself, once per template.
+    """
+
+    ctx = EvalContext(Snapshot(sheet_names, values))
+    results = []
+    for sheet_name, col, row, formula in tasks:
+        template = template_cache.get(formula, (col, row))
+        ctx.set_sheet_name(sheet_name)
+        ctx.set_offset(*template.offset(col, row))
+        results.append((evaluate_template(template, ctx),
+                        set(ctx.invalid_sheet_refs)))
+        ctx.invalid_sheet_refs.clear()
+    return results
+
+
+class ParallelEvaluator:
+    """Evaluates large sets of cells across a pool of worker processes.
+
+    The cells are split into topological levels, where no cell reads another
+    cell in its level. Each level's formulas are divided among the workers,
+    along with the values of the cells they read, and the results are stored
+    before the next level starts. Levels with fewer than min_cells formulas,
+    and formulas calling DYNAMIC_FUNCTIONS, are evaluated in the workbook.
+    """
+
+    def __init__(self, workers: int, min_cells: int = 1000):
+        self.workers = workers
+        self.min_cells = min_cells
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+    def shutdown(self) -> None:
+        """Stops the worker processes, if they were started."""
+
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    @staticmethod
+    def can_ship(cell: Cell) -> bool:
+        return cell.template is not None and \
+            not cell.template.funcs & DYNAMIC_FUNCTIONS
+
+    @staticmethod
+    def levels(wb, cells: Iterable[Cell]) -> List[List[Cell]]:
+        """Groups cells, given in topological order, by the length of the
+        longest path to them from the other cells. Cells are matched by id,
+        so a cell reading an emptied cell among them, whose id its location
+        has kept, still comes after it."""
+
+        level: Dict[int, int] = {}
+        levels: List[List[Cell]] = []
+        for cell in cells:
+            lvl = 0
+            parent_ids = list(wb.graph.parent_ids(cell.id))
+            for index, rect in cell.range_refs:
+                parent_ids.extend(c.id for c in index.cells_in(rect))
+            for i in parent_ids:
+                if i in level:
+                    lvl = max(lvl, level[i] + 1)
+            level[cell.id] = lvl
+            if lvl == len(levels):
+                levels.append([])
+            levels[lvl].append(cell)
+        return levels
+
+    def evaluate(self, wb, cells: Iterable[Cell],
+                 initial_vals: Dict[Cell, Any],
+                 roots: Optional[Iterable[Cell]] = None) -> None:
+        """Evaluates the cells of the workbook, given in topological order,
+        recording the values they had in initial_vals. If roots is given,
+        only cells reading a changed cell are evaluated, as in
+        Workbook.evaluate_cells.
+        """
+
+        root_set: Set[Cell] = set()
+        scheduled = None
+        if roots is not None:
+            root_set = set(roots)
+            scheduled = set(root_set)
+
+        for level in self.levels(wb, cells):
+            if scheduled is not None:
+                level = [c for c in level
+                         if util.needs_evaluation(c, scheduled)]
+            vals = [c.val for c in level]
+            self.evaluate_level(wb, level, initial_vals)
+            if scheduled is not None:
+                for cell, val in zip(level, vals):
+                    if cell in root_set or \
+                            util.value_changed(val, cell.val):
+                        scheduled.update(wb.cell_children(cell))
+
+    def evaluate_level(self, wb, level: List[Cell],
+                       initial_vals: Dict[Cell, Any]) -> None:
+        """Evaluates cells that don't read each other, shipping their
+        formulas to the workers if there are enough of them."""
+
+        for cell in level:
+            if cell not in initial_vals:
+                initial_vals[cell] = cell.val
+
+        tasks: Dict[Cell, Task] = {
+            c: (c.sheet_name, *c.loc, c.contents) for c in level
+            if c.contents and c.contents[0] == "=" and self.can_ship(c)}
+        shipped = list(tasks)
+        if len(shipped) < self.min_cells:
+            wb.evaluate_serial(level, initial_vals)
+            return
+
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers)
+        size = -(-len(shipped) // self.workers)
+        chunks = [shipped[i:i + size] for i in range(0, len(shipped), size)]
+        sheet_names = dict(wb.sheet_names_lower_to_orig)
+        futures = [self.pool.submit(evaluate_tasks,
+                                    [tasks[c] for c in chunk],
+                                    sheet_names, self.values(wb, chunk))
+                   for chunk in chunks]
+
+        for chunk, future in zip(chunks, futures):
+            for cell, (val, invalid_sheet_refs) in zip(chunk,
+                                                       future.result()):
+                cell.val = val
+                wb.dirty_cells.discard(cell)
+                if isinstance(val, CellError):
+                    cell.val_type = CellType.ERROR
+                if wb.context.range_values:
+                    wb.invalidate_ranges(cell)
+                if invalid_sheet_refs:
+                    wb.orphans.add(cell, invalid_sheet_refs)
+
+        wb.evaluate_serial([c for c in level if c not in tasks],
+                           initial_vals)
+
+    @staticmethod
+    def values(wb, cells: List[Cell]) -> Dict[CellKey, Any]:
+        """Returns the values of the cells that the cells read."""
+
+        values = {}
+        for cell in cells:
+            for parent in wb.cell_parents(cell):
+                values[(parent.sheet_name, *parent.loc)] = parent.val
+        return values
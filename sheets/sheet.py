@@ -2,6 +2,7 @@ from typing import Optional, Tuple, Dict, List
 from heapq import heappush, heappop
 from collections import Counter
 from .cell import Cell
+from .graph import DependencyGraph, RangeIndex
 from . import util
 
 
@@ -16,24 +17,31 @@ class Sheet:
         loc_to_cell (dict): A dictionary mapping from cell location to tuple
         containing the cell's content, displayed value, and the type of the
         displayed value.
+        range_index (RangeIndex): The cell ranges in this sheet that formulas
+        read, and the cells whose formulas read them.
+        graph (DependencyGraph): The workbook's graph, which the sheet's cells
+        are added to.
     """
 
-    def __init__(self, name: str):
+    def __init__(self, name: str, graph: DependencyGraph):
         """Initialize a new empty spreadsheet."""
 
         self.name = name
+        self.graph = graph
         self.loc_to_cell: Dict[Tuple[int, int], Cell] = {}
         self.col_counter: Dict[int, int] = Counter()
         self.row_counter: Dict[int, int] = Counter()
         self.col_max_heap: List[int] = []
         self.row_max_heap: List[int] = []
+        self.range_index = RangeIndex(self.loc_to_cell, self)
 
     def cell_from_loc(self, loc: str) -> Optional[Cell]:
         """Given cell location, returns cell instance."""
 
         return self.loc_to_cell.get(util.quantify_cell_loc(loc))
 
-    def update_cell(self, loc: str, contents: Optional[str], parser) -> Cell:
+    def update_cell(self, loc: str, contents: Optional[str],
+                    templates) -> Cell:
         """Update a cell at a specified location.
         The user specifies a cell and the given value is entered into that
         cell. The previous value is overwritten and the spreadsheet is updated
@@ -41,14 +49,15 @@ class Sheet:
         Args:
             loc (str): The location being updated.
             contents Optional[str]: The value to be inserted.
+            templates (TemplateCache): Where formula templates are looked up.
         Returns:
             Cell: the cell instance that was created or changed.
         """
 
         loc_col, loc_row = util.quantify_cell_loc(loc)
         clean_loc = (loc_col, loc_row)
-        clean_contents, val, val_type, pt = util.parse_contents(contents,
-                                                                parser)
+        clean_contents, val, val_type, template = util.parse_contents(
+            contents, clean_loc, templates)
 
         created_new_cell = False
         return_cell = None
@@ -58,39 +67,42 @@ class Sheet:
                 cur_cell.contents = clean_contents
                 cur_cell.val = val
                 cur_cell.val_type = val_type
-                cur_cell.pt = pt
+                cur_cell.template = template
                 return_cell = cur_cell
             else:
                 return_cell = Cell(loc_col, loc_row, clean_contents, val,
-                                   val_type, self.name, pt)
+                                   val_type, self.name, template)
+                self.graph.add_cell(return_cell, self)
                 self.loc_to_cell[clean_loc] = return_cell
                 created_new_cell = True
         else:
             # No contents, so we empty the cell (return for topo-sort)
             if clean_loc in self.loc_to_cell:
                 return_cell = self.loc_to_cell[clean_loc]
-                return_cell.make_empty()
+                return_cell.make_empty(self.graph)
 
-                # Delete cell from all records
-                if len(return_cell.children) == 0:
-                    self.loc_to_cell.pop(clean_loc)
+                # Delete cell from all records; cells referencing it now
+                # reference the empty location
+                self.loc_to_cell.pop(clean_loc)
+                self.graph.remove_cell(return_cell, self)
 
-                    # Update the col/row counters and heaps
-                    self.col_counter[loc_col] -= 1
-                    self.row_counter[loc_row] -= 1
-                    if self.col_counter[loc_col] == 0:
-                        self.col_counter.pop(loc_col)
-                    if self.row_counter[loc_row] == 0:
-                        self.row_counter.pop(loc_row)
-                    while self.col_max_heap and \
-                            -self.col_max_heap[0] not in self.col_counter:
-                        heappop(self.col_max_heap)
-                    while self.row_max_heap and \
-                            -self.row_max_heap[0] not in self.row_counter:
-                        heappop(self.row_max_heap)
+                # Update the col/row counters and heaps
+                self.col_counter[loc_col] -= 1
+                self.row_counter[loc_row] -= 1
+                if self.col_counter[loc_col] == 0:
+                    self.col_counter.pop(loc_col)
+                if self.row_counter[loc_row] == 0:
+                    self.row_counter.pop(loc_row)
+                while self.col_max_heap and \
+                        -self.col_max_heap[0] not in self.col_counter:
+                    heappop(self.col_max_heap)
+                while self.row_max_heap and \
+                        -self.row_max_heap[0] not in self.row_counter:
+                    heappop(self.row_max_heap)
             else:
                 return_cell = Cell(loc_col, loc_row, clean_contents, val,
-                                   val_type, self.name, pt)
+                                   val_type, self.name, template)
+                self.graph.add_cell(return_cell, self)
                 self.loc_to_cell[clean_loc] = return_cell
                 created_new_cell = True
 
@@ -0,0 +1,240 @@
+from . import util
+from collections import OrderedDict
+from copy import deepcopy
+from typing import Any, Callable, List, Optional, Set, Tuple
+from lark import Visitor, Tree, Token
+import re
+
+
+# Splits formula text into the pieces that matter for canonicalization.
+# String literals, sheet names and function names are matched so that they
+# are skipped over; only the last alternative matches a cell reference.
+FORMULA_TOKEN_REGEX = re.compile(
+    r'("[^"]*")'
+    r"|('[^']*'\s*!)"
+    r"|([A-Za-z_][A-Za-z0-9_]*\s*[!(])"
+    r"|(?<![A-Za-z0-9_$])(\$?[A-Za-z]+\$?[1-9][0-9]*)(?![A-Za-z0-9_])"
+)
+
+
+def canonicalize(formula: str, loc: Tuple[int, int]) -> Optional[tuple]:
+    """Returns the relative-offset (R1C1) form of a formula entered at the
+    given location, which is the same for every cell a formula is filled or
+    copied into. The result is a tuple of the text between cell references
+    and one (absolute column, column, absolute row, row) tuple per reference,
+    where relative components are stored as offsets from loc.
+
+    Returns None if the formula refers to a location off the sheet, since
+    moving such a reference doesn't behave like an offset.
+    """
+
+    parts: List[Any] = []
+    pos = 0
+    for m in FORMULA_TOKEN_REGEX.finditer(formula):
+        if not m.group(4):
+            continue
+        col, row, abs_col, abs_row = util.split_cell_ref(m.group(4))
+        if col > util.MAX_COL or row > util.MAX_ROW:
+            return None
+        parts.append(formula[pos:m.start()])
+        parts.append((abs_col, col if abs_col else col - loc[0],
+                      abs_row, row if abs_row else row - loc[1]))
+        pos = m.end()
+    parts.append(formula[pos:])
+    return tuple(parts)
+
+
+class VisitRefs(Visitor):
+    """A Lark Visitor that stores a list of CELLREFs found in the tree, a
+    separate list of the (start, end) CELLREFs of cell ranges, and the set of
+    (upper-case) function names called. Refs without a sheet name are stored
+    with a sheet name of None.
+    """
+    def __init__(self):
+        self.refs = []
+        self.ranges = []
+        self.funcs = set()
+
+    def reset_refs(self):
+        self.refs = []
+        self.ranges = []
+        self.funcs = set()
+
+    def func(self, tree):
+        self.funcs.add(str(tree.children[0]).upper())
+
+    def cell(self, tree):
+        if len(tree.children) == 2:
+            self.refs.append((tree.children[0].lower(),
+                              tree.children[1].lower()))
+        else:
+            self.refs.append((None, tree.children[0].lower()))
+
+    def cell_range(self, tree):
+        sheet_name = tree.children[0].lower() \
+            if len(tree.children) == 3 else None
+        self.ranges.append((sheet_name, tree.children[-2].lower(),
+                            tree.children[-1].lower()))
+
+
+class MoveFormula(Visitor):
+    """A Lark Visitor that updates a cell's formula refs when it is moved."""
+    def __init__(self):
+        self._d_cols = 0
+        self._d_rows = 0
+
+    def set_deltas(self, d_cols, d_rows):
+        self._d_cols = d_cols
+        self._d_rows = d_rows
+
+    def _to_ref_error(self, tree):
+        tree.data = "error"
+        tree.children = [Token("ERROR_VALUE", "#REF!")]
+
+    def cell(self, tree):
+        i = len(tree.children) - 1
+        try:
+            tree.children[i] = Token("CELLREF", util.shift_cell_ref(
+                tree.children[i], self._d_cols, self._d_rows))
+        except ValueError:
+            self._to_ref_error(tree)
+
+    def cell_range(self, tree):
+        try:
+            moved = [util.shift_cell_ref(ref, self._d_cols, self._d_rows)
+                     for ref in tree.children[-2:]]
+        except ValueError:
+            self._to_ref_error(tree)
+            return
+        tree.children[-2:] = [Token("CELLREF", ref) for ref in moved]
+
+
+class FormulaTemplate:
+    """A formula parsed once and shared by every cell whose formula has the
+    same relative-offset form. The parse tree is the formula as entered at the
+    anchor, the location of the first cell that used the template; a cell at
+    another location reads its references moved by its offset from there.
+    """
+
+    def __init__(self, formula: str, anchor: Tuple[int, int]):
+        self.anchor = anchor
+        self.tree: Optional[Tree] = None
+        self.error: Optional[Exception] = None
+        self.compiled: Optional[Callable] = None
+        try:
+            self.tree = util.get_parser().parse(formula)
+        except Exception as e:
+            self.error = e
+
+        self.refs: List[Tuple[Optional[str], str]] = []
+        self.ranges: List[Tuple[Optional[str], str, str]] = []
+        self.funcs: Set[str] = set()
+        if self.tree:
+            visitor = VisitRefs()
+            visitor.visit(self.tree)
+            self.refs = visitor.refs
+            self.ranges = visitor.ranges
+            self.funcs = visitor.funcs
+
+    def offset(self, col: int, row: int) -> Tuple[int, int]:
+        """Returns how far a cell at (col, row) is from the anchor."""
+
+        return (col - self.anchor[0], row - self.anchor[1])
+
+    def refs_at(self, col: int, row: int) -> List[Tuple[Optional[str], str]]:
+        """Returns the (sheet name, location) references made by the formula
+        in a cell at (col, row). Refs that end up off the sheet are dropped.
+        """
+
+        d_cols, d_rows = self.offset(col, row)
+        if not d_cols and not d_rows:
+            return self.refs
+        refs = []
+        for sheet_name, ref in self.refs:
+            try:
+                refs.append((sheet_name, util.shift_cell_ref(
+                    ref, d_cols, d_rows).replace("$", "")))
+            except ValueError:
+                continue
+        return refs
+
+    def ranges_at(self, col: int, row: int) \
+            -> List[Tuple[Optional[str], str, str]]:
+        """Returns the (sheet name, start, end) cell ranges read by the
+        formula in a cell at (col, row), like refs_at.
+        """
+
+        d_cols, d_rows = self.offset(col, row)
+        if not d_cols and not d_rows:
+            return self.ranges
+        ranges = []
+        for sheet_name, start, end in self.ranges:
+            try:
+                ranges.append((sheet_name,
+                               util.shift_cell_ref(start, d_cols, d_rows),
+                               util.shift_cell_ref(end, d_cols, d_rows)))
+            except ValueError:
+                continue
+        return ranges
+
+    def tree_at(self, col: int, row: int) -> Optional[Tree]:
+        """Returns a copy of the parse tree as the formula would be written in
+        a cell at (col, row). References that would be moved off the sheet
+        become #REF! errors, as when moving cells.
+        """
+
+        if self.tree is None:
+            return None
+        tree = deepcopy(self.tree)
+        d_cols, d_rows = self.offset(col, row)
+        if d_cols or d_rows:
+            mover = MoveFormula()
+            mover.set_deltas(d_cols, d_rows)
+            mover.visit(tree)
+        return tree
+
+
+class TemplateCache:
+    """A bounded, least-recently-used cache of formula templates keyed on the
+    formula's relative-offset form. Cells keep their template even after it
+    has been evicted; eviction only stops new cells from sharing it.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self.templates: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, formula: str, loc: Tuple[int, int]) -> FormulaTemplate:
+        """Returns the template for a formula entered at loc, parsing the
+        formula only if no cell has used an equivalent formula recently.
+        """
+
+        key = canonicalize(formula, loc)
+        if key is not None and key in self.templates:
+            self.hits += 1
+            self.templates.move_to_end(key)
+            return self.templates[key]
+
+        self.misses += 1
+        template = FormulaTemplate(formula, loc)
+        if key is not None and self.maxsize > 0:
+            self.templates[key] = template
+            if len(self.templates) > self.maxsize:
+                self.templates.popitem(last=False)
+                self.evictions += 1
+        return template
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self) -> None:
+        self.templates.clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+# Templates hold no workbook state, so all workbooks share one cache.
+template_cache = TemplateCache()
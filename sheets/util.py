@@ -1,15 +1,44 @@
 from .error import CellError, CellErrorType, error_str
 from .cell import Cell, CellType
+import os
 import re
 import decimal
-from functools import reduce
+from functools import reduce, lru_cache
 from collections import deque, defaultdict
-from typing import Tuple, Any, Optional, List, Set, Dict, Generator
+from typing import Tuple, Any, Optional, List, Set, Dict, Generator, \
+    Callable, Iterable
+from lark import Lark
+from lark.reconstruct import Reconstructor
 
 
 MAX_COL = 475254
 MAX_ROW = 9999
 
+CELLREF_REGEX = re.compile(r"^(\$?)([A-Za-z]+)(\$?)([1-9][0-9]*)$")
+
+GRAMMAR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "formulas.lark")
+
+
+@lru_cache(maxsize=None)
+def get_parser() -> Lark:
+    """Returns the formula parser shared by every workbook in the process.
+    The grammar is compiled once into an LALR table, which Lark also caches
+    on disk so later processes skip the table construction entirely.
+    """
+
+    return Lark.open(GRAMMAR_PATH, start="formula", parser="lalr",
+                     maybe_placeholders=False, cache=True)
+
+
+@lru_cache(maxsize=None)
+def get_reconstructor() -> Reconstructor:
+    """Returns the shared reconstructor used to turn modified parse trees
+    back into formula text.
+    """
+
+    return Reconstructor(get_parser())
+
 
 def strip_trailing_zeroes(d: decimal.Decimal) -> decimal.Decimal:
     """Given a decimal, returns a decimal without trailing zeroes to the right
@@ -41,6 +70,33 @@ def quantify_cell_loc(location: str) -> Tuple[int, int]:
     return (col, row)
 
 
+def split_cell_ref(ref: str) -> Tuple[int, int, bool, bool]:
+    """Returns the column, the row, and whether each of them is absolute for a
+    cell reference such as "$B12". The location is not bounds-checked.
+    """
+
+    groups = CELLREF_REGEX.match(ref)
+    if not groups:
+        raise ValueError("Invalid cell location.")
+    abs_col, col_str, abs_row, row_str = groups.groups()
+    col = reduce(lambda a, x: a * 26 + ord(x) - 64, col_str.upper(), 0)
+    return (col, int(row_str), bool(abs_col), bool(abs_row))
+
+
+def shift_cell_ref(ref: str, d_cols: int, d_rows: int) -> str:
+    """Returns the cell reference moved by the given number of columns and
+    rows. Absolute ($) components are not moved and are kept in the result.
+    Raises a ValueError if the moved reference is off the sheet.
+    """
+
+    col, row, abs_col, abs_row = split_cell_ref(ref)
+    if not abs_col:
+        col += d_cols
+    if not abs_row:
+        row += d_rows
+    return stringify_cell_loc(col, row, abs_col, abs_row)
+
+
 def stringify_cell_loc(col: int, row: int,
                        abs_col: bool = False, abs_row: bool = False) -> str:
     """Returns the cell location as a string ([Letter][Row]) such as "A1"."""
@@ -61,16 +117,17 @@ def stringify_cell_loc(col: int, row: int,
     return res
 
 
-def parse_contents(contents: Optional[str], parser) \
+def parse_contents(contents: Optional[str], loc: Tuple[int, int], templates) \
         -> Tuple[Optional[str], Any, CellType, Optional[Any]]:
-    """Returns the cleaned contents, value, its type, and the parse tree (if
-    applicable) as a tuple given a cell's contents. If the contents cannot be
-    parsed, the appropriate cell error type is stored as the value.
+    """Returns the cleaned contents, value, its type, and the formula template
+    (if applicable) as a tuple given a cell's contents and location. If the
+    contents cannot be parsed, the appropriate cell error type is stored as
+    the value.
     """
 
     if not isinstance(contents, (str, type(None))):
         raise TypeError
-    clean_contents, val_type, pt = contents, CellType.NONE, None
+    clean_contents, val_type, template = contents, CellType.NONE, None
     val: Any = None
     if not contents:
         clean_contents = None
@@ -90,13 +147,14 @@ def parse_contents(contents: Optional[str], parser) \
                     val = CellError(CellErrorType.PARSE_ERROR,
                                     "Invalid formula.", None)
                 else:
-                    try:
-                        pt = parser.parse(clean_contents)
+                    template = templates.get(clean_contents, loc)
+                    if template.error is None:
                         val_type = CellType.FORMULA
-                    except Exception as e:
+                    else:
                         val_type = CellType.ERROR
                         val = CellError(CellErrorType.PARSE_ERROR,
-                                        "Invalid formula.", e)
+                                        "Invalid formula.", template.error)
+                        template = None
             else:
                 clean_contents = contents.strip()
                 if len(clean_contents) == 0:
@@ -119,25 +177,46 @@ def parse_contents(contents: Optional[str], parser) \
                         val_type = CellType.STRING
                         val = clean_contents
 
-    return (clean_contents, val, val_type, pt)
+    return (clean_contents, val, val_type, template)
 
 
-def detect_cycle(cell: Cell) -> Tuple[bool, List[List[Cell]]]:
+def value_changed(old: Any, new: Any) -> bool:
+    """Returns whether a cell's value changed, telling apart values of
+    different types that compare equal, such as TRUE and 1."""
+
+    return type(old) is not type(new) or old != new
+
+
+def needs_evaluation(cell: Cell, scheduled: Set[Cell]) -> bool:
+    """Returns whether a cell being recalculated has to be evaluated: if one
+    of the cells it reads changed, so it was scheduled, or if it was marked as
+    part of a cycle, which its evaluation may no longer give."""
+
+    return cell in scheduled or (
+        isinstance(cell.val, CellError) and
+        cell.val.get_type() == CellErrorType.CIRCULAR_REFERENCE)
+
+
+def detect_cycle(cell: int, children: Callable[[int], Iterable[int]]) \
+        -> Tuple[bool, List[List[int]]]:
     """Returns whether the cell is actively or indirectly in a cycle, along
     with the strongly connected components in the cell dependency graph
     grouped together using Kosaraju's algorithm. Only returns those that
     are relevant to the updated cell (CIRCREF and REF errors).
+
+    Cells are given by their ids in the dependency graph, and children
+    returns the ids of the cells that depend on a cell.
     """
 
     # Build the inverse adjacency graph
-    inverse_graph = {}
+    inverse_graph: Dict[int, Iterable[int]] = {}
     queue = deque([cell])
     while queue:
         node = queue.popleft()
         if node in inverse_graph:
             continue
-        inverse_graph[node] = node.children
-        queue.extend(node.children)
+        inverse_graph[node] = children(node)
+        queue.extend(inverse_graph[node])
 
     # Build regular DAG from inverse (a -> b = a depends on b)
     graph: defaultdict = defaultdict(list,
@@ -146,7 +225,7 @@ def detect_cycle(cell: Cell) -> Tuple[bool, List[List[Cell]]]:
         for j in inverse_graph[i]:
             graph[j].append(i)
 
-    def get_scc(start_node: Cell, visited: Set[Cell]):
+    def get_scc(start_node: int, visited: Set[int]):
         """Traverses through the strongly connected component the start node
         is in and returns it as a list.
         """
@@ -156,15 +235,15 @@ def detect_cycle(cell: Cell) -> Tuple[bool, List[List[Cell]]]:
         while stack:
             node = stack.pop()
             scc.append(node)
-            visited.add(node)
             for neighbor in inverse_graph[node]:
                 if neighbor not in visited:
+                    visited.add(neighbor)
                     stack.append(neighbor)
         return scc
 
     # 1st passthrough: compute the order of cells by finishing time
-    res: List[Cell] = []
-    visited_status: Dict[Cell, int] = defaultdict(int)
+    res: List[int] = []
+    visited_status: Dict[int, int] = defaultdict(int)
     for start_node in graph:
         stack = [start_node]
         while stack:
@@ -182,30 +261,36 @@ def detect_cycle(cell: Cell) -> Tuple[bool, List[List[Cell]]]:
 
     # 2nd passthrough to traverse strongly connected components
     scc_arr = []
-    visited: Set[Cell] = set()
+    visited: Set[int] = set()
     while res:
         start_node = res.pop()
         if start_node not in visited:
             scc_arr.append(get_scc(start_node, visited))
 
-    return any(map(lambda x: len(x) > 1, scc_arr)), scc_arr
+    # A cell whose formula reads a range containing itself is a cycle too
+    return any(map(lambda x: len(x) > 1 or x[0] in inverse_graph[x[0]],
+                   scc_arr)), scc_arr
 
 
-def topological_sort(updated_cell: Cell) -> Generator[Cell, None, None]:
+def topological_sort(updated_cell: int,
+                     children: Callable[[int], Iterable[int]]) \
+        -> Generator[int, None, None]:
     """Returns the topological ordering of cells that need to be updated given
-    an initial cell that is changed.
+    an initial cell that is changed, by their ids in the dependency graph.
     """
 
     visited = set()
-    stack: List[Cell] = []
+    stack: List[int] = []
     order, recursion = [], [updated_cell]
+    edges: Dict[int, Set[int]] = {}
 
     while recursion:
         cur_cell = recursion.pop()
         if cur_cell not in visited:
             visited.add(cur_cell)
-            recursion += list(cur_cell.children)
-            while stack and cur_cell not in stack[-1].children:
+            edges[cur_cell] = set(children(cur_cell))
+            recursion += list(edges[cur_cell])
+            while stack and cur_cell not in edges[stack[-1]]:
                 order.append(stack.pop())
             stack.append(cur_cell)
 
@@ -1,19 +1,26 @@
 from __future__ import annotations
-from .error import CellError, CellErrorType, error_str, error_desc
+from .error import CellError, CellErrorType, error_desc
 from .sheet import Sheet
 from .cell import Cell, CellType
 from . import util
 from . import functions
+from . import operators
+from .compiler import CellKey, CompiledFunction, EvalContext, \
+    evaluate_template
+from .template import template_cache
+from .graph import Condensation, DependencyGraph, OrderCache, \
+    OrphanIndex, TopologicalOrder
+from .parallel import ParallelEvaluator
 from typing import Optional, List, Dict, Tuple, Any, TextIO, Callable, \
-                   Iterable, Set, Deque
+                   Iterable, Iterator, Set, Deque
+import enum
 import re
-from lark import Transformer, Visitor, Lark, Token
-from lark.reconstruct import Reconstructor
-from decimal import Decimal
+from lark import Transformer, Visitor, Token, Tree
 import json
 from collections import deque
 import traceback
-from functools import cmp_to_key
+from functools import cmp_to_key, partial
+from contextlib import contextmanager
 
 
 class EvalExpressions(Transformer):
@@ -22,167 +29,64 @@ class EvalExpressions(Transformer):
     def __init__(self, wb):
         self.workbook = wb
         self._sheet_name = None
+        self._d_cols = 0
+        self._d_rows = 0
         self.invalid_sheet_refs = set()
+        self.dynamic_refs = set()
+        self.names = {}
+        self.range_values = None
 
     def set_sheet_name(self, sheet_name):
         self._sheet_name = sheet_name
 
+    def set_offset(self, d_cols, d_rows):
+        """Sets how far the cell being evaluated is from the anchor of its
+        formula template; relative references are moved by this much."""
+        self._d_cols = d_cols
+        self._d_rows = d_rows
+
     def expr(self, args):
         return eval(args[0])
 
     def number(self, args):
-        return util.strip_trailing_zeroes(Decimal(args[0]))
+        return operators.number(args[0])
 
     def parens(self, args):
         return args[0]
 
+    def name(self, args):
+        name = str(args[0]).lower()
+        if name in self.names:
+            return self.names[name]
+        return CellError(CellErrorType.BAD_NAME,
+                         error_desc.get(CellErrorType.BAD_NAME))
+
     def string(self, args):
-        s = args[0][1:-1]
-        if s in error_str:
-            return CellError(error_str.get(s), error_desc.get(s))
-        return s
+        return operators.string(args[0])
 
     def bool(self, args):
-        return args[0].lower() == "true"
+        return operators.boolean(args[0])
 
     def error(self, args):
-        return CellError(error_str.get(args[0]), error_desc.get(args[0]))
+        return operators.error(args[0])
 
     def add_expr(self, args):
-        if isinstance(args[0], CellError):
-            return args[0]
-        if isinstance(args[2], CellError):
-            return args[2]
-
-        args[0] = args[0] if args[0] else Decimal("0")
-        args[2] = args[2] if args[2] else Decimal("0")
-
-        # Use regex to check if the expression can be converted into a decimal.
-        regex = r'^[+-]?((\d+(\.\d*)?)|(\.\d+))$'
-        if type(args[0]) != Decimal:
-            if type(args[0]) == str and re.match(regex, args[0].strip()):
-                args[0] = Decimal(args[0].strip())
-            else:
-                # Can't be parsed if it isn't a decimal and can't be converted.
-                return CellError(CellErrorType.TYPE_ERROR,
-                                 error_desc.get(CellErrorType.TYPE_ERROR))
-        # Same check for the second argument.
-        if type(args[2]) != Decimal:
-            if type(args[2]) == str and re.match(regex, args[2].strip()):
-                args[2] = Decimal(args[2].strip())
-            else:
-                return CellError(CellErrorType.TYPE_ERROR,
-                                 error_desc.get(CellErrorType.TYPE_ERROR))
-
-        if args[1] == "+":
-            return args[0] + args[2]
-        return args[0] - args[2]
+        return operators.apply_chain(operators.add_expr, args)
 
     def mul_expr(self, args):
-        if isinstance(args[0], CellError):
-            return args[0]
-        if isinstance(args[2], CellError):
-            return args[2]
-
-        args[0] = args[0] if args[0] else Decimal("0")
-        args[2] = args[2] if args[2] else Decimal("0")
-
-        # Use regex to check if the expression can be converted into a decimal.
-        regex = r'^[+-]?((\d+(\.\d*)?)|(\.\d+))$'
-        if type(args[0]) != Decimal:
-            if type(args[0]) == str and re.match(regex, args[0].strip()):
-                args[0] = Decimal(args[0].strip())
-            else:
-                # Can't be parsed if it isn't a decimal and can't be converted.
-                return CellError(CellErrorType.TYPE_ERROR,
-                                 error_desc.get(CellErrorType.TYPE_ERROR))
-        # Same check for the second argument.
-        if type(args[2]) != Decimal:
-            if type(args[2]) == str and re.match(regex, args[2].strip()):
-                args[2] = Decimal(args[2].strip())
-            else:
-                return CellError(CellErrorType.TYPE_ERROR,
-                                 error_desc.get(CellErrorType.TYPE_ERROR))
-
-        if args[1] == "*":
-            return args[0] * args[2]
-        elif args[2] == 0:
-            return CellError(CellErrorType.DIVIDE_BY_ZERO,
-                             error_desc.get(CellErrorType.DIVIDE_BY_ZERO))
-        return args[0] / args[2]
+        return operators.apply_chain(operators.mul_expr, args)
 
     def unary_op(self, args):
-        if isinstance(args[1], CellError):
-            return args[1]
-
-        if args[0] == "-":
-            return -args[1]
-        else:
-            return args[1]
+        return operators.unary_op(args[0], args[1])
 
     def concat_expr(self, args):
-        if isinstance(args[0], CellError):
-            return args[0]
-        if isinstance(args[1], CellError):
-            return args[1]
-
-        args[0] = str(args[0]) if args[0] else ""
-        args[1] = str(args[1]) if args[1] else ""
-
-        # Boolean to string conversion
-        if isinstance(args[0], bool):
-            args[0] = str(args[0]).upper()
-        if isinstance(args[1], bool):
-            args[1] = str(args[1]).upper()
-
-        return args[0] + args[1]
+        val = args[0]
+        for arg in args[1:]:
+            val = operators.concat_expr(val, arg)
+        return val
 
     def compare_expr(self, args):
-        if isinstance(args[0], CellError):
-            return args[0]
-        if isinstance(args[2], CellError):
-            return args[2]
-
-        if args[0] is None and args[2] is None:
-            return args[1] in ["=", "==", ">=", "<="]
-        elif args[0] is None:
-            if isinstance(args[2], str):
-                args[0] = ""
-            elif isinstance(args[2], Decimal):
-                args[0] = Decimal("0")
-            elif isinstance(args[2], bool):
-                args[0] = False
-        elif args[2] is None:
-            if isinstance(args[0], str):
-                args[2] = ""
-            elif isinstance(args[0], Decimal):
-                args[2] = Decimal("0")
-            elif isinstance(args[0], bool):
-                args[2] = False
-
-        if isinstance(args[0], str):
-            args[0] = args[0].lower()
-        if isinstance(args[2], str):
-            args[2] = args[2].lower()
-
-        if args[1] in ["=", "=="]:
-            return args[0] == args[2] and isinstance(args[0], type(args[2]))
-        elif args[1] in ["<>", "!="]:
-            return args[0] != args[2] or not isinstance(args[0], type(args[2]))
-
-        priorities = {bool: 3, str: 2, Decimal: 1}
-        if not isinstance(args[0], type(args[2])):
-            args[0] = priorities[type(args[0])]
-            args[2] = priorities[type(args[2])]
-
-        if args[1] == "<":
-            return args[0] < args[2]
-        elif args[1] == ">":
-            return args[0] > args[2]
-        elif args[1] == "<=":
-            return args[0] <= args[2]
-        elif args[1] == ">=":
-            return args[0] >= args[2]
+        return operators.apply_chain(operators.compare_expr, args)
 
     def cell_range(self, args):
         sht_name = self._sheet_name
@@ -193,18 +97,27 @@ class EvalExpressions(Transformer):
             sht_name, start_location, end_location = args[0], args[1], args[2]
 
         # Check if sheet_name exists. If so, check if the sheet name is valid
-        if sht_name.lower() not in self.workbook.sheet_names_lower_to_orig:
+        sheet_name_lower = sht_name.translate({39: None}).lower()
+        if sheet_name_lower not in self.workbook.sheet_names_lower_to_orig:
+            self.invalid_sheet_refs.add(sht_name)
             return CellError(CellErrorType.BAD_REFERENCE,
                              error_desc.get(CellErrorType.BAD_REFERENCE))
-        sht_name = self.workbook.sheet_names_lower_to_orig[sht_name.lower()]
+        sht_name = self.workbook.sheet_names_lower_to_orig[sheet_name_lower]
 
         # Compute area of cells to move from start_location and end_locations
-        start_loc = util.quantify_cell_loc(start_location)
-        end_loc = util.quantify_cell_loc(end_location)
+        start_loc = util.quantify_cell_loc(util.shift_cell_ref(
+            start_location, self._d_cols, self._d_rows))
+        end_loc = util.quantify_cell_loc(util.shift_cell_ref(
+            end_location, self._d_cols, self._d_rows))
 
         tl = (min(start_loc[0], end_loc[0]), min(start_loc[1], end_loc[1]))
         br = (max(start_loc[0], end_loc[0]), max(start_loc[1], end_loc[1]))
 
+        # Ranges read earlier in the recalculation are shared
+        cache = self.range_values
+        if cache is not None and (sht_name, tl + br) in cache:
+            return cache[(sht_name, tl + br)]
+
         # Return range of cells as a list of values
         vals = []
         for r in range(tl[1], br[1] + 1):
@@ -213,14 +126,42 @@ class EvalExpressions(Transformer):
                 loc_str = util.stringify_cell_loc(c, r)
                 row.append(self.workbook.get_cell_value(sht_name, loc_str))
             vals.append(row)
+        if cache is not None:
+            cache[(sht_name, tl + br)] = vals
         return vals
 
+    def _transform_tree(self, tree):
+        # The lazy arguments of functions such as IF are left untransformed,
+        # and passed as functions that transform them when called
+        if tree.data == "func":
+            eager = functions.lazy_functions.get(
+                str(tree.children[0]).upper())
+            if eager is not None:
+                name, inputs = tree.children[0], tree.children[1:]
+                args = [name] + [self.transform(i) for i in inputs[:eager]]
+                if name.upper() == "LET":
+                    # The names LET binds are passed as strings
+                    args.extend(
+                        str(i.children[0]).lower()
+                        if n % 2 == 0 and n < len(inputs) - 1 and
+                        isinstance(i, Tree) and i.data == "name"
+                        else partial(self.transform, i)
+                        for n, i in enumerate(inputs))
+                else:
+                    args.extend(partial(self.transform, i)
+                                for i in inputs[eager:])
+                return self._call_userfunc(tree, args)
+        return super()._transform_tree(tree)
+
     def func(self, args):
         func, inputs = args[0].upper(), args[1:]
         try:
             if func == "INDIRECT":
                 return functions.function_dict[func](inputs, self._sheet_name,
-                                                     self.workbook)
+                                                     self.workbook,
+                                                     self.dynamic_refs)
+            elif func == "LET":
+                return functions.function_dict[func](inputs, self.names)
             else:
                 return functions.function_dict[func](inputs)
         except KeyError as e:
@@ -229,9 +170,12 @@ class EvalExpressions(Transformer):
 
     def cell(self, args):
         try:
+            loc = args[-1]
+            if self._d_cols or self._d_rows:
+                loc = util.shift_cell_ref(loc, self._d_cols, self._d_rows)
             if len(args) == 2:  # Cross-reference with another sheet
-                return self.workbook.get_cell_value(args[0], args[1])
-            return self.workbook.get_cell_value(self._sheet_name, args[0])
+                return self.workbook.get_cell_value(args[0], loc)
+            return self.workbook.get_cell_value(self._sheet_name, loc)
         except KeyError as e:
             self.invalid_sheet_refs.add(args[0])
             return CellError(CellErrorType.BAD_REFERENCE,
@@ -241,27 +185,6 @@ class EvalExpressions(Transformer):
                              error_desc.get(CellErrorType.BAD_REFERENCE), e)
 
 
-class VisitRefs(Visitor):
-    """A Lark Visitor that stores a list of CELLREFs found in the tree."""
-    def __init__(self):
-        self.refs = []
-        self._sheet_name = None
-
-    def reset_refs(self):
-        self.refs = []
-
-    def set_sheet_name(self, sheet_name):
-        self._sheet_name = sheet_name
-
-    def cell(self, tree):
-        if len(tree.children) == 2:
-            self.refs.append((tree.children[0].lower(),
-                              tree.children[1].lower()))
-        else:
-            self.refs.append((self._sheet_name.lower(),
-                              tree.children[0].lower()))
-
-
 class RenameSheet(Visitor):
     def __init__(self):
         self._old_sheet_name = None
@@ -274,11 +197,19 @@ class RenameSheet(Visitor):
         self._new_sheet_name = sheet_name
 
     def cell(self, tree):
+        if len(tree.children) == 2:
+            self.rename(tree)
+
+    def cell_range(self, tree):
+        if len(tree.children) == 3:
+            self.rename(tree)
+
+    def rename(self, tree):
         sheet_match = (tree.children[0].type == "SHEET_NAME" and
                        tree.children[0] == self._old_sheet_name) or \
                       (tree.children[0].type == "QUOTED_SHEET_NAME" and
                        tree.children[0] == f"'{self._old_sheet_name}'")
-        if len(tree.children) == 2 and sheet_match:
+        if sheet_match:
             # If a sheet’s name doesn’t start with an alphabetical character
             # or underscore, or if a sheet’s name contains spaces or any other
             # characters besides “A-Z”, “a-z”, “0-9” or the underscore “_”, it
@@ -290,37 +221,19 @@ class RenameSheet(Visitor):
                                          f"'{self._new_sheet_name}'")
 
 
-class MoveFormula(Visitor):
-    """A Lark Visitor that updates a cell's formula refs when it is moved."""
-    def __init__(self):
-        self._d_cols = 0
-        self._d_rows = 0
+class CalculationMode(enum.Enum):
+    """This enum specifies when a workbook recalculates the cells that depend
+    on a changed cell.
 
-    def set_deltas(self, d_cols, d_rows):
-        self._d_cols = d_cols
-        self._d_rows = d_rows
+    AUTOMATIC recalculates them as soon as the cell changes. LAZY only marks
+    them as dirty, and recalculates a dirty cell (and the dirty cells it
+    depends on) when its value is read. MANUAL recalculates nothing, and
+    calls no notification functions, until Workbook.recalculate() is called.
+    """
 
-    def cell(self, tree):
-        pattern = r"^(?P<abs_col>\$?)[A-Za-z]+(?P<abs_row>\$?)[1-9][0-9]*$"
-        i = len(tree.children) - 1
-        c, r = util.quantify_cell_loc(tree.children[i])
-        new_c, new_r = c, r
-        abs_col = abs_row = True
-
-        groups = re.match(pattern, tree.children[i])
-        if not groups.group("abs_col"):
-            new_c += self._d_cols
-            abs_col = False
-        if not groups.group("abs_row"):
-            new_r += self._d_rows
-            abs_row = False
-
-        if not 1 <= new_c <= util.MAX_COL or not 1 <= new_r <= util.MAX_ROW:
-            tree.data = "error"
-            tree.children[i] = Token("ERROR_VALUE", "#REF!")
-        else:
-            tree.children[i] = Token("CELLREF", util.stringify_cell_loc(
-                new_c, new_r, abs_col, abs_row).lower())
+    AUTOMATIC = 0
+    LAZY = 1
+    MANUAL = 2
 
 
 class Workbook:
@@ -333,24 +246,70 @@ class Workbook:
         sheet_arr (List[Sheet]): A list containing the sheet objects.
         sheet_name_to_idx (): A dictionary mapping from sheet name to their
         index in sheet_list.
+        compile_formulas (bool): Whether formulas are compiled into closures
+        on first evaluation, or re-evaluated by walking the parse tree with
+        EvalExpressions every time.
+        templates (TemplateCache): The cache that formula templates are
+        interned in, shared by all workbooks unless replaced.
+        calculation_mode (CalculationMode): When cells depending on a changed
+        cell are recalculated.
+        dirty_cells (Set[Cell]): In LAZY mode, the formula cells that need
+        recalculating before their value is read. In MANUAL mode, the formula
+        cells left out of recalculating only some sheets.
+        pending_cells (Dict[Cell, bool]): In MANUAL mode, the cells changed
+        since the last recalculation, mapped to whether their references kept
+        the topological order.
+        parallel (Optional[ParallelEvaluator]): With more than one worker,
+        evaluates large recalculations of compiled formulas across worker
+        processes.
+        dynamic_parents (Dict[Cell, Set[int]]): The ids of the cells and empty
+        locations that each formula read through INDIRECT the last time it
+        was evaluated, beyond those its formula references. They are kept as
+        edges in the dependency graph along with its references.
+        volatile_cells (Set[Cell]): The cells whose formulas call volatile
+        functions, such as NOW and RAND, which recalculate_volatile updates.
+        order_cache (OrderCache): The cells to recalculate when each of the
+        most recently edited cells changes, in topological order, kept while
+        the dependency graph's edges are unchanged.
+        precedent_cache (OrderCache): The cells that each of the most
+        recently queried cells depends on, directly or indirectly, kept in
+        the same way.
     """
 
-    def __init__(self):
+    def __init__(self, compile_formulas: bool = True,
+                 calculation_mode: CalculationMode =
+                 CalculationMode.AUTOMATIC, workers: int = 1):
         """Initialize a new empty workbook."""
 
         self.sheet_arr: List[Sheet] = []
         self.sheet_name_to_idx: Dict[str, int] = {}
         self.sheet_names_lower_to_orig: Dict[str, str] = {}
-        self.parser = Lark.open("sheets/formulas.lark", start="formula",
-                                maybe_placeholders=False)
+        self.parser = util.get_parser()
         self.transformer = EvalExpressions(self)
-        self.ref_visitor = VisitRefs()
+        self.context = EvalContext(self)
+        self.compile_formulas = compile_formulas
+        self.templates = template_cache
         self.rename_visitor = RenameSheet()
-        self.move_visitor = MoveFormula()
-        self.orphans: Set[Cell] = set()
+        self.graph = DependencyGraph()
+        self.topo_order = TopologicalOrder(self.cell_children,
+                                           self.cell_parents)
+        self.orphans = OrphanIndex()
         self.cell_change_notif_funcs: List[Callable] = []
-
-        self._sheet_being_deleted = None
+        self.calculation_mode = calculation_mode
+        self.dirty_cells: Set[Cell] = set()
+        self.pending_cells: Dict[Cell, bool] = {}
+        self.parallel = ParallelEvaluator(workers) if workers > 1 else None
+        self.dynamic_parents: Dict[Cell, Set[int]] = {}
+        self.volatile_cells: Set[Cell] = set()
+        self.order_cache = OrderCache()
+        self.precedent_cache = OrderCache()
+
+        self._sheet_being_deleted: Optional[str] = None
+        self._batch_cells: Optional[Dict[Cell, bool]] = None
+        self._batch_vals: Dict[Cell, Any] = {}
+        self._pending_vals: Dict[Cell, Any] = {}
+        self._stale_cells: Optional[Set[Cell]] = None
+        self._reread: Dict[Cell, bool] = {}
 
     def num_sheets(self) -> int:
         """Return the number of spreadsheets in the workbook.
@@ -430,7 +389,7 @@ class Workbook:
 
         self.sheet_name_to_idx[sheet_name] = len(self.sheet_arr)
         self.sheet_names_lower_to_orig[sheet_name.lower()] = sheet_name
-        self.sheet_arr.append(Sheet(sheet_name))
+        self.sheet_arr.append(Sheet(sheet_name, self.graph))
         self.update_orphans(sheet_name)
         return (len(self.sheet_arr) - 1, sheet_name)
 
@@ -461,6 +420,16 @@ class Workbook:
         sheet = self.sheet_arr[idx_del]
         self._sheet_being_deleted = sheet_name_orig
 
+        # Formulas on other sheets that reference cells in the sheet will have
+        # bad references. The sheet graph tells if there are any before going
+        # through the cells' children.
+        referenced = sheet in self.graph.sheet_graph.children
+        dependents: Set[Cell] = set()
+        if referenced:
+            for cell in sheet.loc_to_cell.values():
+                dependents.update(c for c in self.graph.children(cell)
+                                  if c.sheet_name != sheet_name_orig)
+
         # For every cell in the sheet, remove references to it and re-evaluate
         # neighbors
         for loc in list(sheet.loc_to_cell.keys()):
@@ -468,7 +437,8 @@ class Workbook:
             self.set_cell_contents(sheet_name_orig,
                                    util.stringify_cell_loc(col, row), "#REF!")
             cell = sheet.loc_to_cell.pop(loc)
-            cell.make_empty()
+            cell.make_empty(self.graph)
+            self.graph.remove_cell(cell, sheet)
 
         # Remove sheet from class attributes
         self.sheet_name_to_idx.pop(sheet_name_orig)
@@ -480,6 +450,18 @@ class Workbook:
         for i in range(idx_del, len(self.sheet_arr)):
             self.sheet_name_to_idx[self.sheet_arr[i].name] -= 1
 
+        # So do formulas reading ranges or empty cells in the sheet
+        if referenced:
+            dependents.update(sheet.range_index.all_dependents())
+            for i in self.graph.sheet_locations(sheet):
+                dependents.update(self.graph.children_of(i))
+        for cell in dependents:
+            if cell.contents:
+                col, row = cell.loc
+                self.set_cell_contents(cell.sheet_name,
+                                       util.stringify_cell_loc(col, row),
+                                       cell.contents)
+
     def rename_sheet(self, sheet_name: str, new_sheet_name: str) -> None:
         """Rename the specified sheet to the new sheet name.  Additionally, all
         cell formulas that referenced the original sheet name are updated to
@@ -524,29 +506,46 @@ class Workbook:
         self.rename_visitor.set_old_sheet_name(old_sheet_name)
         self.rename_visitor.set_new_sheet_name(new_sheet_name)
 
+        # Update the formulas of all cells in the sheet and, if the sheet
+        # graph has formulas on other sheets referencing it, of their
+        # immediate children, cells reading ranges in it and cells
+        # referencing empty cells in it, which are the only cells that can
+        # reference the sheet
+        to_rewrite: Set[Cell] = set(cur_sheet.loc_to_cell.values())
+        referenced = cur_sheet in self.graph.sheet_graph.children
+        if referenced:
+            to_rewrite.update(cur_sheet.range_index.all_dependents())
+            for i in self.graph.sheet_locations(cur_sheet):
+                to_rewrite.update(self.graph.children_of(i))
         for cell in cur_sheet.loc_to_cell.values():
             cell.sheet_name = new_sheet_name
+            if referenced:
+                to_rewrite.update(self.graph.children(cell))
 
-            # Update children's formula of all cells using the parse tree
-            if cell.pt:
-                self.rename_visitor.visit(cell.pt)
-
-                # Reconstruct formula with updated parse tree
-                cell.contents = "=" + \
-                    Reconstructor(self.parser).reconstruct(cell.pt)
-
-            # Only update the contents and parse tree of affected cell's
-            # immediate children
-            for child in cell.children:
-                if child.pt:
-                    self.rename_visitor.visit(child.pt)
-                    child.contents = "=" + \
-                        Reconstructor(self.parser).reconstruct(child.pt)
+        # A formula can only name the sheet if its text holds the name
+        old_name_lower = old_sheet_name.lower()
+        for cell in to_rewrite:
+            if cell.template and cell.contents and \
+                    old_name_lower in cell.contents.lower():
+                self.rewrite_formula(cell, self.rename_visitor)
 
         self.update_orphans(new_sheet_name)
         self.rename_visitor.set_old_sheet_name(None)
         self.rename_visitor.set_new_sheet_name(None)
 
+        # INDIRECT names sheets in strings, which aren't rewritten, so the
+        # formulas that read cells in the sheet through it are entered again
+        sheets = self.graph.sheets
+        readers = [cell for cell, ids in self.dynamic_parents.items()
+                   if any(sheets[i] is cur_sheet for i in ids)]
+        if readers:
+            with self.batch():
+                for cell in readers:
+                    col, row = cell.loc
+                    self.set_cell_contents(cell.sheet_name,
+                                           util.stringify_cell_loc(col, row),
+                                           cell.contents)
+
     def move_sheet(self, sheet_name: str, index: int) -> None:
         """Move the specified sheet to the specified index in the workbook's
         ordered sequence of sheets.  The index can range from 0 to
@@ -574,7 +573,8 @@ class Workbook:
         orig_name = self.sheet_names_lower_to_orig[sheet_name.lower()]
         oldindex = self.list_sheets().index(orig_name)
         self.sheet_arr.insert(index, self.sheet_arr.pop(oldindex))
-        self.sheet_name_to_idx[sheet_name] = index
+        for i in range(min(index, oldindex), max(index, oldindex) + 1):
+            self.sheet_name_to_idx[self.sheet_arr[i].name] = i
 
     def copy_sheet(self, sheet_name: str) -> Tuple[int, str]:
         """Make a copy of the specified sheet, storing the copy at the end of
@@ -620,22 +620,27 @@ class Workbook:
         # Create a new sheet and set the cell contents for that sheet.
         # Using set_cell_contents should handle all edge cases.
         _, _ = self.new_sheet(copy_name)
-        for loc in list(orig_sheet.loc_to_cell.keys()):
-            col, row = loc
-            string_loc = util.stringify_cell_loc(col, row)
+        with self.batch():
+            for loc in list(orig_sheet.loc_to_cell.keys()):
+                col, row = loc
+                string_loc = util.stringify_cell_loc(col, row)
 
-            orig_contents = self.get_cell_contents(sheet_name, string_loc)
-            self.set_cell_contents(copy_name, string_loc, orig_contents)
+                orig_contents = self.get_cell_contents(sheet_name, string_loc)
+                self.set_cell_contents(copy_name, string_loc, orig_contents)
 
         return (self.num_sheets() - 1, copy_name)
 
     def update_orphans(self, new_sheet_name: str):
-        """Updates the cells that reference invalid sheet names. This function
-        should be called whenever a sheet is created or renamed.
+        """Updates the cells that reference the sheet name while no sheet had
+        it, together in one batch. This function should be called whenever a
+        sheet is created or renamed.
         """
 
-        for cell in self.orphans:
-            if new_sheet_name in cell.invalid_sheet_refs:
+        cells = self.orphans.pop(new_sheet_name)
+        if not cells:
+            return
+        with self.batch():
+            for cell in cells:
                 col, row = cell.loc
                 self.set_cell_contents(cell.sheet_name,
                                        util.stringify_cell_loc(col, row),
@@ -666,42 +671,266 @@ class Workbook:
         cur_sheet = self.sheet_arr[self.sheet_name_to_idx[sheet_name]]
         return cur_sheet.get_extent()
 
-    def reevaluate_refs(self, updated_cell: Cell):
+    def get_affected_sheets(self, sheet_name: str) -> List[str]:
+        """Return the names of the sheets whose cell values an edit to the
+        specified spreadsheet can change: the sheet itself, and the sheets
+        with formulas that reference it, directly or through other sheets.
+        These are the sheets to reload or save after the edit.
+
+        The sheet name match is case-insensitive; the text must match but the
+        case does not have to.
+
+        If the specified sheet name is not found, a KeyError is raised.
+
+        Args:
+            sheet_name: The name of the sheet.
+
+        Returns:
+            The names of the affected sheets, in the order of the sheets in
+            the workbook.
+
+        Raises:
+            KeyError: Raises an exception.
+        """
+
+        if sheet_name.lower() not in self.sheet_names_lower_to_orig:
+            raise KeyError("Sheet name not found.")
+        sheet_name = self.sheet_names_lower_to_orig[sheet_name.lower()]
+        cur_sheet = self.sheet_arr[self.sheet_name_to_idx[sheet_name]]
+        affected = self.graph.sheet_graph.reachable(cur_sheet)
+        return [sheet.name for sheet in self.sheet_arr if sheet in affected]
+
+    def get_precedents(self, sheet_name: str, location: str,
+                       transitive: bool = False) -> List[Tuple[str, str]]:
+        """Return the cells that the specified cell's formula depends on: the
+        cells it references, including empty ones, and the cells in the cell
+        ranges it reads. If transitive, the cells those depend on are
+        included too, and so on.
+
+        The sheet name match is case-insensitive; the text must match but the
+        case does not have to. Additionally, the cell location can be
+        specified in any case.
+
+        If the specified sheet name is not found, a KeyError is raised.
+
+        Args:
+            sheet_name: The name of the sheet.
+            location: The cell location.
+            transitive: Whether to include indirect precedents.
+
+        Returns:
+            The (sheet name, location) of each precedent, ordered by sheet,
+            row and column.
+
+        Raises:
+            KeyError: Raises an exception.
+            ValueError: If the location is invalid.
+        """
+
+        cell = self.get_cell_instance(sheet_name, location)
+        if cell is None:
+            return []
+        if not transitive:
+            return self.cell_locations(self.direct_precedents(cell))
+
+        generation = self.graph.generation
+        precedents = self.precedent_cache.get(cell, generation)
+        if not isinstance(precedents, list):
+            found: Set[Any] = set()
+            stack = [cell]
+            while stack:
+                for p in self.direct_precedents(stack.pop()):
+                    if p not in found:
+                        found.add(p)
+                        if isinstance(p, Cell):
+                            stack.append(p)
+            precedents = list(found)
+            self.precedent_cache.put(cell, generation, precedents)
+        return self.cell_locations(precedents)
+
+    def get_dependents(self, sheet_name: str, location: str,
+                       transitive: bool = False) -> List[Tuple[str, str]]:
+        """Return the cells whose formulas depend on the specified cell,
+        which may be empty: those that reference it and those that read a
+        cell range containing it. If transitive, the cells depending on those
+        are included too, and so on.
+
+        The sheet name match is case-insensitive; the text must match but the
+        case does not have to. Additionally, the cell location can be
+        specified in any case.
+
+        If the specified sheet name is not found, a KeyError is raised.
+
+        Args:
+            sheet_name: The name of the sheet.
+            location: The cell location.
+            transitive: Whether to include indirect dependents.
+
+        Returns:
+            The (sheet name, location) of each dependent, ordered by sheet,
+            row and column.
+
+        Raises:
+            KeyError: Raises an exception.
+            ValueError: If the location is invalid.
+        """
+
+        cell = self.get_cell_instance(sheet_name, location)
+        if cell is None:
+            # An empty cell is read through its location's id or ranges
+            sheet_name = sheet_name.translate({39: None}).lower()
+            sheet = self.sheet_arr[self.sheet_name_to_idx[
+                self.sheet_names_lower_to_orig[sheet_name]]]
+            loc = util.quantify_cell_loc(location)
+            i = self.graph.location_ids.get((sheet, loc))
+            children = set(sheet.range_index.lookup(*loc))
+            if i is not None:
+                children.update(self.graph.children_of(i))
+            if not transitive:
+                return self.cell_locations(children)
+            dependents = set(children)
+            for child in children:
+                dependents.update(self.dependent_cells(child))
+            return self.cell_locations(dependents)
+
+        if not transitive:
+            return self.cell_locations(self.cell_children(cell))
+        return self.cell_locations(self.dependent_cells(cell, False))
+
+    def direct_precedents(self, cell: Cell) -> List[Any]:
+        """Returns the cells the cell depends on directly, with each empty
+        location it references as a (sheet, (col, row)) pair."""
+
+        graph = self.graph
+        precedents: List[Any] = [
+            graph.cells[j] if graph.cells[j] is not None
+            else graph.locations[j] for j in graph.parent_ids(cell.id)]
+        for index, rect in cell.range_refs:
+            precedents.extend(index.cells_in(rect))
+        return precedents
+
+    def dependent_cells(self, cell: Cell, root: bool = True) -> List[Cell]:
+        """Returns the cells depending on the cell, directly or indirectly,
+        along with the cell itself if root or if it is on a cycle. They are
+        kept in the order cache until the graph changes."""
+
+        generation = self.graph.generation
+        cells = self.order_cache.get(cell, generation)
+        if cells is None:
+            cells = self.topo_order.cone([cell])
+            if cells is None:
+                cycle_exists, scc_ids = util.detect_cycle(
+                    cell.id, self.cell_child_ids)
+                if cycle_exists:
+                    cells = Condensation(scc_ids, self.cell_child_ids,
+                                         self.graph.cell)
+                else:
+                    cells = [self.graph.cell(i) for i in
+                             util.topological_sort(cell.id,
+                                                   self.cell_child_ids)]
+            self.order_cache.put(cell, generation, cells)
+
+        if isinstance(cells, Condensation):
+            ordered = cells.cells
+            cells = ordered + [c for cycle in cells.cycles for c in cycle]
+        else:
+            ordered = cells
+        if not root and ordered[:1] == [cell]:
+            return cells[1:]
+        return cells
+
+    def cell_locations(self, cells: Iterable[Any]) -> List[Tuple[str, str]]:
+        """Returns the (sheet name, location) of the cells, and of empty
+        locations given as (sheet, (col, row)) pairs, ordered by sheet, row
+        and column."""
+
+        locations = []
+        for cell in cells:
+            if isinstance(cell, Cell):
+                sheet_name, (col, row) = cell.sheet_name, cell.loc
+            else:
+                sheet_name, (col, row) = cell[0].name, cell[1]
+            idx = self.sheet_name_to_idx.get(sheet_name)
+            if idx is not None:
+                locations.append((idx, row, col, sheet_name))
+        locations.sort()
+        return [(sheet_name, util.stringify_cell_loc(col, row))
+                for _, row, col, sheet_name in locations]
+
+    def rewrite_formula(self, cell: Cell, visitor: Visitor) -> None:
+        """Rewrites a cell's formula with a visitor that edits the cell's own
+        copy of the parse tree, then moves the cell to the template for its
+        new formula. The template other cells share is left untouched.
+        """
+
+        tree = cell.template.tree_at(*cell.loc)
+        visitor.visit(tree)
+        contents = "=" + util.get_reconstructor().reconstruct(tree)
+        if contents != cell.contents:
+            cell.contents = contents
+            cell.template = self.templates.get(contents, cell.loc)
+
+    def reevaluate_refs(self, updated_cell: Cell,
+                        parent_refs: List[Tuple[str, str]],
+                        range_refs: List[Tuple[str, str, str]]):
         """Remove old parents and itself from their children and build
-        new references.
+        new references from the (sheet name, location) refs in its formula.
+        The (sheet name, start, end) cell ranges in its formula are recorded
+        in the range index of their sheet rather than as parents.
         """
 
-        while updated_cell.parents:
-            p = updated_cell.parents.pop()
-            p.children.remove(updated_cell)
+        self.dynamic_parents.pop(updated_cell, None)
+        cell_range_refs = []
+        for sheet_ref, start, end in range_refs:
+            # Ranges on sheets that don't exist are orphans until the sheet
+            # is created, and ranges off the sheet evaluate to errors
+            sheet_ref = sheet_ref.translate({39: None})
+            if sheet_ref not in self.sheet_names_lower_to_orig:
+                self.orphans.add(updated_cell, [sheet_ref])
+                continue
+            sheet = self.sheet_arr[self.sheet_name_to_idx[
+                self.sheet_names_lower_to_orig[sheet_ref]]]
+            try:
+                start_col, start_row = util.quantify_cell_loc(start)
+                end_col, end_row = util.quantify_cell_loc(end)
+            except ValueError:
+                continue
+            rect = (min(start_col, end_col), min(start_row, end_row),
+                    max(start_col, end_col), max(start_row, end_row))
+            cell_range_refs.append((sheet.range_index, rect))
+        self.graph.set_range_refs(updated_cell, tuple(cell_range_refs))
 
-        parent_refs = self.ref_visitor.refs
-        self.ref_visitor.reset_refs()
+        # 1st wall of defense for self-reference
+        c, r = updated_cell.loc
+        self_ref = (updated_cell.sheet_name.lower(),
+                    util.stringify_cell_loc(c, r)) in parent_refs
 
+        parent_ids = set()
         for parent_ref in parent_refs:
             try:
-                # 1st wall of defense for self-reference
-                c, r = updated_cell.loc
-                if (updated_cell.sheet_name.lower(),
-                        util.stringify_cell_loc(c, r)) in parent_refs:
+                if self_ref:
                     raise RuntimeError
 
                 cell = self.get_cell_instance(parent_ref[0], parent_ref[1])
                 if not cell:
-                    # If the cell reference is valid but doesn't exist yet
-                    self.set_cell_contents(parent_ref[0], parent_ref[1], None)
-                    cell = self.get_cell_instance(parent_ref[0], parent_ref[1])
+                    # If the cell reference is valid but the cell is empty,
+                    # reference its location without making a cell there
+                    sheet = self.sheet_arr[self.sheet_name_to_idx[
+                        self.sheet_names_lower_to_orig[
+                            parent_ref[0].translate({39: None}).lower()]]]
+                    parent_ids.add(self.graph.location_id(
+                        sheet, util.quantify_cell_loc(parent_ref[1])))
 
                 # 2nd wall of defense for self-reference
-                if cell == updated_cell:
+                elif cell == updated_cell:
                     raise RuntimeError
-
-                # Check for mypy type checking
-                if cell:
-                    updated_cell.parents.add(cell)
-                    cell.children.add(updated_cell)
+                else:
+                    parent_ids.add(cell.id)
             except (KeyError, ValueError) as e:
-                # Cell reference is an invalid sheet name or cell location
+                # Cell reference is an invalid sheet name or cell location;
+                # a missing sheet may be created later
+                if isinstance(e, KeyError):
+                    self.orphans.add(updated_cell, [parent_ref[0]])
                 updated_cell.val = CellError(
                         CellErrorType.BAD_REFERENCE,
                         error_desc[CellErrorType.BAD_REFERENCE],
@@ -716,14 +945,118 @@ class Workbook:
                         e
                 )
                 updated_cell.val_type = CellType.ERROR
+        self.graph.set_parent_ids(updated_cell, parent_ids)
+
+    def cell_children(self, cell: Cell) -> Set[Cell]:
+        """Returns the cells that depend on the cell: those that reference it
+        directly and those that read a cell range containing it.
+        """
+
+        children = self.graph.children(cell)
+        idx = self.sheet_name_to_idx.get(cell.sheet_name)
+        if idx is not None and self.sheet_arr[idx].range_index:
+            children.update(self.sheet_arr[idx].range_index.lookup(*cell.loc))
+        return children
 
-    def evaluate_cell(self, updated_cell: Cell, initial_vals: Dict[Cell, Any]):
-        """Evaluates the cell and its neighbors using the Lark transformer."""
+    def cell_child_ids(self, i: int) -> List[int]:
+        """Returns the ids of the cells depending on the cell with id i."""
 
-        update_ordering_gen = util.topological_sort(updated_cell)
-        for cell in update_ordering_gen:
+        return [c.id for c in self.cell_children(self.graph.cell(i))]
+
+    def cell_parents(self, cell: Cell) -> Set[Cell]:
+        """Returns the cells the cell depends on: those it references directly
+        and those in the cell ranges it reads.
+        """
+
+        parents = self.graph.parents(cell)
+        for index, rect in cell.range_refs:
+            parents.update(index.cells_in(rect))
+        return parents
+
+    def evaluate_cells(self, cells: Iterable[Cell],
+                       initial_vals: Dict[Cell, Any],
+                       roots: Optional[Iterable[Cell]] = None):
+        """Evaluates the cells, given in topological order, across worker
+        processes if there are enough of them, or else in this process.
+
+        If roots is given, the cells are the roots and the cells depending on
+        them, and a cell is only evaluated once a cell it reads has changed
+        value (or is a root), so changes stop propagating where they are
+        absorbed.
+
+        Cells that read a cell through INDIRECT before it was evaluated are
+        then recalculated, along with the cells depending on them.
+        """
+
+        parallel = self.parallel if self.compile_formulas else None
+        if parallel is not None:
+            cells = list(cells)
+            if len(cells) < parallel.min_cells:
+                parallel = None
+        with self.sharing_ranges():
+            if parallel is not None:
+                parallel.evaluate(self, cells, initial_vals, roots)
+            elif roots is None:
+                self.evaluate_serial(cells, initial_vals)
+            else:
+                roots = set(roots)
+                scheduled = set(roots)
+                for cell in cells:
+                    if not util.needs_evaluation(cell, scheduled):
+                        continue
+                    val = cell.val
+                    self.evaluate_serial((cell,), initial_vals)
+                    if cell in roots or util.value_changed(val, cell.val):
+                        scheduled.update(self.cell_children(cell))
+
+        if self._reread:
+            reread, self._reread = self._reread, {}
+            self.update_dependents(
+                reread, initial_vals,
+                self.calculation_mode == CalculationMode.LAZY)
+
+    @contextmanager
+    def sharing_ranges(self) -> Iterator[None]:
+        """Returns a context manager inside which the values of each cell
+        range that formulas read are kept, and shared by the formulas
+        reading the same range, until a cell in the range is evaluated again.
+
+        Cells are evaluated in topological order, so the cells in a range
+        have their new values by the time the first formula reading it is
+        evaluated, and the range is normally read once per recalculation.
+        """
+
+        if self.context.range_values is not None:
+            yield
+            return
+
+        self.context.range_values = self.transformer.range_values = {}
+        try:
+            yield
+        finally:
+            self.context.range_values = self.transformer.range_values = None
+
+    def invalidate_ranges(self, cell: Cell) -> None:
+        """Forgets the values kept of the cell ranges holding the cell."""
+
+        idx = self.sheet_name_to_idx.get(cell.sheet_name)
+        cache = self.context.range_values
+        if idx is None or cache is None:
+            return
+        for rect in self.sheet_arr[idx].range_index.ranges_at(*cell.loc):
+            cache.pop((cell.sheet_name, rect), None)
+
+    def evaluate_serial(self, cells: Iterable[Cell],
+                        initial_vals: Dict[Cell, Any]):
+        """Evaluates the cells, given in topological order, using the Lark
+        transformer or their compiled formulas."""
+
+        evaluator = self.context if self.compile_formulas else \
+            self.transformer
+        for cell in cells:
             if cell not in initial_vals:
                 initial_vals[cell] = cell.val
+            self.dirty_cells.discard(cell)
 
             if cell.contents and cell.contents[0] == "=":
                 # Regardless of whether the transformer raises an exception
@@ -731,12 +1064,17 @@ class Workbook:
                 # updated_cell.parents.add()
 
                 try:
-                    self.transformer.set_sheet_name(cell.sheet_name)
+                    evaluator.set_sheet_name(cell.sheet_name)
 
-                    # If parse tree is None, then there is nothing to
+                    # If there is no template, then there is nothing to
                     # evaluate or it is already an error
-                    if cell.pt:
-                        cell.val = self.transformer.transform(cell.pt)
+                    template = cell.template
+                    if template:
+                        evaluator.set_offset(*template.offset(*cell.loc))
+                    if template and self.compile_formulas:
+                        cell.val = evaluate_template(template, self.context)
+                    elif template:
+                        cell.val = self.transformer.transform(template.tree)
                 except KeyError as e:
                     cell.val = CellError(
                         CellErrorType.BAD_NAME,
@@ -761,7 +1099,7 @@ class Workbook:
                     print("ASDFR")
                     print(e)
                     traceback.print_stack()
-                    print(cell.pt)
+                    print(cell.template and cell.template.tree)
                     cell.val = CellError(
                         CellErrorType.TYPE_ERROR,
                         error_desc[CellErrorType.TYPE_ERROR],
@@ -771,14 +1109,67 @@ class Workbook:
                 if isinstance(cell.val, CellError):
                     cell.val_type = CellType.ERROR
 
+                # Ranges holding the cell that were already read are stale
+                if evaluator.range_values:
+                    self.invalidate_ranges(cell)
+
                 # If cells reference invalid sheets, then add them to the
                 # orphan list so we know which cells need to be updated
                 # later when a sheet is added/renamed
-                if self.transformer.invalid_sheet_refs:
-                    self.orphans.add(cell)
-                    for sheet_ref in self.transformer.invalid_sheet_refs:
-                        cell.invalid_sheet_refs.add(sheet_ref)
-                    self.transformer.invalid_sheet_refs.clear()
+                if evaluator.invalid_sheet_refs:
+                    self.orphans.add(cell, evaluator.invalid_sheet_refs)
+                    evaluator.invalid_sheet_refs.clear()
+
+                # Cells read through INDIRECT become edges of the graph
+                if evaluator.dynamic_refs or cell in self.dynamic_parents:
+                    self.update_dynamic_refs(cell, evaluator.dynamic_refs)
+                    evaluator.dynamic_refs.clear()
+
+    def update_dynamic_refs(self, cell: Cell,
+                            refs: Iterable[Tuple[str, str]]) -> None:
+        """Replaces the edges to the cells that the cell's formula read
+        through INDIRECT with edges to the (sheet name, location) refs it read
+        this time. If a new edge goes backward in the topological order, the
+        cell may have read a value that was about to change, so it is read
+        again once the current recalculation is done, or in LAZY mode marked
+        dirty again along with the cells depending on it.
+        """
+
+        old = self.dynamic_parents.get(cell, set())
+        static = set(self.graph.parent_ids(cell.id)) - old
+        new = set()
+        for sheet_name, location in refs:
+            sheet_name = sheet_name.lower()
+            if sheet_name not in self.sheet_names_lower_to_orig:
+                self.orphans.add(cell, [sheet_name])
+                continue
+            sheet = self.sheet_arr[self.sheet_name_to_idx[
+                self.sheet_names_lower_to_orig[sheet_name]]]
+            try:
+                loc = util.quantify_cell_loc(location)
+            except ValueError:
+                continue
+            parent = sheet.loc_to_cell.get(loc)
+            new.add(parent.id if parent else
+                    self.graph.location_id(sheet, loc))
+        new -= static
+        if new == old:
+            return
+
+        self.graph.set_parent_ids(cell, static | new)
+        if new:
+            self.dynamic_parents[cell] = new
+        else:
+            self.dynamic_parents.pop(cell, None)
+        # In LAZY mode reading a dirty cell evaluates it, so a cell read
+        # through INDIRECT is only stale if it is still dirty
+        lazy = self.calculation_mode == CalculationMode.LAZY
+        added = [self.graph.cells[i] for i in new - old]
+        behind = any(p is not None and p.order >= cell.order and
+                     (not lazy or p in self.dirty_cells) for p in added)
+        in_order = self.topo_order.add_edges(cell, self.cell_parents(cell))
+        if behind or not in_order:
+            self._reread[cell] = in_order and self._reread.get(cell, True)
 
     def set_cell_contents(self, sheet_name: str, location: str,
                           contents: Optional[str]) -> None:
@@ -823,52 +1214,464 @@ class Workbook:
         # Get initial value before wiping it in update_cell for notifications
         cur_cell = cur_sheet.cell_from_loc(location)
         initial_vals = {cur_cell: cur_cell.val} if cur_cell else {}
-        updated_cell = cur_sheet.update_cell(location, contents, self.parser)
+        updated_cell = cur_sheet.update_cell(location, contents,
+                                             self.templates)
         if not initial_vals:
+            # A new cell goes first in the order until it has references
+            self.topo_order.add_cell(updated_cell)
             initial_vals[updated_cell] = None
 
-        # Get list of references (parents) from updated_cell's parse tree
-        self.ref_visitor.set_sheet_name(sheet_name)
-        if updated_cell.pt:
-            self.ref_visitor.visit(updated_cell.pt)
+        # Get list of references (parents) and cell ranges from updated_cell's
+        # formula
+        parent_refs, range_refs = [], []
+        if updated_cell.template:
+            parent_refs = [
+                (ref_sheet or sheet_name.lower(), ref)
+                for ref_sheet, ref in
+                updated_cell.template.refs_at(*updated_cell.loc)
+            ]
+            range_refs = [
+                (ref_sheet or sheet_name.lower(), start, end)
+                for ref_sheet, start, end in
+                updated_cell.template.ranges_at(*updated_cell.loc)
+            ]
+
+        # Clear invalid sheet refs, then regenerate new parents and children
+        # relationships
+        self.orphans.remove(updated_cell)
+        self.reevaluate_refs(updated_cell, parent_refs, range_refs)
+
+        if updated_cell.template and \
+                updated_cell.template.funcs & functions.volatile_functions:
+            self.volatile_cells.add(updated_cell)
+        else:
+            self.volatile_cells.discard(updated_cell)
+
+        # Keep the topological order up to date with the new references
+        in_order = self.topo_order.add_edges(
+            updated_cell, self.cell_parents(updated_cell))
+
+        # In a batch, recalculation and notifications wait until it ends
+        if self._batch_cells is not None:
+            for cell, val in initial_vals.items():
+                self._batch_vals.setdefault(cell, val)
+            self._batch_cells[updated_cell] = in_order and \
+                self._batch_cells.get(updated_cell, True)
+            return
+
+        self.apply_changes({updated_cell: in_order}, initial_vals)
+
+    def apply_changes(self, updated_cells: Dict[Cell, bool],
+                      initial_vals: Dict[Cell, Any]) -> None:
+        """Recalculates the updated cells and every cell that depends on them
+        as the calculation mode says and notifies of the changed values, or
+        in MANUAL mode adds them to the pending cells."""
+
+        if self.calculation_mode == CalculationMode.MANUAL:
+            for cell, val in initial_vals.items():
+                self._pending_vals.setdefault(cell, val)
+            for cell, in_order in updated_cells.items():
+                self.pending_cells[cell] = in_order and \
+                    self.pending_cells.get(cell, True)
+            self._stale_cells = None
+            return
+
+        self.update_dependents(updated_cells, initial_vals,
+                               self.calculation_mode == CalculationMode.LAZY)
+        self.notify_changed_values(initial_vals)
+
+    def update_dependents(self, updated_cells: Dict[Cell, bool],
+                          initial_vals: Dict[Cell, Any],
+                          lazy: bool = False) -> None:
+        """Recalculates the updated cells and every cell that depends on them,
+        or if lazy marks the formulas among them as dirty. updated_cells maps
+        each cell to whether its new references kept the topological order,
+        and initial_vals collects the values cells had before being
+        recalculated.
+        """
 
-        # Regenerate new parents and children relationships
-        self.reevaluate_refs(updated_cell)
+        # Read the cells to update off the topological order. Only if the new
+        # references close a cycle, or the cells to update already contain
+        # one, is there a need to look for cycles among them.
+        if len(updated_cells) > 1 and all(updated_cells.values()):
+            ordered = self.topo_order.cone(updated_cells)
+            if ordered is not None:
+                self.calculate_cells(ordered, initial_vals, lazy,
+                                     updated_cells)
+                return
+
+        marked: Set[Cell] = set()
+        for updated_cell in sorted(updated_cells, key=lambda c: c.order):
+            # A cell on a cycle that an earlier cell reaches has been marked
+            # along with the rest of the cycle
+            if updated_cell in marked:
+                continue
+            # Evaluating INDIRECT can change edges, so the generation is read
+            # again for every cell
+            generation = self.graph.generation
+            # Orders read while the edges were the same still hold, even for
+            # a cell whose new references don't keep the order
+            cells = self.order_cache.get(updated_cell, generation)
+            if isinstance(cells, Condensation):
+                self.calculate_cycles(cells, initial_vals, lazy, updated_cell)
+                marked.update(*cells.cycles)
+                continue
+            if cells is None and updated_cells[updated_cell]:
+                cells = self.topo_order.cone([updated_cell])
+                if cells is not None:
+                    self.order_cache.put(updated_cell, generation, cells)
+            if cells is None and \
+                    self.graph.cells[updated_cell.id] is not updated_cell:
+                # An emptied cell has left the graph, so cycles are looked
+                # for from the cells that referenced it
+                self.calculate_cells([updated_cell], initial_vals, lazy,
+                                     [updated_cell])
+                self.update_dependents(
+                    {c: False for c in self.cell_children(updated_cell)},
+                    initial_vals, lazy)
+                continue
+            if cells is None:
+                cycle_exists, scc_ids = util.detect_cycle(
+                    updated_cell.id, self.cell_child_ids)
+                # If a cycle exists, then the cells on cycles are marked and
+                # the others evaluated in order of the condensation, which is
+                # kept for later edits. Otherwise, we evaluate cells in order
+                # of the topological sort
+                if cycle_exists:
+                    condensation = Condensation(
+                        scc_ids, self.cell_child_ids, self.graph.cell)
+                    self.order_cache.put(updated_cell, generation,
+                                         condensation)
+                    self.calculate_cycles(condensation, initial_vals, lazy,
+                                          updated_cell)
+                    marked.update(*condensation.cycles)
+                    continue
+
+                cells = [self.graph.cell(i) for i in util.topological_sort(
+                    updated_cell.id, self.cell_child_ids)]
+                self.topo_order.repair(cells)
+                self.order_cache.put(updated_cell, generation, cells)
+            self.calculate_cells(cells, initial_vals, lazy, [updated_cell])
+
+    def calculate_cycles(self, condensation: Condensation,
+                         initial_vals: Dict[Cell, Any], lazy: bool,
+                         root: Cell) -> None:
+        """Marks the cells on cycles among the root and the cells depending on
+        it as circular references, and recalculates the others as
+        calculate_cells does. Only the cells that a newly marked cell, or the
+        root, changes need to be evaluated."""
+
+        # The root's component is the only one that nothing in the
+        # condensation reads, so it comes first unless it's on a cycle
+        roots = condensation.cells[:1] if condensation.cells and \
+            condensation.cells[0] is root else []
+        for component in condensation.cycles:
+            for cell in component:
+                self.dirty_cells.discard(cell)
+                if isinstance(cell.val, CellError) and cell.val.get_type() \
+                        == CellErrorType.CIRCULAR_REFERENCE:
+                    continue
+                if cell not in initial_vals:
+                    initial_vals[cell] = cell.val
+                roots.extend(self.cell_children(cell))
+                cell.val = CellError(
+                    CellErrorType.CIRCULAR_REFERENCE,
+                    error_desc[CellErrorType.CIRCULAR_REFERENCE])
+                cell.val_type = CellType.ERROR
+        self.calculate_cells(condensation.cells, initial_vals, lazy, roots)
+
+    def calculate_cells(self, cells: List[Cell],
+                        initial_vals: Dict[Cell, Any], lazy: bool,
+                        roots: Iterable[Cell]) -> None:
+        """Evaluates the roots and the cells depending on them, given in
+        topological order, or if lazy marks the formulas among them as
+        dirty."""
+
+        if not lazy:
+            self.evaluate_cells(cells, initial_vals, roots)
+            return
+
+        for cell in cells:
+            if cell not in initial_vals:
+                initial_vals[cell] = cell.val
+            if cell.contents and cell.contents[0] == "=":
+                self.dirty_cells.add(cell)
+            else:
+                self.dirty_cells.discard(cell)
 
-        # For self-reference
-        self.ref_visitor.reset_refs()
+    def evaluate_dirty(self, cells: Iterable[Cell],
+                       initial_vals: Dict[Cell, Any]) -> None:
+        """Evaluates the dirty cells among the given cells, after the dirty
+        cells they depend on. A cell may be read, and so evaluated, while
+        another formula is being evaluated, so this uses its own evaluators.
 
-        # Clear invalid sheet refs
-        updated_cell.invalid_sheet_refs.clear()
+        Each cell stays dirty until it is evaluated, so a formula reading a
+        cell through INDIRECT partway through the pass evaluates the cells
+        that one depends on first, and the cells it evaluates are skipped.
+        """
 
-        # Cycle detection and finding neighbors
-        cycle_exists, scc_arr = util.detect_cycle(updated_cell)
+        cells = list(cells)
+        while True:
+            stale = self.topo_order.search(
+                [c for c in cells if c in self.dirty_cells],
+                self.cell_parents, lambda c: c in self.dirty_cells)
+            if not stale:
+                return
+
+            context, transformer = self.context, self.transformer
+            self.context, self.transformer = EvalContext(self), \
+                EvalExpressions(self)
+            try:
+                self.evaluate_cells(
+                    (c for c in sorted(stale, key=lambda c: c.order)
+                     if c in self.dirty_cells), initial_vals)
+            finally:
+                self.context, self.transformer = context, transformer
 
-        # If a cycle exists, then propagate errors to all of its neighbors.
-        # Otherwise, we evaluate cells in order of the topological sort
-        if cycle_exists:
-            for scc in scc_arr:
-                for cell in scc:
-                    if cell not in initial_vals:
-                        initial_vals[cell] = cell.val
+    def set_calculation_mode(self, mode: CalculationMode) -> None:
+        """Set when cells depending on a changed cell are recalculated.
 
-                    cell.val = CellError(
-                        CellErrorType.CIRCULAR_REFERENCE,
-                        error_desc[CellErrorType.CIRCULAR_REFERENCE]
-                    )
-                    cell.val_type = CellType.ERROR
+        Switching out of LAZY mode recalculates every dirty cell, and
+        switching out of MANUAL mode recalculates everything pending.
+
+        Args:
+            mode: The new calculation mode.
+
+        Returns:
+            None.
+        """
+
+        previous, self.calculation_mode = self.calculation_mode, mode
+        if previous == mode:
+            return
+        if previous == CalculationMode.MANUAL:
+            if mode == CalculationMode.AUTOMATIC:
+                self.recalculate()
+                return
+
+            # Every pending and dirty cell may have changed
+            updated_cells, initial_vals = self.pop_pending()
+            for cell in self.dirty_cells:
+                initial_vals.setdefault(cell, cell.val)
+            self.update_dependents(updated_cells, initial_vals, True)
+            self.notify_changed_values(initial_vals)
+        elif mode == CalculationMode.AUTOMATIC:
+            # Dirty cells have already been notified of
+            self.evaluate_dirty(list(self.dirty_cells), {})
+
+    def pop_pending(self) -> Tuple[Dict[Cell, bool], Dict[Cell, Any]]:
+        """Returns the pending cells and their initial values, clearing
+        them."""
+
+        updated_cells, initial_vals = self.pending_cells, self._pending_vals
+        self.pending_cells, self._pending_vals = {}, {}
+        self._stale_cells = None
+        return updated_cells, initial_vals
+
+    def recalculate(self, sheet_names: Optional[Iterable[str]] = None) \
+            -> None:
+        """Recalculate the cells waiting to be recalculated in MANUAL mode.
+
+        Every cell changed since the last recalculation, and every cell that
+        depends on them, is recalculated in a single pass in topological
+        order, and the notification functions are called once with every
+        cell whose value changed.
+
+        If sheet names are given, only cells on those sheets (and the cells on
+        other sheets that they read) are recalculated; cells on other sheets
+        stay stale until they are recalculated.
+
+        The sheet name match is case-insensitive; the text must match but the
+        case does not have to.
+
+        If a specified sheet name is not found, a KeyError is raised.
+
+        Args:
+            sheet_names: The names of the sheets to recalculate, or None to
+            recalculate the whole workbook.
+
+        Returns:
+            None.
+
+        Raises:
+            KeyError: Raises an exception.
+        """
+
+        if sheet_names is not None:
+            names = set()
+            for sheet_name in sheet_names:
+                if sheet_name.lower() not in self.sheet_names_lower_to_orig:
+                    raise KeyError("Sheet name not found.")
+                names.add(self.sheet_names_lower_to_orig[sheet_name.lower()])
+
+        # Mark everything that needs recalculating, including cells left
+        # stale by earlier recalculations, then evaluate what was asked for
+        updated_cells, initial_vals = self.pop_pending()
+        self.update_dependents(updated_cells, initial_vals, True)
+        if sheet_names is None:
+            self.evaluate_dirty(list(self.dirty_cells), initial_vals)
         else:
-            self.evaluate_cell(updated_cell, initial_vals)
-
-        final_vals = {cell: cell.val for cell in initial_vals}
-        changed_cells = [
-            (cell.sheet_name,
-             util.stringify_cell_loc(cell.loc[0], cell.loc[1]))
-            for cell in final_vals if initial_vals[cell] != final_vals[cell]
-            and cell.sheet_name != self._sheet_being_deleted
-        ]
+            self.evaluate_dirty([c for c in self.dirty_cells
+                                 if c.sheet_name in names], initial_vals)
+        self.notify_changed_values(initial_vals)
+
+    def recalculate_volatile(self) -> None:
+        """Recalculate the cells whose formulas call volatile functions, such
+        as NOW and RAND, which can change value without any cell changing.
+
+        The volatile cells and every cell that depends on them are
+        recalculated in a single pass in topological order, or in LAZY mode
+        marked as needing recalculation, and the notification functions are
+        called once with every cell whose value changed.
+
+        Returns:
+            None.
+        """
+
+        if not self.volatile_cells:
+            return
+        initial_vals: Dict[Cell, Any] = {}
+        self.update_dependents({c: True for c in self.volatile_cells},
+                               initial_vals,
+                               self.calculation_mode == CalculationMode.LAZY)
+        self.notify_changed_values(initial_vals)
+
+    def is_cell_stale(self, sheet_name: str, location: str) -> bool:
+        """Return whether the value of the specified cell is waiting to be
+        recalculated, so get_cell_value would return an out-of-date value.
+
+        This only happens in MANUAL mode, before recalculate() is called;
+        in LAZY mode a stale value is recalculated when it is read.
+
+        The sheet name match is case-insensitive; the text must match but the
+        case does not have to.  Additionally, the cell location can be
+        specified in any case.
+
+        If the specified sheet name is not found, a KeyError is raised.
+        If the cell location is invalid, a ValueError is raised.
+
+        Args:
+            sheet_name: The name of the sheet.
+            location: The cell location.
+
+        Returns:
+            Whether the value at location is stale.
+
+        Raises:
+            KeyError: Raises an exception.
+        """
+
+        cell = self.get_cell_instance(sheet_name, location)
+        if cell is None or not cell.contents or cell.contents[0] != "=":
+            return False
+        if cell in self.dirty_cells:
+            return True
+        if not self.pending_cells:
+            return False
+
+        if self._stale_cells is None:
+            self._stale_cells = TopologicalOrder.search(
+                self.pending_cells, self.cell_children, lambda c: True)
+        return cell in self._stale_cells
+
+    def notify_changed_values(self, initial_vals: Dict[Cell, Any]) -> None:
+        """Calls the notification functions with the location of every cell
+        whose value is no longer its initial value, or in LAZY mode may no
+        longer be because it is dirty. Each location is reported once, and
+        cells on sheets being deleted are not reported.
+        """
+
+        changed_cells = []
+        seen = set()
+        for cell, initial_val in initial_vals.items():
+            idx = self.sheet_name_to_idx.get(cell.sheet_name)
+            if idx is None or cell.sheet_name == self._sheet_being_deleted \
+                    or (cell.sheet_name, cell.loc) in seen:
+                continue
+            seen.add((cell.sheet_name, cell.loc))
+
+            # The cell may have been emptied and replaced in a batch
+            cur_cell = self.sheet_arr[idx].loc_to_cell.get(cell.loc)
+            final_val = cur_cell.val if cur_cell else None
+            if initial_val != final_val or \
+                    (self.calculation_mode == CalculationMode.LAZY and
+                     cur_cell in self.dirty_cells):
+                changed_cells.append(
+                    (cell.sheet_name,
+                     util.stringify_cell_loc(cell.loc[0], cell.loc[1])))
         self.call_notify_functions(changed_cells)
 
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Return a context manager that groups changes to the workbook into a
+        batch.
+
+        Inside the batch, cell contents are stored and references are updated
+        as usual, but no cells are recalculated, so cell values are only up to
+        date once the batch ends. When the batch ends, every cell that was
+        changed and every cell depending on them is recalculated in a single
+        pass, and the notification functions are called once with every cell
+        whose value changed. This happens even if the batch ends with an
+        exception.
+
+        Batches may be nested; only the outermost batch recalculates.
+
+        Example:
+            with wb.batch():
+                for i in range(1, 100):
+                    wb.set_cell_contents("Sheet1", f"A{i}", str(i))
+
+        Returns:
+            A context manager.
+        """
+
+        if self._batch_cells is not None:
+            yield
+            return
+
+        self._batch_cells = {}
+        self._batch_vals = {}
+        try:
+            yield
+        finally:
+            updated_cells, initial_vals = self._batch_cells, self._batch_vals
+            self._batch_cells = None
+            self._batch_vals = {}
+            self.apply_changes(updated_cells, initial_vals)
+
+    def set_cells_contents(self, sheet_name: str,
+                           contents: Dict[str, Optional[str]]) -> None:
+        """Set the contents of several cells on the specified sheet as one
+        batch, so that the cells depending on them are recalculated once
+        rather than once per changed cell.
+
+        Each cell's contents are handled as by set_cell_contents(). The sheet
+        name match is case-insensitive.
+
+        If the specified sheet name is not found, a KeyError is raised and no
+        cells are changed. If a cell location is invalid, a ValueError is
+        raised; the cells before it have been changed and recalculated.
+
+        Args:
+            sheet_name: The name of the sheet to be updated.
+            contents: A mapping from cell location to the content to be
+            inserted at that location.
+
+        Returns:
+            None.
+
+        Raises:
+            KeyError: Raises an exception.
+            ValueError: Raises an exception.
+        """
+
+        if sheet_name.lower() not in self.sheet_names_lower_to_orig:
+            raise KeyError("Sheet name not found.")
+
+        with self.batch():
+            for location, cell_contents in contents.items():
+                self.set_cell_contents(sheet_name, location, cell_contents)
+
     def move_copy_cells_helper(self, sheet_name: str, start_location: str,
                                end_location: str, to_location: str,
                                copying: bool, to_sheet: Optional[str] = None) \
@@ -879,8 +1682,6 @@ class Workbook:
         if sheet_name.lower() not in self.sheet_names_lower_to_orig:
             raise KeyError
         sheet_name = self.sheet_names_lower_to_orig[sheet_name.lower()]
-        src_sheet_idx = self.sheet_name_to_idx[sheet_name]
-        src_sheet = self.sheet_arr[src_sheet_idx]
 
         # Check if to_sheet exists. If so, check if the sheet name is valid
         # If not, we are using current sheet
@@ -909,37 +1710,34 @@ class Workbook:
         d_cols = to_tl[0] - src_tl[0]
         d_rows = to_tl[1] - src_tl[1]
 
-        # Store source area cells (dict?), changing their info
-        # change sheet name if moving to another sheet
-        cells: Deque[Tuple] = deque()
-        for c in range(src_tl[0], src_br[0] + 1):
-            for r in range(src_tl[1], src_br[1] + 1):
-                loc_str = util.stringify_cell_loc(c, r)
-                cur_cell = self.get_cell_instance(sheet_name, loc_str)
-                if cur_cell:
-                    cells.append((c, r, cur_cell.contents, cur_cell.pt))
-                    if not copying:
-                        # Make cells in source area empty
-                        self.set_cell_contents(sheet_name, loc_str, None)
-
-                        # Delete cell if it has no children
-                        if not cur_cell.children:
-                            src_sheet.loc_to_cell.pop((c, r), None)
-
-        # Iterate over area starting at to-location locations and fill in
-        while cells:
-            old_c, old_r, contents, pt = cells.popleft()
-            new_loc = util.stringify_cell_loc(old_c + d_cols, old_r + d_rows)
-            self.move_visitor.set_deltas(d_cols, d_rows)
-
-            # Update contents formula based on how far the move is
-            if pt:
-                self.move_visitor.visit(pt)
-                # Reconstruct formula with updated parse tree
-                contents = "=" + \
-                    Reconstructor(self.parser).reconstruct(pt)
-
-            self.set_cell_contents(tgt_sheet_name, new_loc, contents)
+        with self.batch():
+            # Store source area cells (dict?), changing their info
+            # change sheet name if moving to another sheet
+            cells: Deque[Tuple] = deque()
+            for c in range(src_tl[0], src_br[0] + 1):
+                for r in range(src_tl[1], src_br[1] + 1):
+                    loc_str = util.stringify_cell_loc(c, r)
+                    cur_cell = self.get_cell_instance(sheet_name, loc_str)
+                    if cur_cell:
+                        cells.append((c, r, cur_cell.contents,
+                                      cur_cell.template))
+                        if not copying:
+                            # Make cells in source area empty
+                            self.set_cell_contents(sheet_name, loc_str, None)
+
+            # Iterate over area starting at to-location locations and fill in
+            while cells:
+                old_c, old_r, contents, template = cells.popleft()
+                new_c, new_r = old_c + d_cols, old_r + d_rows
+                new_loc = util.stringify_cell_loc(new_c, new_r)
+
+                # Update contents formula based on how far the move is
+                if template:
+                    # Reconstruct formula with the template moved to new_loc
+                    contents = "=" + util.get_reconstructor().reconstruct(
+                        template.tree_at(new_c, new_r))
+
+                self.set_cell_contents(tgt_sheet_name, new_loc, contents)
 
     def move_cells(self, sheet_name: str, start_location: str,
                    end_location: str, to_location: str,
@@ -1167,22 +1965,21 @@ class Workbook:
                     cell = self.get_cell_instance(sht_name, loc)
                     row_to_contents[tgt_row].append((
                         cell.contents if cell else None,
-                        cell.pt if cell else None
+                        cell.template if cell else None
                     ))
 
             if cur_row in row_to_contents:
                 contents = row_to_contents[cur_row]
                 for c in range(tl[0], br[0] + 1):
                     loc = util.stringify_cell_loc(c, tgt_row)
-                    self.move_visitor.set_deltas(0, tgt_row - cur_row)
 
                     # Update contents formula based on how far the move is
-                    pt = contents[c-tl[0]][1]
+                    template = contents[c-tl[0]][1]
                     new_contents = contents[c-tl[0]][0]
-                    if pt:
-                        self.move_visitor.visit(pt)
+                    if template:
                         new_contents = "=" + \
-                            Reconstructor(self.parser).reconstruct(pt)
+                            util.get_reconstructor().reconstruct(
+                                template.tree_at(c, tgt_row))
 
                     self.set_cell_contents(sht_name, loc, new_contents)
             else:
@@ -1276,7 +2073,130 @@ class Workbook:
         """
 
         cell = self.get_cell_instance(sheet_name, location)
-        return cell.val if cell else None
+        if cell is None:
+            return None
+        if self.calculation_mode == CalculationMode.LAZY and \
+                cell in self.dirty_cells:
+            self.evaluate_dirty([cell], {})
+        return cell.val
+
+    def compile_function(self, inputs: List[Tuple[str, str]],
+                         outputs: List[Tuple[str, str]]) -> CompiledFunction:
+        """Compile the cells between the specified input and output cells
+        into a function that takes the values of the inputs and returns the
+        values of the outputs, without setting or reading any cell in the
+        workbook. The cells the formulas between them read, other than the
+        inputs, keep the values they have when the function is compiled.
+
+        Cells are given as (sheet name, location) pairs. The sheet name match
+        is case-insensitive; the text must match but the case does not have
+        to. Additionally, the cell location can be specified in any case.
+
+        If a specified sheet name is not found, a KeyError is raised.
+
+        Args:
+            inputs: The cells whose values the function takes, in order.
+            outputs: The cells whose values the function returns, in order.
+
+        Returns:
+            The compiled function.
+
+        Raises:
+            KeyError: Raises an exception.
+            ValueError: If a location is invalid, or the cells between the
+                inputs and outputs call INDIRECT or contain a cycle.
+        """
+
+        def resolve(sheet_name: str, location: str) \
+                -> Tuple[Sheet, Tuple[int, int]]:
+            sheet_name = sheet_name.translate({39: None}).lower()
+            if sheet_name not in self.sheet_names_lower_to_orig:
+                raise KeyError("Sheet name not found.")
+            sheet = self.sheet_arr[self.sheet_name_to_idx[
+                self.sheet_names_lower_to_orig[sheet_name]]]
+            return sheet, util.quantify_cell_loc(location)
+
+        def key(cell: Cell) -> CellKey:
+            return (cell.sheet_name.lower(), cell.loc)
+
+        input_locs = [resolve(*ref) for ref in inputs]
+        output_locs = [resolve(*ref) for ref in outputs]
+        input_cells = {sheet.loc_to_cell[loc] for sheet, loc in input_locs
+                       if loc in sheet.loc_to_cell}
+
+        # The cells depending on the inputs, which may be empty
+        downstream: Set[Cell] = set()
+        stack: List[Cell] = []
+        for sheet, loc in input_locs:
+            cell = sheet.loc_to_cell.get(loc)
+            if cell is not None:
+                stack.extend(self.cell_children(cell))
+                continue
+            i = self.graph.location_ids.get((sheet, loc))
+            if i is not None:
+                stack.extend(self.graph.children_of(i))
+            stack.extend(sheet.range_index.lookup(*loc))
+        while stack:
+            cell = stack.pop()
+            if cell not in downstream:
+                downstream.add(cell)
+                stack.extend(self.cell_children(cell))
+
+        # Of those, the cells the outputs depend on
+        upstream: Set[Cell] = set()
+        stack = [sheet.loc_to_cell[loc] for sheet, loc in output_locs
+                 if loc in sheet.loc_to_cell]
+        while stack:
+            cell = stack.pop()
+            if cell not in upstream:
+                upstream.add(cell)
+                if cell not in input_cells:
+                    stack.extend(self.cell_parents(cell))
+        cone = {cell for cell in upstream & downstream
+                if cell not in input_cells and cell.template}
+        if any("INDIRECT" in cell.template.funcs for cell in cone):
+            raise ValueError("The cells between the inputs and outputs "
+                             "call INDIRECT.")
+
+        # Order the cone with Kahn's algorithm, keeping the values of the
+        # cells it reads outside of it
+        children = {}
+        parents_left = dict.fromkeys(cone, 0)
+        constants = set()
+        for cell in cone:
+            children[cell] = [c for c in self.cell_children(cell)
+                              if c in cone]
+            for c in children[cell]:
+                parents_left[c] += 1
+            constants.update(self.cell_parents(cell))
+        ready = [cell for cell, count in parents_left.items() if not count]
+        order = []
+        while ready:
+            cell = ready.pop()
+            order.append(cell)
+            for c in children[cell]:
+                parents_left[c] -= 1
+                if not parents_left[c]:
+                    ready.append(c)
+        if len(order) < len(cone):
+            raise ValueError("The cells between the inputs and outputs "
+                             "contain a cycle.")
+
+        constants.update(sheet.loc_to_cell[loc] for sheet, loc in output_locs
+                         if loc in sheet.loc_to_cell)
+        constants -= cone
+        constants -= input_cells
+        if self.calculation_mode == CalculationMode.LAZY:
+            self.evaluate_dirty(
+                [c for c in constants if c in self.dirty_cells], {})
+        return CompiledFunction(
+            [(sheet.name.lower(), loc) for sheet, loc in input_locs],
+            [(sheet.name.lower(), loc) for sheet, loc in output_locs],
+            [(key(cell), cell.sheet_name,
+              cell.template.offset(*cell.loc), cell.template)
+             for cell in order],
+            dict(self.sheet_names_lower_to_orig),
+            {key(cell): cell.val for cell in constants})
 
     @staticmethod
     def load_workbook(fp: TextIO) -> Workbook:
@@ -1311,12 +2231,13 @@ class Workbook:
 
         data = json.load(fp)
         wb = Workbook()
-        for sheet in data["sheets"]:
-            sheet_name = sheet["name"]
-            wb.new_sheet(sheet_name)
-            for loc in sheet["cell-contents"]:
-                contents = sheet["cell-contents"][loc]
-                wb.set_cell_contents(sheet_name, loc, contents)
+        with wb.batch():
+            for sheet in data["sheets"]:
+                sheet_name = sheet["name"]
+                wb.new_sheet(sheet_name)
+                for loc in sheet["cell-contents"]:
+                    contents = sheet["cell-contents"][loc]
+                    wb.set_cell_contents(sheet_name, loc, contents)
         return wb
 
     def save_workbook(self, fp: TextIO) -> None:
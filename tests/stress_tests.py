@@ -1,10 +1,19 @@
-from sheets.workbook import Workbook
+from sheets.workbook import Workbook, CalculationMode
+from sheets import util
+from sheets.template import TemplateCache
+from sheets.graph import OrderCache, RangeIndex
+from lark import Lark
+from decimal import Decimal
 import unittest
 import cProfile
+import time
+import tracemalloc
 from pstats import Stats
 
 
 class TestPerformanceStress(unittest.TestCase):
+    compile_formulas = True
+
     def setUp(self):
         self.profiler = cProfile.Profile()
         self.profiler.enable()
@@ -21,7 +30,7 @@ class TestPerformanceStress(unittest.TestCase):
         """Integration test for propagating updates through long chains of cell
         references, where each cell depends only on one other cell."""
 
-        wb = Workbook()
+        wb = Workbook(compile_formulas=self.compile_formulas)
         _, name = wb.new_sheet()
 
         wb.set_cell_contents(name, "a1", "=1")
@@ -34,7 +43,7 @@ class TestPerformanceStress(unittest.TestCase):
         """Integration test for cells that are referenced by many other cells,
         with shallow chains but large amounts of cell updates."""
 
-        wb = Workbook()
+        wb = Workbook(compile_formulas=self.compile_formulas)
         _, name = wb.new_sheet()
 
         wb.set_cell_contents(name, "a1", "=1")
@@ -49,7 +58,7 @@ class TestPerformanceStress(unittest.TestCase):
     def test_one_large_cycle(self):
         """Integration test for large cycles that contain many cells."""
 
-        wb = Workbook()
+        wb = Workbook(compile_formulas=self.compile_formulas)
         _, name = wb.new_sheet()
 
         wb.set_cell_contents(name, "a1", "=1")
@@ -62,7 +71,7 @@ class TestPerformanceStress(unittest.TestCase):
         """Integration test for many small cycles each containing a small
         number of cells."""
 
-        wb = Workbook()
+        wb = Workbook(compile_formulas=self.compile_formulas)
         _, name = wb.new_sheet()
 
         wb.set_cell_contents(name, "a1", "=1")
@@ -78,7 +87,7 @@ class TestPerformanceStress(unittest.TestCase):
         """Integration test for cell that is part of many different cycles.
         """
 
-        wb = Workbook()
+        wb = Workbook(compile_formulas=self.compile_formulas)
         _, name = wb.new_sheet()
 
         # b1=b2, b2=a1, a1=b1
@@ -93,6 +102,13 @@ class TestPerformanceStress(unittest.TestCase):
                              for i in range(1, 9999, 2)]))
 
 
+class TestPerformanceStressTransformer(TestPerformanceStress):
+    """The same workloads, evaluating formulas by walking their parse trees
+    with EvalExpressions instead of calling compiled formulas."""
+
+    compile_formulas = False
+
+
 class TestPerformanceStress2(unittest.TestCase):
     def setUp(self):
         self.profiler = cProfile.Profile()
@@ -130,5 +146,680 @@ class TestPerformanceStress2(unittest.TestCase):
         self.__class__.large_wb.copy_cells("Sheet3", "A1", "SE499", "A2")
 
 
+class TestParserPerformance(unittest.TestCase):
+    """Compares the shared LALR parser against building an Earley parser for
+    every workbook, which is what each workbook used to do."""
+
+    formulas = [
+        "=a1+b1*3",
+        "=Sheet1!a1 & \"foo\" & 'Other Sheet'!b2",
+        "=IF(AND(a1>0, b1<=10), SUM(a1:d100), -AVERAGE(Sheet2!b1:b50))",
+        "=" + "+".join(f"a{i}" for i in range(1, 201)),
+    ]
+
+    @staticmethod
+    def earley_parser():
+        return Lark.open(util.GRAMMAR_PATH, start="formula",
+                         maybe_placeholders=False)
+
+    def test_workbook_construction(self):
+        n = 20
+        start = time.perf_counter()
+        for _ in range(n):
+            self.earley_parser()
+        earley = (time.perf_counter() - start) / n
+
+        start = time.perf_counter()
+        for _ in range(n):
+            Workbook()
+        shared = (time.perf_counter() - start) / n
+
+        print(f"\nworkbook construction: earley {earley * 1e3:.2f} ms, "
+              f"shared lalr {shared * 1e3:.4f} ms")
+
+    def test_parse_throughput(self):
+        earley, lalr = self.earley_parser(), util.get_parser()
+        for f in self.formulas:
+            self.assertEqual(earley.parse(f), lalr.parse(f))
+
+            rates = []
+            for parser in (earley, lalr):
+                n, start = 0, time.perf_counter()
+                while time.perf_counter() - start < 0.5:
+                    parser.parse(f)
+                    n += 1
+                rates.append(n / (time.perf_counter() - start))
+            print(f"\n{f[:40]!r}: earley {rates[0]:.0f}/s, "
+                  f"lalr {rates[1]:.0f}/s ({rates[1] / rates[0]:.1f}x)")
+
+
+class TestTemplatePerformance(unittest.TestCase):
+    """Fills 100k formulas down ten sheets (sheets are capped at 9999 rows)
+    and compares sharing templates against parsing every cell's formula."""
+
+    sheets = 10
+    rows = 9999
+
+    def fill(self, templates):
+        wb = Workbook()
+        wb.templates = templates
+        for _ in range(self.sheets):
+            _, name = wb.new_sheet()
+            for i in range(1, self.rows + 1):
+                wb.set_cell_contents(name, f"b{i}", f"=a{i} * 2 + $a$1")
+        return wb
+
+    def test_filled_down_formulas(self):
+        results = []
+        for templates in (TemplateCache(0), TemplateCache()):
+            tracemalloc.start()
+            start = time.perf_counter()
+            wb = self.fill(templates)
+            elapsed = time.perf_counter() - start
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            results.append((elapsed, memory))
+            print(f"\nmaxsize {templates.maxsize}: {elapsed:.2f} s, "
+                  f"{memory / 2**20:.1f} MiB, "
+                  f"hit rate {templates.hit_rate():.4f}")
+            del wb
+
+        (t_off, m_off), (t_on, m_on) = results
+        print(f"templates saved {(m_off - m_on) / 2**20:.1f} MiB and "
+              f"{t_off - t_on:.2f} s")
+
+
+class TestRangeDependencyPerformance(unittest.TestCase):
+    """Times recording range dependencies and finding the formulas that read
+    a changed cell, which should not grow with the ranges' area. (Evaluating
+    a formula still reads every cell in its ranges.)"""
+
+    def test_range_area(self):
+        n = 10000
+        for rows, cols in ((10, 1), (9999, 1), (9999, 10), (9999, 100)):
+            index = RangeIndex()
+            start = time.perf_counter()
+            for i in range(1, n + 1):
+                index.add((i, 1, i + cols - 1, rows), i)
+            add = (time.perf_counter() - start) / n
+
+            start = time.perf_counter()
+            for i in range(1, n + 1):
+                index.lookup(i, i % rows + 1)
+            lookup = (time.perf_counter() - start) / n
+            print(f"\n{n} ranges of {rows}x{cols} cells: add {add * 1e6:.1f}"
+                  f" us, lookup {lookup * 1e6:.1f} us")
+
+
+class TestRecalculationPerformance(unittest.TestCase):
+    """Times the long chain and many cycles workloads without the profiler,
+    splitting building the graph from editing it once it's built."""
+
+    def time_edits(self, wb, name, edits):
+        start = time.perf_counter()
+        for loc, contents in edits:
+            wb.set_cell_contents(name, loc, contents)
+        return time.perf_counter() - start
+
+    def test_one_long_chain(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        build = self.time_edits(wb, name, [("a1", "=1")] + [
+            (f"a{i}", f"=a{i-1}") for i in range(2, 9999)])
+        edit = self.time_edits(wb, name, [
+            ("a1", str(i)) for i in range(20)]) / 20
+        print(f"\none long chain: build {build:.2f} s, "
+              f"edit head {edit * 1e3:.1f} ms")
+
+    def test_one_cell_many_cycles(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        edits = []
+        for i in range(1, 9999, 2):
+            edits += [(f"b{i}", f"=b{i+1}"), (f"b{i+1}", "=a1")]
+        build = self.time_edits(wb, name, edits)
+        close = self.time_edits(wb, name, [
+            ("a1", "=" + "+".join(f"b{i}" for i in range(1, 9999, 2)))])
+        edit = self.time_edits(wb, name, [("b3", "=b4+1")])
+        print(f"\none cell many cycles: build {build:.2f} s, "
+              f"close cycles {close:.2f} s, edit in cycle {edit:.2f} s")
+
+
+class TestBatchPerformance(unittest.TestCase):
+    """Pastes a column of inputs that a sum depends on, one cell at a time
+    and then as one batch."""
+
+    def test_paste_column(self):
+        n = 1000
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cells_contents(name, {f"b{i}": f"=a{i}*2"
+                                     for i in range(1, n + 1)})
+        wb.set_cell_contents(name, "c1", f"=SUM(b1:b{n})")
+
+        start = time.perf_counter()
+        for i in range(1, n + 1):
+            wb.set_cell_contents(name, f"a{i}", str(i))
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        wb.set_cells_contents(name, {f"a{i}": str(i + 1)
+                                     for i in range(1, n + 1)})
+        batch = time.perf_counter() - start
+        print(f"\npaste {n} cells: one at a time {single:.2f} s, "
+              f"batch {batch:.3f} s ({single / batch:.0f}x)")
+
+
+class TestLazyPerformance(unittest.TestCase):
+    """Edits the inputs of a long chain of formulas many times, reading only
+    the summary at its end now and then, in each calculation mode."""
+
+    def run_edits(self, mode):
+        n, edits = 1000, 200
+        wb = Workbook(calculation_mode=mode)
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "a1", "0")
+        for i in range(2, n + 1):
+            wb.set_cell_contents(name, f"a{i}", f"=a{i - 1}+1")
+        wb.get_cell_value(name, f"a{n}")
+
+        evaluated = 0
+        evaluate_serial = wb.evaluate_serial
+
+        def counting(cells, initial_vals):
+            nonlocal evaluated
+            cells = list(cells)
+            evaluated += len(cells)
+            evaluate_serial(cells, initial_vals)
+        wb.evaluate_serial = counting
+
+        start = time.perf_counter()
+        for i in range(1, edits + 1):
+            wb.set_cell_contents(name, "a1", str(i))
+            if i % 50 == 0:
+                self.assertEqual(wb.get_cell_value(name, f"a{n}"),
+                                 Decimal(i + n - 1))
+        return time.perf_counter() - start, evaluated
+
+    def test_edits_between_reads(self):
+        auto_time, auto_evals = self.run_edits(CalculationMode.AUTOMATIC)
+        lazy_time, lazy_evals = self.run_edits(CalculationMode.LAZY)
+        print(f"\nautomatic: {auto_evals} evaluations, {auto_time:.2f} s; "
+              f"lazy: {lazy_evals} evaluations, {lazy_time:.2f} s")
+
+
+class TestManualPerformance(unittest.TestCase):
+    """Runs a script of edits to the inputs of a sum and a chain reading it,
+    then reads the result, in each calculation mode."""
+
+    def run_script(self, mode):
+        n = 1000
+        wb = Workbook(calculation_mode=mode)
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "b1", f"=SUM(a1:a{n})")
+        for i in range(2, 201):
+            wb.set_cell_contents(name, f"b{i}", f"=b{i - 1}+1")
+
+        start = time.perf_counter()
+        for i in range(1, n + 1):
+            wb.set_cell_contents(name, f"a{i}", str(i))
+        if mode == CalculationMode.MANUAL:
+            wb.recalculate()
+        self.assertEqual(wb.get_cell_value(name, "b200"),
+                         Decimal(n * (n + 1) // 2 + 199))
+        return time.perf_counter() - start
+
+    def test_scripted_edits(self):
+        auto = self.run_script(CalculationMode.AUTOMATIC)
+        manual = self.run_script(CalculationMode.MANUAL)
+        print(f"\n1000 edits: automatic {auto:.2f} s, manual {manual:.3f} s "
+              f"({auto / manual:.0f}x)")
+
+
+class TestParallelPerformance(unittest.TestCase):
+    """Recalculates a wide, shallow model, where every formula reads one
+    shared input, with different numbers of worker processes."""
+
+    def recalc_time(self, workers):
+        rows, cols = 5000, "bcd"
+        wb = Workbook(workers=workers)
+        _, name = wb.new_sheet()
+        with wb.batch():
+            wb.set_cell_contents(name, "a1", "1")
+            for col in cols:
+                for i in range(1, rows + 1):
+                    wb.set_cell_contents(
+                        name, f"{col}{i}",
+                        f"=$a$1*{i}+IF($a$1>0, {i}/7, 1)&\"\"")
+
+        times = []
+        for i in range(2, 5):
+            start = time.perf_counter()
+            wb.set_cell_contents(name, "a1", str(i))
+            times.append(time.perf_counter() - start)
+        self.assertEqual(wb.get_cell_value(name, "b10"),
+                         str(40 + Decimal(10) / 7))
+        if wb.parallel:
+            wb.parallel.shutdown()
+        return min(times), len(cols) * rows
+
+    def test_worker_scaling(self):
+        print()
+        for workers in (1, 2, 4, 8):
+            best, cells = self.recalc_time(workers)
+            print(f"{workers} workers: {best:.3f} s, "
+                  f"{cells / best:.0f} cells/s")
+
+
+class TestEarlyCutoffPerformance(unittest.TestCase):
+    """Edits an input that a clamp absorbs, in front of a long chain."""
+
+    def test_absorbed_edits(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "a1", "1")
+        wb.set_cell_contents(name, "b1", "=IF(a1>0, 1, 0)")
+        for i in range(2, 5001):
+            wb.set_cell_contents(name, f"b{i}", f"=b{i - 1}+1")
+
+        start = time.perf_counter()
+        for i in range(2, 102):
+            wb.set_cell_contents(name, "a1", str(i))
+        elapsed = time.perf_counter() - start
+        self.assertEqual(wb.get_cell_value(name, "b5000"), Decimal(5000))
+        print(f"\n100 absorbed edits before a 5000-cell chain: "
+              f"{elapsed:.3f} s")
+
+
+class TestGraphMemory(unittest.TestCase):
+    """Builds a workbook of a million cells, half of them formulas reading
+    the cells beside them, and reports the memory it takes."""
+
+    def test_million_cells(self):
+        rows, cols = 10000 - 1, 50
+        tracemalloc.start()
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        for c in range(1, cols + 1):
+            col = util.stringify_cell_loc(c, 1)[:-1]
+            formula_col = util.stringify_cell_loc(c + cols, 1)[:-1]
+            with wb.batch():
+                for r in range(1, rows + 1):
+                    wb.set_cell_contents(name, f"{col}{r}", str(r))
+                    wb.set_cell_contents(name, f"{formula_col}{r}",
+                                         f"={col}{r}+{col}1")
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"\n{2 * rows * cols} cells: {current / 2 ** 20:.0f} MiB "
+              f"(peak {peak / 2 ** 20:.0f} MiB)")
+
+
+class TestEmptyReferencePerformance(unittest.TestCase):
+    """Fills ten columns of formulas reading two empty columns down every
+    row, as a template laid out before its inputs are entered."""
+
+    def test_template_over_empty_rows(self):
+        rows, cols = 9999, "cdefghijkl"
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        start = time.perf_counter()
+        with wb.batch():
+            for r in range(1, rows + 1):
+                for c in cols:
+                    wb.set_cell_contents(name, f"{c}{r}", f"=a{r}*b{r}")
+        elapsed = time.perf_counter() - start
+        self.assertEqual(wb.get_sheet_extent(name), (12, rows))
+        print(f"\n{rows * len(cols)} formulas over empty rows: "
+              f"{elapsed:.2f} s, "
+              f"{len(wb.sheet_arr[0].loc_to_cell)} cells in the sheet")
+
+        start = time.perf_counter()
+        with wb.batch():
+            for r in range(1, rows + 1):
+                wb.set_cell_contents(name, f"a{r}", str(r))
+                wb.set_cell_contents(name, f"b{r}", "2")
+        elapsed = time.perf_counter() - start
+        self.assertEqual(wb.get_cell_value(name, f"l{rows}"), 2 * rows)
+        print(f"Filling in {2 * rows} inputs: {elapsed:.2f} s")
+
+
+class TestOrphanPerformance(unittest.TestCase):
+    """Creates sheets one at a time in a workbook where 19998 formulas
+    reference sheets that don't exist yet."""
+
+    def test_new_sheets_with_orphans(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        with wb.batch():
+            for r in range(1, 10000):
+                for c in "ab":
+                    wb.set_cell_contents(name, f"{c}{r}",
+                                         f"=Later{r % 500}!A1+1")
+
+        start = time.perf_counter()
+        for i in range(200):
+            wb.new_sheet(f"Other{i}")
+        elapsed = time.perf_counter() - start
+        print(f"\n200 unrelated sheets: {elapsed:.3f} s")
+
+        start = time.perf_counter()
+        for i in range(200):
+            wb.new_sheet(f"Later{i}")
+        elapsed = time.perf_counter() - start
+        self.assertEqual(wb.get_cell_value(name, "a1000"), 1)
+        print(f"200 sheets resolving 40 formulas each: {elapsed:.3f} s")
+
+
+class TestIndirectPerformance(unittest.TestCase):
+    """Edits the targets of 5000 INDIRECT formulas one at a time, keeping
+    them up to date through their dependencies instead of recalculating the
+    whole workbook after every edit."""
+
+    def test_target_edits(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        with wb.batch():
+            for r in range(1, 5001):
+                wb.set_cell_contents(name, f"a{r}", str(r))
+                wb.set_cell_contents(name, f"b{r}", str(r))
+                wb.set_cell_contents(name, f"c{r}",
+                                     f"=INDIRECT(\"b\"&a{r})*2")
+
+        start = time.perf_counter()
+        for r in range(1, 101):
+            wb.set_cell_contents(name, f"b{r}", str(-r))
+        elapsed = time.perf_counter() - start
+        self.assertEqual(wb.get_cell_value(name, "c100"), -200)
+        print(f"\n100 edits read through INDIRECT: {elapsed:.3f} s")
+
+        # Without the dependencies, each edit needs every cell evaluated
+        cells = sorted(wb.sheet_arr[0].loc_to_cell.values(),
+                       key=lambda c: c.order)
+        start = time.perf_counter()
+        for r in range(1, 11):
+            wb.set_cell_contents(name, f"b{r}", str(r))
+            wb.evaluate_cells(cells, {})
+        elapsed = time.perf_counter() - start
+        print(f"10 edits, each followed by a full recalculation: "
+              f"{elapsed:.3f} s")
+
+
+class TestVolatilePerformance(unittest.TestCase):
+    """Recalculates 100 RAND cells, each read by a short chain, in a
+    workbook of 50000 cells."""
+
+    def test_recalculate_volatile(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        with wb.batch():
+            for r in range(1, 10000):
+                wb.set_cell_contents(name, f"a{r}", str(r))
+                for c in "bcde":
+                    wb.set_cell_contents(name, f"{c}{r}", f"=a{r}+1")
+            for r in range(1, 101):
+                wb.set_cell_contents(name, f"f{r}", "=RAND()")
+                wb.set_cell_contents(name, f"g{r}", f"=f{r}*2")
+                wb.set_cell_contents(name, f"h{r}", f"=g{r}+1")
+
+        start = time.perf_counter()
+        for _ in range(10):
+            wb.recalculate_volatile()
+        elapsed = time.perf_counter() - start
+        print(f"\n10 volatile recalculations: {elapsed:.3f} s")
+
+        cells = sorted(wb.sheet_arr[0].loc_to_cell.values(),
+                       key=lambda c: c.order)
+        start = time.perf_counter()
+        wb.evaluate_cells(cells, {})
+        elapsed = time.perf_counter() - start
+        print(f"1 whole-workbook recalculation: {elapsed:.3f} s")
+
+
+class TestOrderCachePerformance(unittest.TestCase):
+    """Edits one input read by 20000 cells over and over, where the change is
+    absorbed by the first formula, with and without cached orders."""
+
+    def test_repeated_edits(self):
+        for maxsize in (0, 64):
+            wb = Workbook()
+            wb.order_cache = OrderCache(maxsize)
+            _, name = wb.new_sheet()
+            with wb.batch():
+                wb.set_cell_contents(name, "a1", "1")
+                wb.set_cell_contents(name, "b1", "=IF(a1>0, 1, 0)")
+                for r in range(1, 5001):
+                    for c in "cdef":
+                        wb.set_cell_contents(name, f"{c}{r}", "=b1+1")
+
+            start = time.perf_counter()
+            for i in range(2, 102):
+                wb.set_cell_contents(name, "a1", str(i))
+            elapsed = time.perf_counter() - start
+            print(f"\n100 edits, cache size {maxsize}: {elapsed:.3f} s")
+
+
+class TestCondensationPerformance(unittest.TestCase):
+    """Edits a formula on the one cell many cycles workload 20 times, with
+    and without reusing the condensation of its cycles."""
+
+    def test_edit_in_cycle(self):
+        for maxsize in (0, 64):
+            wb = Workbook()
+            wb.order_cache = OrderCache(maxsize)
+            _, name = wb.new_sheet()
+            with wb.batch():
+                for i in range(1, 9999, 2):
+                    wb.set_cell_contents(name, f"b{i}", f"=b{i+1}")
+                    wb.set_cell_contents(name, f"b{i+1}", "=a1")
+                wb.set_cell_contents(name, "a1", "=" + "+".join(
+                    f"b{i}" for i in range(1, 9999, 2)))
+
+            start = time.perf_counter()
+            for i in range(20):
+                wb.set_cell_contents(name, "b3", f"=b4+{i}")
+            elapsed = time.perf_counter() - start
+            print(f"\n20 edits in cycle, cache size {maxsize}: "
+                  f"{elapsed:.3f} s")
+
+
+class TestSheetGraphPerformance(unittest.TestCase):
+    """Renames a sheet of 20000 cells 10 times, first while no other sheet
+    references it and then while one formula on another sheet does."""
+
+    def test_rename_sheet(self):
+        wb = Workbook()
+        wb.new_sheet("Big")
+        wb.new_sheet("Other")
+        with wb.batch():
+            for r in range(1, 5001):
+                wb.set_cell_contents("Big", f"a{r}", str(r))
+                for c in "bcd":
+                    wb.set_cell_contents("Big", f"{c}{r}", f"=a{r}*2")
+
+        for referenced in (False, True):
+            if referenced:
+                wb.set_cell_contents("Other", "a1", "=Big!a1")
+            start = time.perf_counter()
+            for i in range(10):
+                wb.rename_sheet(*(("Big", "Renamed"), ("Renamed", "Big"))[
+                    i % 2])
+            elapsed = time.perf_counter() - start
+            print(f"\n10 renames, referenced {referenced}: {elapsed:.3f} s")
+
+
+class TestCompileFunctionPerformance(unittest.TestCase):
+    """Evaluates a pricing model of 3 inputs, 200 formulas and 2 outputs, in
+    a workbook of 20000 other cells, by editing and reading cells and by
+    calling a compiled function."""
+
+    def test_throughput(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        with wb.batch():
+            for r in range(1, 5001):
+                for c in "fghi":
+                    wb.set_cell_contents(name, f"{c}{r}", str(r))
+            wb.set_cells_contents(name, {"a1": "100", "a2": "0.05",
+                                         "a3": "12", "b1": "=a1"})
+            for r in range(2, 201):
+                wb.set_cell_contents(
+                    name, f"b{r}", f"=b{r-1}*(1+$a$2/$a$3)+f{r}/1000")
+            wb.set_cell_contents(name, "c1", "=b200-a1")
+            wb.set_cell_contents(name, "c2", "=SUM(b1:b200)/200")
+        inputs = [(name, "a1"), (name, "a2"), (name, "a3")]
+        outputs = [(name, "c1"), (name, "c2")]
+        n = 200
+
+        start = time.perf_counter()
+        for i in range(n):
+            for (sheet, loc), val in zip(inputs, (100 + i, 0.05, 12)):
+                wb.set_cell_contents(sheet, loc, str(val))
+            [wb.get_cell_value(sheet, loc) for sheet, loc in outputs]
+        edits = n / (time.perf_counter() - start)
+
+        f = wb.compile_function(inputs, outputs)
+        start = time.perf_counter()
+        for i in range(n):
+            f(100 + i, 0.05, 12)
+        calls = n / (time.perf_counter() - start)
+        print(f"\nedit and read: {edits:.0f} evaluations/s, "
+              f"compiled function: {calls:.0f} evaluations/s")
+
+
+class TestPrecedentQueryPerformance(unittest.TestCase):
+    """Queries the transitive precedents and dependents of cells in a chain
+    of 5000 formulas, first cold and then from the caches."""
+
+    def test_queries(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        with wb.batch():
+            wb.set_cell_contents(name, "a1", "1")
+            for r in range(2, 5001):
+                wb.set_cell_contents(name, f"a{r}", f"=a{r-1}+1")
+        n = 100
+
+        for query, loc in ((wb.get_precedents, "a5000"),
+                           (wb.get_dependents, "a1")):
+            start = time.perf_counter()
+            query(name, loc, transitive=True)
+            cold = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(n):
+                query(name, loc, transitive=True)
+            warm = (time.perf_counter() - start) / n
+            print(f"\n{query.__name__}: cold {cold * 1000:.1f} ms, "
+                  f"warm {warm * 1000:.1f} ms")
+
+
+class TestLazyArgumentPerformance(unittest.TestCase):
+    """Recalculates 200 formulas whose untaken IF branch looks up a value in
+    a range of 2000 cells."""
+
+    def test_untaken_lookup(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        with wb.batch():
+            wb.set_cell_contents(name, "a1", "FALSE")
+            for r in range(1, 2001):
+                wb.set_cell_contents(name, f"b{r}", str(r))
+            for r in range(1, 201):
+                wb.set_cell_contents(
+                    name, f"c{r}", f"=IF($a$1, VLOOKUP({r}, $b$1:$b$2000, "
+                    f"1), 0)")
+
+        # The flag stays false but its value changes, so every formula is
+        # evaluated again
+        start = time.perf_counter()
+        for i in range(10):
+            wb.set_cell_contents(name, "a1", "0" if i % 2 else "FALSE")
+        print(f"\n10 edits: {time.perf_counter() - start:.3f}s")
+
+
+class TestConstantFoldingPerformance(unittest.TestCase):
+    """Recalculates 5000 formulas that each apply constant subexpressions to
+    one input cell."""
+
+    def test_recalculation(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        with wb.batch():
+            wb.set_cell_contents(name, "a1", "1000")
+            for r in range(1, 5001):
+                wb.set_cell_contents(
+                    name, f"b{r}", "=$a$1*(1+0.07)/12-SUM(1.50, 2.25)*"
+                    "(100-3*(2+1))+IF(TRUE, 10/4, 0)")
+
+        start = time.perf_counter()
+        for i in range(10):
+            wb.set_cell_contents(name, "a1", str(1000 + i))
+        print(f"\n10 edits: {time.perf_counter() - start:.3f}s")
+
+
+class TestSharedRangePerformance(unittest.TestCase):
+    """Recalculates 5000 formulas that each read the same 5000-cell range."""
+
+    def test_recalculation(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        with wb.batch():
+            for r in range(1, 5001):
+                wb.set_cell_contents(name, f"a{r}", str(r))
+                wb.set_cell_contents(name, f"b{r}",
+                                     f"=SUM($a$1:$a$5000)-a{r}")
+
+        start = time.perf_counter()
+        wb.set_cell_contents(name, "a1", "0")
+        print(f"\n1 edit: {time.perf_counter() - start:.3f}s")
+
+
+class TestOperatorChainPerformance(unittest.TestCase):
+    """Recalculates a formula adding up 5000 cells, with each engine."""
+
+    def test_long_chain(self):
+        formula = "=" + "+".join(f"a{r}" for r in range(1, 5001))
+        for compile_formulas in (True, False):
+            wb = Workbook(compile_formulas=compile_formulas)
+            _, name = wb.new_sheet()
+            with wb.batch():
+                for r in range(1, 5001):
+                    wb.set_cell_contents(name, f"a{r}", "1")
+                wb.set_cell_contents(name, "b1", formula)
+
+            start = time.perf_counter()
+            for i in range(10):
+                wb.set_cell_contents(name, "a1", str(i))
+            elapsed = time.perf_counter() - start
+            print(f"\ncompiled={compile_formulas}: 10 edits {elapsed:.3f}s, "
+                  f"value {wb.get_cell_value(name, 'b1')}")
+
+
+class TestLetPerformance(unittest.TestCase):
+    """Recalculates 200 formulas that use one lookup in a 2000-row table
+    three times, written out and bound once with LET."""
+
+    def test_repeated_lookup(self):
+        lookup = "VLOOKUP($c$1+{r}, $a$1:$b$2000, 2)"
+        formulas = {
+            "repeated": "=IF({l}>0, {l}*2, -{l})",
+            "LET": "=LET(v, {l}, IF(v>0, v*2, -v))"}
+        for kind, formula in formulas.items():
+            wb = Workbook()
+            _, name = wb.new_sheet()
+            with wb.batch():
+                wb.set_cell_contents(name, "c1", "0")
+                for r in range(1, 2001):
+                    wb.set_cell_contents(name, f"a{r}", str(r))
+                    wb.set_cell_contents(name, f"b{r}", str(1000 - r))
+                for r in range(1, 201):
+                    wb.set_cell_contents(name, f"d{r}", formula.format(
+                        l=lookup.format(r=r * 5)))
+
+            start = time.perf_counter()
+            for i in range(1, 6):
+                wb.set_cell_contents(name, "c1", str(i))
+            print(f"\n{kind}: 5 edits {time.perf_counter() - start:.3f}s")
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,113 @@
+from sheets.workbook import Workbook
+from sheets.error import CellError, CellErrorType
+from collections import Counter
+from decimal import Decimal
+import unittest
+
+
+class TestBatchUpdates(unittest.TestCase):
+    def setUp(self):
+        self.wb = Workbook()
+        _, self.name = self.wb.new_sheet()
+        self.notifications = []
+        self.wb.notify_cells_changed(
+            lambda wb, cells: self.notifications.append(list(cells)))
+
+        # Count how often each cell is evaluated
+        self.evaluated = Counter()
+        evaluate_serial = self.wb.evaluate_serial
+
+        def counting(cells, initial_vals):
+            cells = list(cells)
+            self.evaluated.update(cells)
+            evaluate_serial(cells, initial_vals)
+        self.wb.evaluate_serial = counting
+
+    def test_set_cells_contents(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "C1", "=SUM(A1:A50)+B1")
+        wb.set_cell_contents(name, "C2", "=C1*2")
+        self.notifications.clear()
+        self.evaluated.clear()
+
+        contents = {f"A{i}": str(i) for i in range(1, 51)}
+        contents["B1"] = "=A1"
+        wb.set_cells_contents(name.upper(), contents)
+
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(1276))
+        self.assertEqual(wb.get_cell_value(name, "C2"), Decimal(2552))
+        c1 = wb.get_cell_instance(name, "C1")
+        self.assertEqual(self.evaluated[c1], 1)
+        self.assertEqual(len(self.notifications), 1)
+        self.assertEqual(len(self.notifications[0]), 53)
+        self.assertIn((name, "c2"), self.notifications[0])
+
+        with self.assertRaises(KeyError):
+            wb.set_cells_contents("Nope", {"A1": "1"})
+
+    def test_batch_context(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "1")
+        wb.set_cell_contents(name, "B1", "=A1+1")
+        self.notifications.clear()
+
+        with wb.batch():
+            wb.set_cell_contents(name, "A1", "5")
+            with wb.batch():
+                wb.set_cell_contents(name, "A2", "=B1")
+            # Values are brought up to date when the batch ends
+            self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(2))
+            self.assertIsNone(wb.get_cell_value(name, "A2"))
+            self.assertEqual(self.notifications, [])
+
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(6))
+        self.assertEqual(wb.get_cell_value(name, "A2"), Decimal(6))
+        self.assertEqual(self.notifications,
+                         [[(name, "a1"), (name, "a2"), (name, "b1")]])
+
+    def test_batch_exception(self):
+        wb, name = self.wb, self.name
+        with self.assertRaises(ValueError):
+            wb.set_cells_contents(name, {"A1": "1", "B1": "=A1*3",
+                                         "ZZZZZ1": "2"})
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(3))
+        self.assertEqual(len(self.notifications), 1)
+
+    def test_batch_cycles(self):
+        wb, name = self.wb, self.name
+        wb.set_cells_contents(name, {"A1": "=B1", "B1": "=C1", "C1": "=A1",
+                                     "D1": "=C1+1"})
+        for loc in ("A1", "B1", "C1", "D1"):
+            val = wb.get_cell_value(name, loc)
+            self.assertIsInstance(val, CellError)
+            self.assertEqual(val.get_type(), CellErrorType.CIRCULAR_REFERENCE)
+
+        wb.set_cells_contents(name, {"C1": "7", "D1": "=C1+1"})
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(7))
+        self.assertEqual(wb.get_cell_value(name, "D1"), Decimal(8))
+
+    def test_batch_replaced_cells(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "1")
+        self.notifications.clear()
+
+        # A cell emptied and set back to its value hasn't changed
+        with wb.batch():
+            wb.set_cell_contents(name, "A1", None)
+            wb.set_cell_contents(name, "A1", "1")
+            wb.set_cell_contents(name, "A2", "2")
+        self.assertEqual(self.notifications, [[(name, "a2")]])
+
+    def test_move_cells_batched(self):
+        wb, name = self.wb, self.name
+        wb.set_cells_contents(name, {"A1": "1", "A2": "2", "A3": "3",
+                                     "B1": "=SUM(C1:C3)"})
+        self.notifications.clear()
+
+        wb.move_cells(name, "A1", "A3", "C1")
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(6))
+        self.assertEqual(len(self.notifications), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,6 @@
 from sheets.workbook import Workbook
 from sheets.error import CellError, CellErrorType
+from sheets.graph import RangeIndex, span_blocks
 from decimal import Decimal
 import unittest
 
@@ -223,18 +224,94 @@ class TestCellRangeFunctionality(unittest.TestCase):
         #       "=IFERROR(VLOOKUP(A2, INDIRECT(B1 & \"!A2:J100\"), 7), \"\")")
         assert True
 
-    # def test_range_cycles(self):
-    #     wb = Workbook()
-    #     _, name = wb.new_sheet()
-
-    #     wb.set_cell_contents(name, "A1", "=SUM(A2:A4)")
-    #     wb.set_cell_contents(name, "A2", "1")
-    #     wb.set_cell_contents(name, "A3", "2")
-    #     wb.set_cell_contents(name, "A4", "=A1")
-
-    #     self.assertTrue(isinstance(wb.get_cell_value(name, "A1"), CellError))
-    #     self.assertEqual(wb.get_cell_value(name, "A1").get_type(),
-    #                      CellErrorType.CIRCULAR_REFERENCE)
-    #     self.assertTrue(isinstance(wb.get_cell_value(name, "A4"), CellError))
-    #     self.assertEqual(wb.get_cell_value(name, "A4").get_type(),
-    #                      CellErrorType.CIRCULAR_REFERENCE)
+    def test_range_cycles(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+
+        wb.set_cell_contents(name, "A1", "=SUM(A2:A4)")
+        wb.set_cell_contents(name, "A2", "1")
+        wb.set_cell_contents(name, "A3", "2")
+        wb.set_cell_contents(name, "A4", "=A1")
+
+        self.assertTrue(isinstance(wb.get_cell_value(name, "A1"), CellError))
+        self.assertEqual(wb.get_cell_value(name, "A1").get_type(),
+                         CellErrorType.CIRCULAR_REFERENCE)
+        self.assertTrue(isinstance(wb.get_cell_value(name, "A4"), CellError))
+        self.assertEqual(wb.get_cell_value(name, "A4").get_type(),
+                         CellErrorType.CIRCULAR_REFERENCE)
+
+        # A range containing its own cell is a cycle
+        wb.set_cell_contents(name, "B2", "=MAX(B1:B3)")
+        self.assertEqual(wb.get_cell_value(name, "B2").get_type(),
+                         CellErrorType.CIRCULAR_REFERENCE)
+        wb.set_cell_contents(name, "B2", "=MAX(C1:C3)")
+        self.assertEqual(wb.get_cell_value(name, "B2"), Decimal(0))
+
+    def test_range_dependents(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.new_sheet("Other Data")
+
+        wb.set_cell_contents(name, "A1", "=SUM(B1:C9999)")
+        wb.set_cell_contents(name, "A2", "=SUM('Other Data'!B5:B6) + A1")
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(0))
+
+        # Cells created inside a range update formulas reading it, without
+        # any of the range's empty cells being created
+        wb.set_cell_contents(name, "C5000", "4")
+        wb.set_cell_contents("Other Data", "B6", "10")
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(4))
+        self.assertEqual(wb.get_cell_value(name, "A2"), Decimal(14))
+        self.assertEqual(wb.get_sheet_extent(name), (3, 5000))
+
+        wb.set_cell_contents(name, "C5000", None)
+        wb.set_cell_contents(name, "D5000", "1")
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(0))
+
+        # Changing a formula stops it depending on its old range
+        wb.set_cell_contents(name, "A1", "=SUM(D1:D2)")
+        wb.set_cell_contents(name, "B1", "100")
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(0))
+        wb.set_cell_contents(name, "D2", "5")
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(5))
+
+        # Renaming and deleting the sheet the range is on
+        wb.rename_sheet("Other Data", "Input")
+        self.assertEqual(wb.get_cell_contents(name, "A2"),
+                         "=SUM(Input!B5:B6)+A1")
+        wb.set_cell_contents("Input", "B5", "1")
+        self.assertEqual(wb.get_cell_value(name, "A2"), Decimal(16))
+        wb.del_sheet("Input")
+        self.assertTrue(isinstance(wb.get_cell_value(name, "A2"), CellError))
+
+    def test_range_on_missing_sheet(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+
+        wb.set_cell_contents(name, "A1", "=SUM(Later!A1:A3)")
+        self.assertTrue(isinstance(wb.get_cell_value(name, "A1"), CellError))
+        wb.new_sheet("Later")
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(0))
+        wb.set_cell_contents("Later", "A2", "3")
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(3))
+
+    def test_range_index(self):
+        index = RangeIndex()
+        for top, bottom in [(1, 9999), (1, 1), (17, 4000), (9999, 9999)]:
+            covered = set()
+            for level, i in span_blocks(top, bottom):
+                covered.update(range(i << level, (i + 1) << level))
+            self.assertEqual(covered, set(range(top, bottom + 1)))
+
+        index.add((1, 1, 1, 9999), "a")
+        index.add((2, 5, 3, 10), "b")
+        index.add((2, 5, 3, 10), "c")
+        self.assertEqual(index.lookup(1, 5000), {"a"})
+        self.assertEqual(index.lookup(3, 10), {"b", "c"})
+        self.assertEqual(index.lookup(3, 11), set())
+        index.remove((2, 5, 3, 10), "b")
+        self.assertEqual(index.lookup(2, 5), {"c"})
+        index.remove((2, 5, 3, 10), "c")
+        index.remove((1, 1, 1, 9999), "a")
+        self.assertEqual(len(index), 0)
+        self.assertFalse(index.blocks)
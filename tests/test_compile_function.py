@@ -0,0 +1,92 @@
+from sheets.workbook import Workbook, CalculationMode
+from sheets.error import CellError, CellErrorType
+from decimal import Decimal
+import unittest
+
+
+class TestCompileFunction(unittest.TestCase):
+    def setUp(self):
+        self.wb = Workbook()
+        _, self.name = self.wb.new_sheet("Model")
+        self.wb.new_sheet("Rates")
+        self.wb.set_cells_contents("Rates", {"A1": "0.05", "A2": "=A1*2"})
+        self.wb.set_cells_contents(self.name, {
+            "A1": "100", "A2": "3",
+            "B1": "=A1*(1+Rates!A2)*A2",
+            "B2": "=SUM(A1:A3)+Rates!A1",
+            "B3": "=IF(B1>B2, \"up\", \"down\")",
+            "C1": "=B1/A3", "D1": "=INDIRECT(\"A1\")"})
+
+    def edit_and_read(self, inputs, outputs, values):
+        for (sheet, loc), val in zip(inputs, values):
+            self.wb.set_cell_contents(sheet, loc, str(val))
+        return [self.wb.get_cell_value(sheet, loc) for sheet, loc in outputs]
+
+    def test_matches_workbook(self):
+        inputs = [("model", "a1"), ("Model", "A2")]
+        outputs = [("Model", "B1"), ("Model", "B2"), ("Model", "B3")]
+        f = self.wb.compile_function(inputs, outputs)
+        before = self.edit_and_read([], outputs, [])
+
+        for values in ((100, 3), (250.5, 0), (Decimal(1), 10)):
+            self.assertEqual(self.wb.get_cell_value(self.name, "A1"),
+                             Decimal(100))
+            result = f(*values)
+            self.assertEqual(self.edit_and_read([], outputs, []), before)
+            self.assertEqual(result,
+                             self.edit_and_read(inputs, outputs, values))
+            self.edit_and_read(inputs, [], (100, 3))
+
+    def test_constants_and_errors(self):
+        wb, name = self.wb, self.name
+        f = wb.compile_function([(name, "A3")],
+                                [(name, "C1"), (name, "A3"), ("Rates", "A2"),
+                                 (name, "Z9")])
+        c1, a3, rate, empty = f(0)
+        self.assertIsInstance(c1, CellError)
+        self.assertEqual(c1.get_type(), CellErrorType.DIVIDE_BY_ZERO)
+        self.assertEqual((a3, rate, empty), (Decimal(0), Decimal("0.1"), None))
+        self.assertEqual(f("x")[0].get_type(), CellErrorType.TYPE_ERROR)
+
+        # The values read outside the function are those it was compiled
+        # with
+        b1 = wb.get_cell_value(name, "B1")
+        wb.set_cell_contents("Rates", "A1", "0.5")
+        self.assertEqual(f(2)[0], b1 / 2)
+
+        # An empty input that nothing reads is allowed
+        self.assertEqual(wb.compile_function([(name, "Z1")], [(name, "B1")])(
+            5), [wb.get_cell_value(name, "B1")])
+
+    def test_unsupported_cones(self):
+        wb, name = self.wb, self.name
+        with self.assertRaises(ValueError):
+            wb.compile_function([(name, "A1")], [(name, "D1")])
+        with self.assertRaises(KeyError):
+            wb.compile_function([("Nope", "A1")], [(name, "B1")])
+        with self.assertRaises(ValueError):
+            wb.compile_function([(name, "A0")], [(name, "B1")])
+
+        # INDIRECT outside the cone is fine, and so is a cycle the inputs
+        # break
+        wb.compile_function([(name, "A2")], [(name, "B1")])
+        wb.set_cell_contents(name, "E1", "=E2+1")
+        wb.set_cell_contents(name, "E2", "=E1*2")
+        self.assertEqual(wb.compile_function([(name, "E1")],
+                                             [(name, "E2")])(4),
+                         [Decimal(8)])
+        wb.set_cell_contents(name, "E1", "=E2+A1")
+        with self.assertRaises(ValueError):
+            wb.compile_function([(name, "A1")], [(name, "E2")])
+
+    def test_lazy_mode(self):
+        wb = Workbook(calculation_mode=CalculationMode.LAZY)
+        _, name = wb.new_sheet()
+        wb.set_cells_contents(name, {"A1": "1", "A2": "=A1+1", "B1": "2",
+                                     "B2": "=A2*B1"})
+        f = wb.compile_function([(name, "B1")], [(name, "B2")])
+        self.assertEqual(f(3), [Decimal(6)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+from sheets.workbook import Workbook
+from sheets import functions
+from decimal import Decimal
+import unittest
+
+
+# Input cells shared by every formula below.
+INPUTS = {
+    "A1": "1", "A2": "2.50", "A3": "'12", "A4": "hello", "A5": "true",
+    "A6": "#DIV/0!", "B1": "0", "B2": "-3", "B3": "=1/0", "B4": "'",
+    "C1": "1", "C2": "a", "C3": "b", "D1": "2", "D2": "c", "D3": "d",
+}
+
+FORMULAS = [
+    # Literals and parentheses
+    "=1.500", "=\"str\"", "=\"#REF!\"", "=TRUE", "=#NAME?", "=((A1))",
+    # Arithmetic, including string coercion, empty cells and errors
+    "=A1+A2", "=A1-A3", "=A1+A4", "=A1+A5", "=A1+Z99", "=A6+1", "=1+A6",
+    "=A1*A2", "=A2/B1", "=A3/A2", "=B2*Z99", "=A1/A4",
+    "=-A1", "=+A2", "=-A6", "=-A4",
+    # Chains of operators at one precedence level
+    "=10-A1-A2+3", "=A2*2/A1*4", "=1+2+A1-A6+3", "=A6*A1/B1",
+    # Concatenation
+    "=A1&A4", "=A4&Z99&A5", "=A6&\"x\"", "=B4&A3",
+    # Comparisons across types and with empty cells
+    "=A1=A3", "=A1<A4", "=A4>A5", "=A4=\"HELLO\"", "=Z99=0", "=Z99<>\"\"",
+    "=Z99=Z98", "=A1<=A2", "=A2>=A1", "=A1!=A1", "=A6=1", "=A5<A1",
+    "=A1<A2=TRUE", "=1=1=A5", "=\"a\"&1&2&A1",
+    # References to other sheets, missing sheets and bad locations
+    "=Other!A1+1", "=Missing!A1", "='Other'!A1*2", "=AAAAA1",
+    # Unknown functions and bad ranges
+    "=NOPE(1)", "=SUM(A1:AAAAA1)", "=SUM(Missing!A1:A2)",
+]
+
+# Calls exercising every entry in functions.function_dict.
+CALLS = {
+    "AND": ["=AND(A1, A5)", "=AND(B1, A1)", "=AND()", "=AND(A1:A2)",
+            "=AND(B1, A1:A2)"],
+    "OR": ["=OR(B1, A5)", "=OR(B1)", "=OR()", "=OR(A1, NOPE())"],
+    "NOT": ["=NOT(A5)", "=NOT(1, 2)"],
+    "XOR": ["=XOR(A1, A5, B1)", "=XOR()"],
+    "EXACT": ["=EXACT(A3, \"12\")", "=EXACT(A4, \"Hello\")", "=EXACT(A1)"],
+    "IF": ["=IF(A5, A1, A2)", "=IF(B1, A1)", "=IF(B1, A1, Z99)", "=IF(A1)"],
+    "IFERROR": ["=IFERROR(A6, 1)", "=IFERROR(A1, 2)", "=IFERROR(B3)",
+                "=IFERROR(A6, Z99)", "=IFERROR(A1:A2, 1)"],
+    "CHOOSE": ["=CHOOSE(2, A1, A2)", "=CHOOSE(3, A1)", "=CHOOSE(A2, 1, 2)"],
+    "LET": ["=LET(x, A1, y, x*2, x+y)", "=LET(x, Z99, x)", "=LET(x, 1)",
+            "=LET(A1, 1, 2)", "=LET(x, 1, z)", "=x+1",
+            "=LET(x, 1, LET(x, x+1, x)*10+x)"],
+    "ISBLANK": ["=ISBLANK(Z99)", "=ISBLANK(A1)", "=ISBLANK()"],
+    "ISERROR": ["=ISERROR(A6)", "=ISERROR(B3)", "=ISERROR(A1)"],
+    "VERSION": ["=VERSION()", "=VERSION(1)"],
+    "NOW": ["=NOW()>45000", "=NOW(1)"],
+    "RAND": ["=AND(RAND()>=0, RAND()<1)", "=RAND(A1)"],
+    "INDIRECT": ["=INDIRECT(\"A1\")", "=INDIRECT(\"Other!A1\")",
+                 "=INDIRECT(\"Nope!A1\")", "=INDIRECT(\"junk\")"],
+    "MIN": ["=MIN(A1:B2)", "=MIN(Z1:Z5)", "=MIN(A1, A4)"],
+    "MAX": ["=MAX(A1:B2, 10)", "=MAX(Other!A1:A2)"],
+    "SUM": ["=SUM(A1:B2)", "=SUM(A1:A2, B2)", "=SUM()"],
+    "AVERAGE": ["=AVERAGE(A1:A2)", "=AVERAGE(Z1:Z9)"],
+    "HLOOKUP": ["=HLOOKUP(1, C1:D3, 2)", "=HLOOKUP(9, C1:D3, 2)"],
+    "VLOOKUP": ["=VLOOKUP(2, C1:D3, 3)", "=VLOOKUP(\"x\", C1:D3, 1)"],
+}
+
+
+class TestFormulaCompiler(unittest.TestCase):
+    @staticmethod
+    def evaluate(compile_formulas, formulas):
+        wb = Workbook(compile_formulas=compile_formulas)
+        _, name = wb.new_sheet()
+        wb.new_sheet("Other")
+        wb.set_cell_contents("Other", "A1", "5")
+        wb.set_cell_contents("Other", "A2", "6")
+        for loc, contents in INPUTS.items():
+            wb.set_cell_contents(name, loc, contents)
+        vals = []
+        for i, formula in enumerate(formulas, 1):
+            wb.set_cell_contents(name, f"J{i}", formula)
+            vals.append(wb.get_cell_value(name, f"J{i}"))
+        return vals
+
+    def assert_engines_agree(self, formulas):
+        compiled = self.evaluate(True, formulas)
+        interpreted = self.evaluate(False, formulas)
+        for formula, c, i in zip(formulas, compiled, interpreted):
+            with self.subTest(formula=formula):
+                self.assertEqual(type(c), type(i))
+                self.assertEqual(c, i)
+
+    def test_operators(self):
+        self.assert_engines_agree(FORMULAS)
+
+    def test_functions(self):
+        self.assertEqual(set(CALLS), set(functions.function_dict))
+        self.assert_engines_agree([f for calls in CALLS.values()
+                                   for f in calls])
+
+    def test_compiled_formula_reset(self):
+        """The compiled formula is kept across recalculations and replaced
+        when the cell's formula changes or a sheet it references is
+        renamed."""
+
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "2")
+        wb.set_cell_contents(name, "B1", "=A1*3")
+        cell = wb.get_cell_instance(name, "B1")
+        compiled = cell.template.compiled
+        self.assertIsNotNone(compiled)
+
+        wb.set_cell_contents(name, "A1", "3")
+        self.assertIs(cell.template.compiled, compiled)
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(9))
+
+        wb.set_cell_contents(name, "B1", "=A1*4")
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(12))
+
+        wb.new_sheet("Data")
+        wb.set_cell_contents("Data", "A1", "1")
+        wb.set_cell_contents(name, "C1", "=Data!A1+1")
+        wb.rename_sheet("Data", "Input")
+        wb.set_cell_contents("Input", "A1", "5")
+        self.assertEqual(wb.get_cell_contents(name, "C1"), "=Input!A1+1")
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(6))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+from sheets.workbook import Workbook
+from sheets.error import CellError, CellErrorType
+from sheets.graph import Condensation
+from collections import Counter
+from decimal import Decimal
+import unittest
+
+
+class TestCondensation(unittest.TestCase):
+    def setUp(self):
+        self.wb = Workbook()
+        _, self.name = self.wb.new_sheet()
+
+        # Count how often each cell is evaluated
+        self.evaluated = Counter()
+        evaluate_serial = self.wb.evaluate_serial
+
+        def counting(cells, initial_vals):
+            cells = list(cells)
+            self.evaluated.update(cells)
+            evaluate_serial(cells, initial_vals)
+        self.wb.evaluate_serial = counting
+
+    def cells(self, *locs):
+        return [self.wb.get_cell_instance(self.name, loc) for loc in locs]
+
+    def assert_circular(self, *locs):
+        for loc in locs:
+            val = self.wb.get_cell_value(self.name, loc)
+            self.assertIsInstance(val, CellError, loc)
+            self.assertEqual(val.get_type(), CellErrorType.CIRCULAR_REFERENCE)
+
+    def test_components(self):
+        wb, name = self.wb, self.name
+        wb.set_cells_contents(name, {
+            "A1": "1", "B1": "=A1+C1", "C1": "=B1", "D1": "=C1+E1",
+            "E1": "=A1*2", "F1": "=SUM(F1:F2)"})
+        a1, b1, c1, d1, e1 = self.cells("A1", "B1", "C1", "D1", "E1")
+        wb.set_cell_contents(name, "A1", "2")
+
+        condensation = wb.order_cache.orders[a1][1]
+        self.assertIsInstance(condensation, Condensation)
+        self.assertEqual([set(c) for c in condensation.cycles], [{b1, c1}])
+        self.assertEqual(condensation.cells[0], a1)
+        self.assertEqual(set(condensation.cells), {a1, d1, e1})
+        self.assertLess(condensation.cells.index(e1),
+                        condensation.cells.index(d1))
+
+        # Cells feeding the cycle keep their values, and cells reading it
+        # see its errors
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(2))
+        self.assertEqual(wb.get_cell_value(name, "E1"), Decimal(4))
+        self.assert_circular("B1", "C1", "D1", "F1")
+
+    def test_edits_reuse_condensation(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "=" + "+".join(
+            f"B{i}" for i in range(1, 21)))
+        for i in range(1, 21):
+            wb.set_cell_contents(name, f"B{i}", f"=A1+C{i}")
+        wb.set_cell_contents(name, "C1", "1")
+        self.assert_circular("A1", "B1", "B20")
+        self.evaluated.clear()
+        hits = wb.order_cache.hits
+
+        for i in range(2, 6):
+            wb.set_cell_contents(name, "C1", str(i))
+            wb.set_cell_contents(name, "B2", "=A1+C2+0")
+        self.assertEqual(wb.order_cache.hits - hits, 7)
+        self.assert_circular("A1", "B2")
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(5))
+
+        # The cells on the cycle are marked without being evaluated
+        b1, b3 = self.cells("B1", "B3")
+        self.assertEqual(self.evaluated[b1], 0)
+        self.assertEqual(self.evaluated[b3], 0)
+
+    def test_changed_edges_break_cycle(self):
+        wb, name = self.wb, self.name
+        wb.set_cells_contents(name, {"A1": "=B1", "B1": "=A1+C1", "C1": "1",
+                                     "D1": "=B1*2"})
+        wb.set_cell_contents(name, "C1", "2")
+        self.assert_circular("A1", "B1", "D1")
+
+        wb.set_cell_contents(name, "A1", "5")
+        wb.set_cell_contents(name, "C1", "3")
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(8))
+        self.assertEqual(wb.get_cell_value(name, "D1"), Decimal(16))
+        self.assertIsInstance(wb.order_cache.orders[self.cells("C1")[0]][1],
+                              list)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+from sheets.workbook import Workbook
+from sheets.compiler import Constant, compile_formula
+from sheets.error import CellError, CellErrorType
+from sheets import util
+from decimal import Decimal
+import unittest
+
+
+class TestConstantFolding(unittest.TestCase):
+    @staticmethod
+    def compile(formula):
+        return compile_formula(util.get_parser().parse(formula))
+
+    def test_constant_formulas(self):
+        for formula, value in (
+                ("=(1+0.07)/12*12", Decimal("1.07")),
+                ("=-2.50&\"x\"", "-2.5x"),
+                ("=\"a\"=\"A\"", True),
+                ("=SUM(1, 2)*IF(FALSE, 1, 3)", Decimal(9)),
+                ("=AND(TRUE, OR(FALSE, 1))", True),
+                ("=IFERROR(1/0, 4)", Decimal(4)),
+                ("=CHOOSE(2, 1, 2)+VERSION()&\"\"", None)):
+            with self.subTest(formula=formula):
+                compiled = self.compile(formula)
+                self.assertIsInstance(compiled, Constant)
+                if value is not None:
+                    self.assertEqual(compiled.value, value)
+
+        compiled = self.compile("=1/0")
+        self.assertIsInstance(compiled, Constant)
+        self.assertEqual(compiled.value.get_type(),
+                         CellErrorType.DIVIDE_BY_ZERO)
+
+    def test_formulas_reading_cells(self):
+        for formula in ("=A1*(1+0.07)", "=RAND()*0", "=NOW()>1",
+                        "=INDIRECT(\"A1\")", "=SUM(A1:A2, 1)", "=NOPE(1)",
+                        "=IF(TRUE, A1, 2)"):
+            with self.subTest(formula=formula):
+                self.assertNotIsInstance(self.compile(formula), Constant)
+
+    def test_values(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cells_contents(name, {
+            "A1": "1200", "B1": "=A1*(1+0.06)/12", "B2": "=1+2+A1",
+            "B3": "=NOPE(1)+1", "B4": "=RAND()*0"})
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(106))
+        self.assertEqual(wb.get_cell_value(name, "B2"), Decimal(1203))
+        val = wb.get_cell_value(name, "B3")
+        self.assertIsInstance(val, CellError)
+        self.assertEqual(val.get_type(), CellErrorType.BAD_NAME)
+        self.assertEqual(wb.get_cell_value(name, "B4"), Decimal(0))
+
+        # The folded part is kept across recalculations
+        wb.set_cell_contents(name, "A1", "2400")
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(212))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+from sheets.workbook import Workbook
+from sheets.error import CellError, CellErrorType
+from sheets.cell import Cell, CellType
+from sheets.graph import DependencyGraph
+from decimal import Decimal
+import random
+import unittest
+
+
+class TestDependencyOrder(unittest.TestCase):
+    def assert_in_order(self, wb):
+        for sheet in wb.sheet_arr:
+            for cell in sheet.loc_to_cell.values():
+                for child in wb.cell_children(cell):
+                    self.assertLess(cell.order, child.order)
+
+    def test_random_edits(self):
+        """Formulas are entered in a random order, referencing cells and
+        ranges that come earlier in a hidden order so there are no cycles;
+        the workbook's order and values have to agree with it."""
+
+        rng = random.Random(5)
+        locs = [f"{c}{r}" for c in "ABCDE" for r in range(1, 9)]
+        hidden = locs[:]
+        rng.shuffle(hidden)
+
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        refs = {}
+        for _ in range(300):
+            loc = rng.choice(locs)
+            earlier = hidden[:hidden.index(loc)]
+            refs[loc] = rng.sample(earlier, min(len(earlier),
+                                                rng.randint(0, 3)))
+            terms = ["1"] + refs[loc]
+            if earlier and rng.random() < 0.3:
+                # A whole column, when everything in it comes earlier
+                col = rng.choice(earlier)[0]
+                column = [f"{col}{r}" for r in range(1, 9)]
+                if all(c in earlier for c in column):
+                    refs[loc] = refs[loc] + column
+                    terms.append(f"SUM({col}1:{col}8)")
+            wb.set_cell_contents(name, loc, "=" + "+".join(terms))
+            self.assert_in_order(wb)
+
+        def expected(loc):
+            if loc not in refs:
+                return 0
+            return 1 + sum(expected(r) for r in refs[loc])
+
+        for loc in locs:
+            if loc in refs:
+                self.assertEqual(wb.get_cell_value(name, loc),
+                                 Decimal(expected(loc)))
+
+    def test_reversed_chain(self):
+        """Building a chain from its end moves every cell in front of the
+        cells that depend on it."""
+
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        for i in range(1, 200):
+            wb.set_cell_contents(name, f"A{i}", f"=A{i + 1}+1")
+        wb.set_cell_contents(name, "A200", "1")
+
+        self.assert_in_order(wb)
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(200))
+
+    def test_broken_cycle(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "=A3+1")
+        wb.set_cell_contents(name, "A2", "=A1+1")
+        wb.set_cell_contents(name, "A3", "=A2+1")
+        wb.set_cell_contents(name, "A4", "=SUM(A1:A3)")
+        for loc in ("A1", "A2", "A3"):
+            val = wb.get_cell_value(name, loc)
+            self.assertIsInstance(val, CellError)
+            self.assertEqual(val.get_type(), CellErrorType.CIRCULAR_REFERENCE)
+
+        wb.set_cell_contents(name, "A1", "1")
+        self.assertEqual(wb.get_cell_value(name, "A3"), Decimal(3))
+        self.assertEqual(wb.get_cell_value(name, "A4"), Decimal(6))
+
+        # Once the cycle is broken, the order is repaired and recalculation
+        # reads it again
+        self.assert_in_order(wb)
+        a1 = wb.get_cell_instance(name, "A1")
+        self.assertIsNotNone(wb.topo_order.cone([a1]))
+        wb.set_cell_contents(name, "A1", "2")
+        self.assertEqual(wb.get_cell_value(name, "A4"), Decimal(9))
+
+    def test_dependency_graph(self):
+        """Random changes of parents, across compactions of the graph's
+        arrays, leave both directions of every edge in place."""
+
+        rng = random.Random(7)
+        graph = DependencyGraph(min_edits=16)
+        cells = []
+        for i in range(40):
+            cell = Cell(1, i + 1, None, None, CellType.NONE, "s", None)
+            graph.add_cell(cell)
+            cells.append(cell)
+
+        parents = {cell: set() for cell in cells}
+        for _ in range(500):
+            cell = rng.choice(cells)
+            parents[cell] = set(rng.sample(cells, rng.randint(0, 4)))
+            graph.set_parents(cell, parents[cell])
+
+        self.assertGreater(len(graph.child_adj.ids), 0)
+        for cell in cells:
+            self.assertEqual(graph.parents(cell), parents[cell])
+            self.assertEqual(graph.children(cell),
+                             {c for c in cells if cell in parents[c]})
+            self.assertEqual(graph.has_children(cell),
+                             bool(graph.children(cell)))
+
+    def test_graph_compaction(self):
+        wb = Workbook()
+        wb.graph.min_edits = 4
+        _, name = wb.new_sheet()
+        for i in range(1, 51):
+            wb.set_cell_contents(name, f"A{i}", f"=B{i}+B{i + 1}")
+        for i in range(1, 52):
+            wb.set_cell_contents(name, f"B{i}", str(i))
+        wb.set_cell_contents(name, "A10", "=C1")
+        wb.set_cell_contents(name, "B1", None)
+
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(2))
+        self.assertEqual(wb.get_cell_value(name, "A50"), Decimal(101))
+        b2 = wb.get_cell_instance(name, "B2")
+        self.assertTrue(wb.graph.has_children(b2))
+        wb.set_cell_contents(name, "A1", None)
+        wb.set_cell_contents(name, "A2", None)
+        self.assertFalse(wb.graph.has_children(b2))
+        self.assert_in_order(wb)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+from sheets.workbook import Workbook
+from sheets.error import CellError, CellErrorType
+from collections import Counter
+from decimal import Decimal
+import unittest
+
+
+class TestEarlyCutoff(unittest.TestCase):
+    def setUp(self):
+        self.wb = Workbook()
+        _, self.name = self.wb.new_sheet()
+
+        # Count how often each cell is evaluated
+        self.evaluated = Counter()
+        evaluate_serial = self.wb.evaluate_serial
+
+        def counting(cells, initial_vals):
+            cells = list(cells)
+            self.evaluated.update(cells)
+            evaluate_serial(cells, initial_vals)
+        self.wb.evaluate_serial = counting
+
+    def evaluations(self, loc):
+        return self.evaluated[self.wb.get_cell_instance(self.name, loc)]
+
+    def test_unchanged_value_stops_propagation(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "5")
+        wb.set_cell_contents(name, "B1", "=IF(A1>0, 1, 0)")
+        for i in range(2, 101):
+            wb.set_cell_contents(name, f"B{i}", f"=B{i - 1}+1")
+        wb.set_cell_contents(name, "C1", "=MAX(A1, 10)")
+        wb.set_cell_contents(name, "C2", "=SUM(C1, B1:B3)")
+        self.evaluated.clear()
+
+        wb.set_cell_contents(name, "A1", "6")
+        self.assertEqual(sum(self.evaluated.values()), 3)
+        self.assertEqual(self.evaluations("B1"), 1)
+        self.assertEqual(self.evaluations("C1"), 1)
+
+        wb.set_cell_contents(name, "A1", "-1")
+        self.assertEqual(wb.get_cell_value(name, "B100"), Decimal(99))
+        self.assertEqual(wb.get_cell_value(name, "C2"), Decimal(13))
+        self.assertEqual(self.evaluations("B100"), 1)
+        self.assertEqual(self.evaluations("C2"), 1)
+
+    def test_type_changes(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "1")
+        wb.set_cell_contents(name, "B1", "=A1")
+        wb.set_cell_contents(name, "C1", "=B1&\"\"")
+
+        # TRUE = 1, but it isn't the same value
+        wb.set_cell_contents(name, "A1", "true")
+        self.assertEqual(wb.get_cell_value(name, "C1"), "True")
+
+    def test_cycle_errors_are_recalculated(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "C1", "=ISERROR(A1)")
+        wb.set_cell_contents(name, "D1", "=A1+1")
+        wb.set_cell_contents(name, "A1", "=B1")
+        wb.set_cell_contents(name, "B1", "=A1")
+
+        # Only the cells on the cycle are marked, and the cells reading them
+        # see their errors
+        val = wb.get_cell_value(name, "D1")
+        self.assertIsInstance(val, CellError)
+        self.assertEqual(val.get_type(), CellErrorType.CIRCULAR_REFERENCE)
+        self.assertEqual(wb.get_cell_value(name, "C1"), True)
+
+        # A1 keeps the error once B1 no longer reads it, but is still
+        # recalculated
+        wb.set_cell_contents(name, "B1", "#CIRCREF!")
+        self.assertEqual(wb.get_cell_value(name, "A1").get_type(),
+                         CellErrorType.CIRCULAR_REFERENCE)
+        wb.set_cell_contents(name, "B1", "5")
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(5))
+        self.assertEqual(wb.get_cell_value(name, "C1"), False)
+        self.assertEqual(wb.get_cell_value(name, "D1"), Decimal(6))
+
+
+if __name__ == "__main__":
+    unittest.main()
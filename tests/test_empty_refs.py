@@ -0,0 +1,149 @@
+from sheets.workbook import Workbook
+from sheets.error import CellError, CellErrorType
+from decimal import Decimal
+import unittest
+
+
+class TestEmptyReferences(unittest.TestCase):
+    def setUp(self):
+        self.wb = Workbook()
+        _, self.name = self.wb.new_sheet()
+        self.sheet = self.wb.sheet_arr[0]
+
+    def test_no_cells_for_empty_references(self):
+        wb, name, sheet = self.wb, self.name, self.sheet
+        wb.set_cell_contents(name, "A1", "=Z99+1")
+        wb.set_cell_contents(name, "A2", "=Z99*Y98")
+
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(1))
+        self.assertEqual(len(sheet.loc_to_cell), 2)
+        self.assertEqual(wb.get_sheet_extent(name), (1, 2))
+        z99 = wb.graph.location_ids[(sheet, (26, 99))]
+        self.assertIsNone(wb.graph.cells[z99])
+        self.assertEqual(len(wb.graph.child_ids(z99)), 2)
+
+        # The locations are forgotten along with the references
+        wb.set_cell_contents(name, "A1", "1")
+        wb.set_cell_contents(name, "A2", None)
+        self.assertEqual(wb.graph.location_ids, {})
+        self.assertEqual(wb.graph.locations, {})
+
+    def test_filling_and_emptying_watched_cell(self):
+        wb, name, sheet = self.wb, self.name, self.sheet
+        wb.set_cell_contents(name, "A1", "=B1+1")
+        wb.set_cell_contents(name, "A2", "=A1*2")
+
+        b1_id = wb.graph.location_ids[(sheet, (2, 1))]
+        wb.set_cell_contents(name, "B1", "4")
+        self.assertEqual(wb.get_cell_value(name, "A2"), Decimal(10))
+        self.assertEqual(wb.graph.location_ids, {})
+        self.assertEqual(wb.get_cell_instance(name, "B1").id, b1_id)
+
+        # An emptied cell is removed, and its location keeps its edges
+        wb.set_cell_contents(name, "B1", None)
+        self.assertIsNone(wb.get_cell_instance(name, "B1"))
+        self.assertEqual(wb.get_cell_value(name, "A2"), Decimal(2))
+        self.assertEqual(wb.graph.location_ids, {(sheet, (2, 1)): b1_id})
+        a1 = wb.get_cell_instance(name, "A1")
+        self.assertEqual(list(wb.graph.child_ids(b1_id)), [a1.id])
+        self.assertEqual(wb.get_sheet_extent(name), (1, 2))
+
+        wb.set_cell_contents(name, "B1", "9")
+        self.assertEqual(wb.get_cell_value(name, "A2"), Decimal(20))
+
+    def test_cycle_through_empty_cell(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "=B1")
+        wb.set_cell_contents(name, "C1", "=A1+1")
+        wb.set_cell_contents(name, "B1", "=A1")
+        for loc in ("A1", "B1", "C1"):
+            val = wb.get_cell_value(name, loc)
+            self.assertIsInstance(val, CellError)
+            self.assertEqual(val.get_type(), CellErrorType.CIRCULAR_REFERENCE)
+
+        # Emptying a cell of the cycle breaks it
+        wb.set_cell_contents(name, "B1", None)
+        self.assertIsNone(wb.get_cell_value(name, "A1"))
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(1))
+
+    def test_other_sheets(self):
+        wb, name = self.wb, self.name
+        wb.new_sheet("Other")
+        wb.set_cell_contents(name, "A1", "=Other!B2+1")
+
+        wb.rename_sheet("Other", "Renamed")
+        self.assertEqual(wb.get_cell_contents(name, "A1"), "=Renamed!B2+1")
+        wb.set_cell_contents("Renamed", "B2", "5")
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(6))
+
+        wb.set_cell_contents("Renamed", "B2", None)
+        wb.del_sheet("Renamed")
+        val = wb.get_cell_value(name, "A1")
+        self.assertIsInstance(val, CellError)
+        self.assertEqual(val.get_type(), CellErrorType.BAD_REFERENCE)
+
+        wb.new_sheet("Renamed")
+        wb.set_cell_contents("Renamed", "B2", "2")
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(3))
+
+    def test_ids_reused(self):
+        wb, name, graph = self.wb, self.name, self.wb.graph
+        wb.set_cell_contents(name, "B1", "=C1+1")
+        size = len(graph.cells)
+        for i in range(1000):
+            wb.set_cell_contents(name, "A1", str(i))
+            wb.set_cell_contents(name, "A1", None)
+            wb.set_cell_contents(name, "B1", "=C1+1" if i % 2 else "=C2")
+        self.assertEqual(len(graph.cells), size + 1)
+        self.assertEqual(len(graph.sheets), len(graph.cells))
+
+        wb.set_cell_contents(name, "A1", "=B1")
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(1))
+        wb.set_cell_contents(name, "C1", "4")
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(5))
+
+    def test_deleted_sheet_released(self):
+        wb, name, graph = self.wb, self.name, self.wb.graph
+        for i in range(100):
+            wb.new_sheet("Other")
+            wb.set_cells_contents("Other", {"A1": "1", "A2": "=A1"})
+            wb.set_cell_contents(name, "A1", "=Other!A1+Other!B1")
+            wb.del_sheet("Other")
+        other = [s for s in graph.sheets if s is not None and
+                 s is not self.sheet]
+        self.assertEqual(other, [])
+        self.assertEqual(graph.location_ids, {})
+        self.assertLess(len(graph.cells), 10)
+        val = wb.get_cell_value(name, "A1")
+        self.assertIsInstance(val, CellError)
+        self.assertEqual(val.get_type(), CellErrorType.BAD_REFERENCE)
+
+    def test_emptying_watched_cell_in_parallel(self):
+        wb = Workbook(workers=2)
+        self.addCleanup(wb.parallel.shutdown)
+        wb.parallel.min_cells = 1
+        _, name = wb.new_sheet()
+        wb.set_cells_contents(name, {"A5": "8", "A3": "=A5", "A1": "=A3"})
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(8))
+
+        # A1 reads the emptied A3, so it is evaluated after it
+        wb.set_cell_contents(name, "A3", None)
+        self.assertIsNone(wb.get_cell_value(name, "A1"))
+        wb.set_cell_contents(name, "A3", "=A5*2")
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(16))
+
+    def test_move_cells_onto_watched_cells(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "1")
+        wb.set_cell_contents(name, "A2", "2")
+        wb.set_cell_contents(name, "B1", "=C1+C2")
+
+        wb.move_cells(name, "A1", "A2", "C1")
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(3))
+        wb.move_cells(name, "C1", "C2", "D1")
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(0))
+        self.assertEqual(len(self.sheet.loc_to_cell), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+from sheets.workbook import Workbook, CalculationMode
+from sheets.error import CellError, CellErrorType
+from sheets import functions
+from decimal import Decimal
+import unittest
+
+
+class TestIndirectDependencies(unittest.TestCase):
+    def setUp(self):
+        self.wb = Workbook()
+        _, self.name = self.wb.new_sheet()
+
+    def assert_error(self, loc, error_type):
+        val = self.wb.get_cell_value(self.name, loc)
+        self.assertIsInstance(val, CellError)
+        self.assertEqual(val.get_type(), error_type)
+
+    def test_target_changes(self):
+        wb, name = self.wb, self.name
+        wb.set_cells_contents(name, {"A1": "1", "B1": "10", "B2": "20",
+                                     "C1": "=INDIRECT(\"B\"&A1)+1"})
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(11))
+
+        wb.set_cell_contents(name, "B1", "15")
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(16))
+
+        # Only the cell read last is a dependency
+        wb.set_cell_contents(name, "A1", "2")
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(21))
+        b1 = wb.get_cell_instance(name, "B1")
+        c1 = wb.get_cell_instance(name, "C1")
+        self.assertNotIn(c1, wb.cell_children(b1))
+        wb.set_cell_contents(name, "B2", "30")
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(31))
+
+        # Changing the formula forgets what it read
+        wb.set_cell_contents(name, "C1", "=A1")
+        self.assertNotIn(c1, wb.dynamic_parents)
+        self.assertEqual(wb.graph.parents(c1),
+                         {wb.get_cell_instance(name, "A1")})
+
+    def test_empty_target(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "=INDIRECT(\"D5\")*2")
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(0))
+        self.assertIsNone(wb.get_cell_instance(name, "D5"))
+
+        wb.set_cell_contents(name, "D5", "4")
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(8))
+        wb.set_cell_contents(name, "D5", None)
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(0))
+        wb.set_cell_contents(name, "A1", "1")
+        self.assertEqual(wb.graph.location_ids, {})
+
+    def test_other_sheets(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "=INDIRECT(\"'Other Sheet'!B1\")")
+        self.assert_error("A1", CellErrorType.BAD_REFERENCE)
+
+        wb.new_sheet("Other Sheet")
+        wb.set_cell_contents("Other Sheet", "B1", "3")
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(3))
+
+        wb.set_cell_contents(name, "A2", "=INDIRECT(\"Nope!A1\")")
+        self.assert_error("A2", CellErrorType.BAD_REFERENCE)
+        wb.set_cell_contents(name, "A3", "=INDIRECT(\"ZZZZZ1\")")
+        self.assert_error("A3", CellErrorType.BAD_REFERENCE)
+        wb.set_cell_contents(name, "A4", "=INDIRECT(\"B\")")
+        self.assert_error("A4", CellErrorType.TYPE_ERROR)
+
+    def test_renamed_sheet(self):
+        for compile_formulas in (True, False):
+            with self.subTest(compiled=compile_formulas):
+                wb = Workbook(compile_formulas=compile_formulas)
+                _, name = wb.new_sheet()
+                wb.new_sheet("S2")
+                wb.set_cell_contents("S2", "B3", "5")
+                wb.set_cells_contents(name, {
+                    "A1": "=INDIRECT(\"S2!B3\")",
+                    "A2": "=INDIRECT(\"S2!C3\")", "A3": "=A1+1"})
+
+                # The strings still name the old sheet
+                wb.rename_sheet("S2", "X")
+                for loc in ("A1", "A2", "A3"):
+                    val = wb.get_cell_value(name, loc)
+                    self.assertIsInstance(val, CellError)
+                    self.assertEqual(val.get_type(),
+                                     CellErrorType.BAD_REFERENCE)
+
+                wb.rename_sheet("X", "S2")
+                self.assertEqual(wb.get_cell_value(name, "A3"), Decimal(6))
+                self.assertIsNone(wb.get_cell_value(name, "A2"))
+
+    def test_target_evaluated_later(self):
+        """A target that comes after the formula in the order is read again
+        once it has been evaluated."""
+
+        wb, name = self.wb, self.name
+        wb.set_cells_contents(name, {"D1": "A5", "E1": "2", "A5": "=E1*2",
+                                     "C1": "=INDIRECT(D1)"})
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(4))
+
+        wb.set_cells_contents(name, {"D1": "A6", "A6": "=E1*3"})
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(6))
+        wb.set_cell_contents(name, "E1", "5")
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(15))
+
+    def test_cycles(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "=INDIRECT(\"B1\")")
+        wb.set_cell_contents(name, "B1", "=A1+1")
+        self.assert_error("A1", CellErrorType.CIRCULAR_REFERENCE)
+        self.assert_error("B1", CellErrorType.CIRCULAR_REFERENCE)
+
+        wb.set_cell_contents(name, "C2", "=A2+1")
+        wb.set_cell_contents(name, "A2", "=INDIRECT(\"C2\")")
+        self.assert_error("A2", CellErrorType.CIRCULAR_REFERENCE)
+        self.assert_error("C2", CellErrorType.CIRCULAR_REFERENCE)
+
+        wb.set_cell_contents(name, "A2", "=INDIRECT(\"C3\")")
+        self.assertEqual(wb.get_cell_value(name, "C2"), Decimal(1))
+
+    def test_modes(self):
+        for mode in (CalculationMode.LAZY, CalculationMode.MANUAL):
+            wb = Workbook(compile_formulas=False, calculation_mode=mode)
+            _, name = wb.new_sheet()
+            wb.set_cells_contents(name, {"A1": "B2", "B2": "7",
+                                         "C1": "=INDIRECT(A1)"})
+            wb.recalculate()
+            wb.set_cell_contents(name, "B2", "8")
+            if mode == CalculationMode.MANUAL:
+                self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(7))
+                wb.recalculate()
+            self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(8))
+
+    def test_modes_agree(self):
+        # The cells are set one at a time, so the order matters
+        for contents, values in (
+                ((("A4", "=B1+B2"), ("A5", "5"), ("B2", "=A5"),
+                  ("B1", "=INDIRECT(\"C1\")"), ("C1", "=B5"),
+                  ("B5", "=B2")),
+                 (("A4", 10), ("B1", 5), ("C1", 5), ("B5", 5))),
+                ((("A2", None), ("B4", "=A3+1"),
+                  ("C4", "=INDIRECT(\"A2\")"), ("A3", "=C4+1")),
+                 (("A3", 1), ("B4", 2), ("B4", 2)))):
+            for mode in CalculationMode:
+                with self.subTest(mode=mode, contents=contents):
+                    wb = Workbook(calculation_mode=mode)
+                    _, name = wb.new_sheet()
+                    for loc, cell_contents in contents:
+                        wb.set_cell_contents(name, loc, cell_contents)
+                    if mode == CalculationMode.MANUAL:
+                        wb.recalculate()
+                    for loc, value in values:
+                        self.assertEqual(wb.get_cell_value(name, loc),
+                                         Decimal(value))
+                    self.assertEqual(wb.dirty_cells, set())
+
+    def test_lazy_cycle(self):
+        wb = Workbook(calculation_mode=CalculationMode.LAZY)
+        _, name = wb.new_sheet()
+        wb.set_cells_contents(name, {"A1": "=INDIRECT(\"B1\")",
+                                     "B1": "=A1+1", "C1": "=A1"})
+        val = wb.get_cell_value(name, "C1")
+        self.assertIsInstance(val, CellError)
+        self.assertEqual(val.get_type(), CellErrorType.CIRCULAR_REFERENCE)
+        self.assertEqual(wb.dirty_cells, set())
+
+        wb.set_cell_contents(name, "A1", "=INDIRECT(\"B2\")")
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(1))
+
+    def test_parsed_references_are_cached(self):
+        functions.parse_reference.cache_clear()
+        wb, name = self.wb, self.name
+        for i in range(1, 11):
+            wb.set_cell_contents(name, f"A{i}", "=INDIRECT(\"$B$1\")")
+        self.assertEqual(functions.parse_reference.cache_info().misses, 1)
+        self.assertEqual(functions.parse_reference("'A b'!c3"),
+                         ("A b", "c3"))
+        self.assertIsNone(functions.parse_reference("A1:B2"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+from sheets import Workbook, CalculationMode
+from sheets.error import CellError, CellErrorType
+from collections import Counter
+from decimal import Decimal
+import unittest
+
+
+class TestLazyEvaluation(unittest.TestCase):
+    def setUp(self):
+        self.wb = Workbook(calculation_mode=CalculationMode.LAZY)
+        _, self.name = self.wb.new_sheet()
+        self.notifications = []
+        self.wb.notify_cells_changed(
+            lambda wb, cells: self.notifications.append(list(cells)))
+
+        # Count how often each cell is evaluated
+        self.evaluated = Counter()
+        evaluate_serial = self.wb.evaluate_serial
+
+        def counting(cells, initial_vals):
+            def count(cells):
+                for cell in cells:
+                    self.evaluated[cell] += 1
+                    yield cell
+            evaluate_serial(count(cells), initial_vals)
+        self.wb.evaluate_serial = counting
+
+    def test_evaluated_on_read(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "1")
+        wb.set_cell_contents(name, "B1", "=A1*2")
+        wb.set_cell_contents(name, "C1", "=B1+A1")
+        self.assertEqual(sum(self.evaluated.values()), 0)
+
+        for i in range(2, 20):
+            wb.set_cell_contents(name, "A1", str(i))
+        self.assertEqual(sum(self.evaluated.values()), 0)
+        b1 = wb.get_cell_instance(name, "B1")
+        self.assertIn(b1, wb.dirty_cells)
+
+        # Reading a cell evaluates it and the dirty cells it reads, once
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(57))
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(38))
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(57))
+        self.assertEqual(self.evaluated[b1], 1)
+        self.assertEqual(sum(self.evaluated.values()), 2)
+        self.assertEqual(wb.dirty_cells, set())
+
+    def test_only_read_cells_evaluated(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "1")
+        for i in range(1, 11):
+            wb.set_cell_contents(name, f"B{i}", f"=A1+{i}")
+        wb.set_cell_contents(name, "C1", "=SUM(B1:B3)")
+
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(9))
+        self.assertEqual(sum(self.evaluated.values()), 4)
+        self.assertEqual(len(wb.dirty_cells), 7)
+
+    def test_notifications(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "1")
+        wb.set_cell_contents(name, "B1", "=A1")
+        self.notifications.clear()
+
+        # A dirty cell is reported, since its value may have changed
+        wb.set_cell_contents(name, "A1", "2")
+        self.assertEqual(self.notifications, [[(name, "a1"), (name, "b1")]])
+
+    def test_long_chain(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "1")
+        for i in range(2, 3001):
+            wb.set_cell_contents(name, f"A{i}", f"=A{i - 1}+1")
+        self.assertEqual(wb.get_cell_value(name, "A3000"), Decimal(3000))
+
+    def test_cycles(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "=B1")
+        wb.set_cell_contents(name, "B1", "=A1")
+        wb.set_cell_contents(name, "C1", "=A1+1")
+        for loc in ("A1", "B1"):
+            val = wb.get_cell_value(name, loc)
+            self.assertIsInstance(val, CellError)
+            self.assertEqual(val.get_type(), CellErrorType.CIRCULAR_REFERENCE)
+
+        wb.set_cell_contents(name, "B1", "4")
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(5))
+
+    def test_indirect(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "1")
+        wb.set_cell_contents(name, "B1", "=A1+1")
+        wb.set_cell_contents(name, "C1", "=INDIRECT(\"B1\")*10")
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(20))
+
+        # C1 doesn't depend on B1, but reading B1 while evaluating it still
+        # brings B1 up to date
+        wb.set_cell_contents(name, "A1", "2")
+        wb.set_cell_contents(name, "C1", "=INDIRECT(\"B1\")*100")
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(300))
+
+    def test_indirect_reads_pending_cell(self):
+        wb, name = self.wb, self.name
+        wb.set_cells_contents(name, {
+            "A4": "=B1+B2", "A5": "5", "B2": "=A5",
+            "B1": "=INDIRECT(\"C1\")", "C1": "=B5", "B5": "=B2"})
+
+        # Evaluating B1 reads C1, whose evaluation needs B2 before the pass
+        # reading A4 has got to it
+        self.assertEqual(wb.get_cell_value(name, "A4"), Decimal(10))
+        for loc in ("B1", "C1", "B5"):
+            self.assertEqual(wb.get_cell_value(name, loc), Decimal(5))
+        self.assertEqual(wb.dirty_cells, set())
+        self.assertEqual(set(self.evaluated.values()), {1})
+
+    def test_switching_modes(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "1")
+        wb.set_cell_contents(name, "B1", "=A1+1")
+        wb.set_calculation_mode(CalculationMode.AUTOMATIC)
+        self.assertEqual(wb.dirty_cells, set())
+        b1 = wb.get_cell_instance(name, "B1")
+        self.assertEqual(self.evaluated[b1], 1)
+        self.assertEqual(b1.val, Decimal(2))
+
+        wb.set_cell_contents(name, "A1", "5")
+        self.assertEqual(b1.val, Decimal(6))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+from sheets.workbook import Workbook
+from sheets.error import CellError, CellErrorType
+from decimal import Decimal
+import unittest
+
+
+class TestLazyArguments(unittest.TestCase):
+    def evaluate(self, compile_formulas, formula):
+        """Returns the value of the formula and the locations it read."""
+
+        wb = Workbook(compile_formulas=compile_formulas)
+        _, name = wb.new_sheet()
+        wb.set_cells_contents(name, {"A1": "1", "A2": "=1/0", "B1": "x"})
+        for r in range(1, 101):
+            wb.set_cell_contents(name, f"C{r}", str(r))
+
+        read = []
+        get_cell_value = wb.get_cell_value
+
+        def reading(sheet_name, location):
+            read.append(location.lower())
+            return get_cell_value(sheet_name, location)
+        wb.get_cell_value = reading
+        wb.set_cell_contents(name, "D1", formula)
+        wb.get_cell_value = get_cell_value
+        return wb.get_cell_value(name, "D1"), read
+
+    def assert_lazy(self, formula, value, read):
+        for compile_formulas in (True, False):
+            with self.subTest(formula=formula, compiled=compile_formulas):
+                val, locs = self.evaluate(compile_formulas, formula)
+                self.assertEqual(val, value)
+                self.assertEqual(set(locs), set(read))
+
+    def test_untaken_branches(self):
+        self.assert_lazy("=IF(A1=1, 5, SUM(C1:C100))", Decimal(5), {"a1"})
+        self.assert_lazy("=IF(A1=2, SUM(C1:C100))", False, {"a1"})
+        self.assert_lazy("=IF(A1, B1, VLOOKUP(1, C1:C100, 1))", "x",
+                         {"a1", "b1"})
+        self.assert_lazy("=CHOOSE(2, C1, A1, C3)", Decimal(1), {"a1"})
+        self.assert_lazy("=IFERROR(A1, C1)", Decimal(1), {"a1"})
+        self.assert_lazy("=IFERROR(A2, B1)", "x", {"a2", "b1"})
+
+    def test_short_circuit(self):
+        self.assert_lazy("=AND(A1, A1=2, C1)", False, {"a1"})
+        self.assert_lazy("=AND(A1, C1)", True, {"a1", "c1"})
+        self.assert_lazy("=OR(A1=2, B1=\"x\", SUM(C1:C100))", True,
+                         {"a1", "b1"})
+        self.assert_lazy("=OR(A1=2)", False, {"a1"})
+
+    def test_untaken_indirect(self):
+        """A cell read through an INDIRECT call that isn't evaluated isn't
+        a dependency."""
+
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cells_contents(name, {"A1": "FALSE", "B1": "3",
+                                     "C1": "=IF(A1, INDIRECT(\"B1\"), 0)"})
+        c1 = wb.get_cell_instance(name, "C1")
+        self.assertNotIn(c1, wb.dynamic_parents)
+
+        wb.set_cell_contents(name, "A1", "TRUE")
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(3))
+        wb.set_cell_contents(name, "B1", "4")
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(4))
+
+    def test_iferror(self):
+        for compile_formulas in (True, False):
+            wb = Workbook(compile_formulas=compile_formulas)
+            _, name = wb.new_sheet()
+            wb.set_cells_contents(name, {
+                "A1": "=IFERROR(1/0, \"none\")", "A2": "=IFERROR(7, 0)",
+                "A3": "=IFERROR(#REF!)", "A4": "=IFERROR(B1:B2, 1)"})
+            self.assertEqual(wb.get_cell_value(name, "A1"), "none")
+            self.assertEqual(wb.get_cell_value(name, "A2"), Decimal(7))
+            self.assertEqual(wb.get_cell_value(name, "A3"), "")
+            val = wb.get_cell_value(name, "A4")
+            self.assertIsInstance(val, CellError)
+            self.assertEqual(val.get_type(), CellErrorType.TYPE_ERROR)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+from sheets.workbook import Workbook
+from sheets.error import CellError, CellErrorType
+from sheets.template import template_cache
+from sheets import functions
+from decimal import Decimal
+import unittest
+
+
+class TestLet(unittest.TestCase):
+    def setUp(self):
+        # Count the lookups, which formulas compiled before now wouldn't call
+        template_cache.clear()
+        self.lookups = 0
+        vlookup = functions.function_dict["VLOOKUP"]
+
+        def counting(args):
+            self.lookups += 1
+            return vlookup(args)
+        functions.function_dict["VLOOKUP"] = counting
+        self.addCleanup(functions.function_dict.__setitem__, "VLOOKUP",
+                        vlookup)
+        self.addCleanup(template_cache.clear)
+
+    @staticmethod
+    def workbooks():
+        """Yields a workbook and its sheet for each way of evaluating."""
+
+        for compile_formulas in (True, False):
+            wb = Workbook(compile_formulas=compile_formulas)
+            _, name = wb.new_sheet()
+            yield wb, name
+
+    def assert_error(self, val, error_type):
+        self.assertIsInstance(val, CellError)
+        self.assertEqual(val.get_type(), error_type)
+
+    def test_values(self):
+        for wb, name in self.workbooks():
+            wb.set_cells_contents(name, {
+                "A1": "3", "A2": "4",
+                "B1": "=LET(x, A1, y, x*A2, x+y)",
+                "B2": "=LET(Total, SUM(A1:A2), total*2)",
+                "B3": "=LET(x, 1, LET(x, x+1, x)*10+x)",
+                "B4": "=LET(x, Z99, x)",
+                "B5": "=LET(a1x, A1, a1x&\"!\")"})
+            self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(15))
+            self.assertEqual(wb.get_cell_value(name, "B2"), Decimal(14))
+            self.assertEqual(wb.get_cell_value(name, "B3"), Decimal(21))
+            self.assertEqual(wb.get_cell_value(name, "B4"), Decimal(0))
+            self.assertEqual(wb.get_cell_value(name, "B5"), "3!")
+
+            wb.set_cell_contents(name, "A1", "5")
+            self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(25))
+
+    def test_value_evaluated_once(self):
+        for wb, name in self.workbooks():
+            wb.set_cells_contents(name, {"A1": "1", "B1": "2", "A2": "3",
+                                         "B2": "-4", "C1": "2"})
+            self.lookups = 0
+            wb.set_cell_contents(name, "D1",
+                                 "=LET(v, VLOOKUP(C1+1, A1:B2, 2), "
+                                 "IF(v>0, v*2, -v))")
+            self.assertEqual(wb.get_cell_value(name, "D1"), Decimal(4))
+            self.assertEqual(self.lookups, 1)
+
+    def test_errors(self):
+        for wb, name in self.workbooks():
+            wb.set_cells_contents(name, {
+                "A1": "=LET(x, 1)", "A2": "=LET(A3, 1, 2)",
+                "A3": "=LET(x, 1, y)", "A4": "=x+1",
+                "A5": "=LET(x, 1/0, IFERROR(x, 7))"})
+            self.assert_error(wb.get_cell_value(name, "A1"),
+                              CellErrorType.TYPE_ERROR)
+            self.assert_error(wb.get_cell_value(name, "A2"),
+                              CellErrorType.TYPE_ERROR)
+            self.assert_error(wb.get_cell_value(name, "A3"),
+                              CellErrorType.BAD_NAME)
+            self.assert_error(wb.get_cell_value(name, "A4"),
+                              CellErrorType.BAD_NAME)
+            self.assertEqual(wb.get_cell_value(name, "A5"), Decimal(7))
+
+    def test_move_and_copy(self):
+        for wb, name in self.workbooks():
+            wb.set_cells_contents(name, {
+                "A1": "2", "A2": "5", "B1": "1", "B2": "10",
+                "C1": "=LET(x, A1*2, total, x+$B$1, total+B1)"})
+            wb.copy_cells(name, "C1", "C1", "C2")
+            self.assertEqual(wb.get_cell_contents(name, "C2"),
+                             "=LET(x,a2*2,total,x+$b$1,total+b2)")
+            self.assertEqual(wb.get_cell_value(name, "C2"), Decimal(21))
+
+            wb.move_cells(name, "C2", "C2", "D2")
+            self.assertEqual(wb.get_cell_contents(name, "D2"),
+                             "=LET(x,b2*2,total,x+$b$1,total+c2)")
+            self.assertEqual(wb.get_cell_value(name, "D2"), Decimal(21))
+            wb.set_cell_contents(name, "B2", "1")
+            self.assertEqual(wb.get_cell_value(name, "D2"), Decimal(3))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+from sheets import Workbook, CalculationMode
+from sheets.error import CellError, CellErrorType
+from collections import Counter
+from decimal import Decimal
+import unittest
+
+
+class TestManualCalculation(unittest.TestCase):
+    def setUp(self):
+        self.wb = Workbook(calculation_mode=CalculationMode.MANUAL)
+        _, self.name = self.wb.new_sheet()
+        self.notifications = []
+        self.wb.notify_cells_changed(
+            lambda wb, cells: self.notifications.append(list(cells)))
+
+        # Count how often each cell is evaluated
+        self.evaluated = Counter()
+        evaluate_serial = self.wb.evaluate_serial
+
+        def counting(cells, initial_vals):
+            cells = list(cells)
+            self.evaluated.update(cells)
+            evaluate_serial(cells, initial_vals)
+        self.wb.evaluate_serial = counting
+
+    def test_recalculate(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "B1", "=A1*2")
+        wb.set_cell_contents(name, "C1", "=SUM(A1:B1)")
+        for i in range(1, 100):
+            wb.set_cell_contents(name, "A1", str(i))
+
+        self.assertEqual(sum(self.evaluated.values()), 0)
+        self.assertEqual(self.notifications, [])
+        self.assertIsNone(wb.get_cell_value(name, "B1"))
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(99))
+        self.assertTrue(wb.is_cell_stale(name, "B1"))
+        self.assertTrue(wb.is_cell_stale(name, "c1"))
+        self.assertFalse(wb.is_cell_stale(name, "A1"))
+        self.assertFalse(wb.is_cell_stale(name, "D1"))
+
+        wb.recalculate()
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(297))
+        self.assertFalse(wb.is_cell_stale(name, "C1"))
+        self.assertEqual(self.evaluated[wb.get_cell_instance(name, "B1")], 1)
+        self.assertEqual(sum(self.evaluated.values()), 2)
+        self.assertEqual(len(self.notifications), 1)
+        self.assertCountEqual(self.notifications[0],
+                              [(name, "a1"), (name, "b1"), (name, "c1")])
+
+        # Nothing pending, nothing to do
+        wb.recalculate()
+        self.assertEqual(sum(self.evaluated.values()), 2)
+
+    def test_recalculate_sheets(self):
+        wb, name = self.wb, self.name
+        wb.new_sheet("Other")
+        wb.set_cell_contents(name, "A1", "1")
+        wb.set_cell_contents("Other", "A1", f"={name}!A1+1")
+        wb.set_cell_contents("Other", "B1", f"={name}!A1+2")
+        wb.set_cell_contents(name, "B1", "=Other!A1*10")
+        wb.recalculate(["other"])
+
+        # Other!A1 is read by a stale cell, but isn't stale itself
+        self.assertEqual(wb.get_cell_value("Other", "A1"), Decimal(2))
+        self.assertFalse(wb.is_cell_stale("Other", "B1"))
+        self.assertTrue(wb.is_cell_stale(name, "B1"))
+
+        wb.set_cell_contents(name, "A1", "5")
+        wb.recalculate([name])
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(60))
+        self.assertEqual(wb.get_cell_value("Other", "B1"), Decimal(3))
+        self.assertTrue(wb.is_cell_stale("Other", "B1"))
+
+        # Cells left stale are brought up to date by the next recalculation
+        wb.set_cell_contents(name, "C1", "=Other!B1")
+        wb.recalculate()
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(7))
+        self.assertEqual(wb.dirty_cells, set())
+
+        with self.assertRaises(KeyError):
+            wb.recalculate(["Nope"])
+
+    def test_cycles(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "=B1")
+        wb.set_cell_contents(name, "B1", "=A1")
+        wb.set_cell_contents(name, "C1", "=A1+1")
+        wb.recalculate()
+        for loc in ("A1", "B1", "C1"):
+            val = wb.get_cell_value(name, loc)
+            self.assertIsInstance(val, CellError)
+            self.assertEqual(val.get_type(), CellErrorType.CIRCULAR_REFERENCE)
+
+        wb.set_cell_contents(name, "B1", "4")
+        wb.recalculate()
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(5))
+
+    def test_sheet_changes(self):
+        wb, name = self.wb, self.name
+        wb.new_sheet("Data")
+        wb.set_cell_contents("Data", "A1", "3")
+        wb.set_cell_contents(name, "A1", "=Data!A1+1")
+        wb.copy_sheet("Data")
+        wb.del_sheet("Data")
+        wb.recalculate()
+
+        val = wb.get_cell_value(name, "A1")
+        self.assertIsInstance(val, CellError)
+        self.assertEqual(val.get_type(), CellErrorType.BAD_REFERENCE)
+        wb.rename_sheet("Data_1", "Data")
+        wb.recalculate()
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(4))
+
+    def test_switching_modes(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "1")
+        wb.set_cell_contents(name, "B1", "=A1+1")
+        wb.set_calculation_mode(CalculationMode.LAZY)
+        self.assertEqual(self.notifications, [[(name, "a1"), (name, "b1")]])
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(2))
+
+        wb.set_calculation_mode(CalculationMode.MANUAL)
+        wb.set_cell_contents(name, "A1", "2")
+        wb.set_calculation_mode(CalculationMode.AUTOMATIC)
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(3))
+        self.assertEqual(wb.pending_cells, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+from sheets.workbook import Workbook
+from sheets import util
+from decimal import Decimal
+import sys
+import unittest
+
+
+class TestOperatorChains(unittest.TestCase):
+    def test_flat_trees(self):
+        tree = util.get_parser().parse("=1+2-A1*3/4&\"x\"&B1=C1<>2")
+        self.assertEqual(tree.data, "compare_expr")
+        self.assertEqual(len(tree.children), 5)
+        concat = tree.children[0]
+        self.assertEqual(concat.data, "concat_expr")
+        self.assertEqual(len(concat.children), 3)
+        self.assertEqual([c.data for c in concat.children[0].children[::2]],
+                         ["number", "number", "mul_expr"])
+
+    def test_left_to_right(self):
+        for compile_formulas in (True, False):
+            wb = Workbook(compile_formulas=compile_formulas)
+            _, name = wb.new_sheet()
+            wb.set_cells_contents(name, {
+                "A1": "=10-2-3+1", "A2": "=2*3/4*2", "A3": "=1=1=TRUE",
+                "A4": "=\"a\"&1&A1"})
+            with self.subTest(compiled=compile_formulas):
+                self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(6))
+                self.assertEqual(wb.get_cell_value(name, "A2"), Decimal(3))
+                self.assertEqual(wb.get_cell_value(name, "A3"), True)
+                self.assertEqual(wb.get_cell_value(name, "A4"), "a16")
+
+    def test_long_formula(self):
+        """A formula adding up thousands of cells is evaluated and copied
+        without deep recursion."""
+
+        formula = "=" + "+".join(f"A{r}" for r in range(1, 2001))
+        for compile_formulas in (True, False):
+            wb = Workbook(compile_formulas=compile_formulas)
+            _, name = wb.new_sheet()
+            with wb.batch():
+                for r in range(1, 2001):
+                    wb.set_cell_contents(name, f"A{r}", "2")
+            limit = sys.getrecursionlimit()
+            sys.setrecursionlimit(500)
+            try:
+                wb.set_cell_contents(name, "B1", formula)
+                wb.copy_cells(name, "B1", "B1", "C1")
+                wb.set_cell_contents(name, "A1", "3")
+            finally:
+                sys.setrecursionlimit(limit)
+            with self.subTest(compiled=compile_formulas):
+                self.assertEqual(wb.get_cell_value(name, "B1"),
+                                 Decimal(4001))
+                self.assertTrue(wb.get_cell_contents(name, "C1").lower()
+                                .startswith("=b1+b2+"))
+
+
+if __name__ == "__main__":
+    unittest.main()
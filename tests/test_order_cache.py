@@ -0,0 +1,81 @@
+from sheets.workbook import Workbook, CalculationMode
+from sheets.graph import OrderCache
+from decimal import Decimal
+import unittest
+
+
+class TestOrderCache(unittest.TestCase):
+    def setUp(self):
+        self.wb = Workbook()
+        _, self.name = self.wb.new_sheet()
+        self.wb.set_cells_contents(self.name, {
+            "A1": "1", "A2": "=A1+1", "A3": "=A2*2", "B1": "=SUM(A1:A2)"})
+        self.cache = self.wb.order_cache
+        self.cache.clear()
+
+    def test_repeated_edits_hit(self):
+        wb, name, cache = self.wb, self.name, self.cache
+        for i in range(2, 6):
+            wb.set_cell_contents(name, "A1", str(i))
+            self.assertEqual(wb.get_cell_value(name, "A3"),
+                             Decimal(2 * i + 2))
+            self.assertEqual(wb.get_cell_value(name, "B1"),
+                             Decimal(2 * i + 1))
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+        self.assertEqual(cache.hit_rate(), 0.75)
+
+    def test_changed_edges_invalidate(self):
+        wb, name, cache = self.wb, self.name, self.cache
+        wb.set_cell_contents(name, "A1", "2")
+        wb.set_cell_contents(name, "C1", "=A3+1")
+        wb.set_cell_contents(name, "A1", "3")
+        self.assertEqual(wb.get_cell_value(name, "C1"), Decimal(9))
+        self.assertEqual(cache.hits, 0)
+
+        # So do changed ranges, though they are not edges of the graph
+        wb.set_cell_contents(name, "C2", "=SUM(A3:A4)")
+        wb.set_cell_contents(name, "A1", "4")
+        self.assertEqual(wb.get_cell_value(name, "C2"), Decimal(10))
+        self.assertEqual(cache.hits, 0)
+
+        # Edits that leave the edges alone do not, and C2 finds the order
+        # stored when it was set
+        wb.set_cell_contents(name, "C2", "=SUM(A3:A4)*2")
+        wb.set_cell_contents(name, "A1", "5")
+        self.assertEqual(wb.get_cell_value(name, "C2"), Decimal(24))
+        self.assertEqual(cache.hits, 2)
+
+    def test_emptied_cells_invalidate(self):
+        wb, name, cache = self.wb, self.name, self.cache
+        wb.set_cell_contents(name, "C1", "=SUM(A2:A3)")
+        wb.set_cell_contents(name, "A1", "2")
+        wb.set_cell_contents(name, "C1", None)
+        wb.set_cell_contents(name, "A1", "3")
+        self.assertEqual(cache.hits, 0)
+        self.assertIsNone(wb.get_cell_instance(name, "C1"))
+
+    def test_lazy_mode(self):
+        wb = Workbook(calculation_mode=CalculationMode.LAZY)
+        _, name = wb.new_sheet()
+        wb.set_cells_contents(name, {"A1": "1", "A2": "=A1+1"})
+        for i in range(2, 5):
+            wb.set_cell_contents(name, "A1", str(i))
+            self.assertTrue(wb.is_cell_stale(name, "A2"))
+            self.assertEqual(wb.get_cell_value(name, "A2"), Decimal(i + 1))
+        self.assertEqual(wb.order_cache.hits, 2)
+
+    def test_eviction(self):
+        cache = OrderCache(maxsize=2)
+        wb, name = self.wb, self.name
+        cells = [wb.get_cell_instance(name, loc) for loc in ("A1", "A2", "A3")]
+        for cell in cells:
+            cache.put(cell, 0, [cell])
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNone(cache.get(cells[0], 0))
+        self.assertEqual(cache.get(cells[2], 0), [cells[2]])
+        self.assertIsNone(cache.get(cells[1], 1))
+        self.assertEqual(len(cache.orders), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+from sheets.workbook import Workbook, CalculationMode
+from sheets.error import CellError, CellErrorType
+from decimal import Decimal
+import unittest
+
+
+class TestOrphanedReferences(unittest.TestCase):
+    def test_index_follows_formulas(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "=Missing!A1+1")
+        wb.set_cell_contents(name, "A2", "=SUM('Other Sheet'!A1:A3)")
+        wb.set_cell_contents(name, "A3", "=missing!B1")
+        a1 = wb.get_cell_instance(name, "A1")
+        a3 = wb.get_cell_instance(name, "A3")
+
+        self.assertEqual(wb.orphans.cells["missing"], {a1, a3})
+        self.assertIn("other sheet", wb.orphans.cells)
+        val = wb.get_cell_value(name, "A1")
+        self.assertIsInstance(val, CellError)
+        self.assertEqual(val.get_type(), CellErrorType.BAD_REFERENCE)
+
+        # Changed and cleared formulas are forgotten
+        wb.set_cell_contents(name, "A1", "=A2")
+        wb.set_cell_contents(name, "A2", None)
+        self.assertEqual(wb.orphans.cells, {"missing": {a3}})
+        self.assertEqual(len(wb.orphans), 1)
+
+    def test_new_and_renamed_sheets(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "=missing!A1+1")
+        wb.set_cell_contents(name, "A2", "=SUM(Later!A1:A2)")
+        wb.set_cell_contents(name, "A3", "=A1+A2")
+
+        # The name matches in any case
+        wb.new_sheet("MISSING")
+        wb.set_cell_contents("Missing", "A1", "4")
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(5))
+        self.assertIsInstance(wb.get_cell_value(name, "A3"), CellError)
+        self.assertNotIn(wb.get_cell_instance(name, "A1"), wb.orphans)
+
+        wb.new_sheet("Other")
+        wb.set_cell_contents("Other", "A2", "4")
+        wb.rename_sheet("Other", "Later")
+        self.assertEqual(wb.get_cell_value(name, "A2"), Decimal(4))
+        self.assertEqual(wb.get_cell_value(name, "A3"), Decimal(9))
+        self.assertEqual(len(wb.orphans), 0)
+
+    def test_manual_mode(self):
+        # References to missing sheets are found without evaluating
+        wb = Workbook(calculation_mode=CalculationMode.MANUAL)
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "=Other!B1*2")
+        wb.new_sheet("Other")
+        wb.set_cell_contents("Other", "B1", "3")
+        wb.recalculate()
+        self.assertEqual(wb.get_cell_value(name, "A1"), Decimal(6))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+from sheets.workbook import Workbook
+from sheets.error import CellError, CellErrorType
+from decimal import Decimal
+import unittest
+
+
+class TestParallelRecalculation(unittest.TestCase):
+    def setUp(self):
+        self.wb = Workbook(workers=2)
+        self.wb.parallel.min_cells = 4
+        _, self.name = self.wb.new_sheet()
+        self.wb.new_sheet("Other")
+
+    def tearDown(self):
+        self.wb.parallel.shutdown()
+
+    def fill(self, wb, name):
+        """A wide, shallow model: ten inputs, two levels of formulas reading
+        them, and a total."""
+
+        with wb.batch():
+            for i in range(1, 11):
+                wb.set_cell_contents(name, f"A{i}", str(i))
+                wb.set_cell_contents("Other", f"A{i}", str(10 * i))
+            for i in range(1, 11):
+                wb.set_cell_contents(name, f"B{i}",
+                                     f"=A{i}*2+Other!A{i}+SUM($A$1:$A$10)")
+                wb.set_cell_contents(name, f"C{i}", f"=B{i}/(A{i}-5)")
+                wb.set_cell_contents(name, f"D{i}", f"=IF(A{i}>5, C{i}, "
+                                     f"INDIRECT(\"B{i}\"))&\"!\"")
+                wb.set_cell_contents(name, f"E{i}", f"=Missing!A{i}+B{i}")
+            wb.set_cell_contents(name, "F1", "=SUM(B1:C10)")
+
+    def test_matches_serial(self):
+        serial = Workbook()
+        _, name = serial.new_sheet()
+        serial.new_sheet("Other")
+        self.fill(self.wb, self.name)
+        self.fill(serial, name)
+
+        for sheet in (name, "Other"):
+            for col in "ABCDEF":
+                for row in range(1, 11):
+                    loc = f"{col}{row}"
+                    with self.subTest(loc=loc):
+                        val = self.wb.get_cell_value(sheet, loc)
+                        expected = serial.get_cell_value(sheet, loc)
+                        self.assertEqual(type(val), type(expected))
+                        self.assertEqual(val, expected)
+        self.assertIsNotNone(self.wb.parallel.pool)
+
+    def test_recalculation(self):
+        wb, name = self.wb, self.name
+        self.fill(wb, name)
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(67))
+        self.assertEqual(wb.get_cell_value(name, "D1"), "67!")
+        val = wb.get_cell_value(name, "C5")
+        self.assertIsInstance(val, CellError)
+        self.assertEqual(val.get_type(), CellErrorType.DIVIDE_BY_ZERO)
+
+        wb.set_cell_contents(name, "A1", "0")
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(64))
+        self.assertEqual(wb.get_cell_value(name, "B2"), Decimal(78))
+
+        # Formulas evaluated by workers still find sheets added later
+        self.assertIsInstance(wb.get_cell_value(name, "E1"), CellError)
+        wb.new_sheet("Missing")
+        self.assertEqual(wb.get_cell_value(name, "E1"), Decimal(64))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+from sheets.workbook import Workbook
+import unittest
+
+
+class TestPrecedentsAndDependents(unittest.TestCase):
+    def setUp(self):
+        self.wb = Workbook()
+        _, self.name = self.wb.new_sheet()
+        self.wb.new_sheet("Other")
+        self.wb.set_cells_contents(self.name, {
+            "A1": "1", "A2": "=A1+D4", "A3": "=SUM(A1:A2)*2",
+            "B1": "=A3+Other!C2", "B2": "7"})
+        self.wb.set_cell_contents("Other", "C3", "=Sheet1!b1")
+
+    def test_direct(self):
+        wb, name = self.wb, self.name
+        self.assertEqual(wb.get_precedents(name, "a2"),
+                         [(name, "a1"), (name, "d4")])
+        self.assertEqual(wb.get_precedents(name, "A3"),
+                         [(name, "a1"), (name, "a2")])
+        self.assertEqual(wb.get_precedents(name, "B2"), [])
+        self.assertEqual(wb.get_precedents(name, "Z9"), [])
+
+        self.assertEqual(wb.get_dependents(name, "A1"),
+                         [(name, "a2"), (name, "a3")])
+        self.assertEqual(wb.get_dependents(name, "B1"), [("Other", "c3")])
+        self.assertEqual(wb.get_dependents("other", "C2"), [(name, "b1")])
+        self.assertEqual(wb.get_dependents(name, "D4"), [(name, "a2")])
+
+    def test_transitive(self):
+        wb, name = self.wb, self.name
+        self.assertEqual(wb.get_precedents("Other", "C3", transitive=True),
+                         [(name, "a1"), (name, "b1"), (name, "a2"),
+                          (name, "a3"), (name, "d4"), ("Other", "c2")])
+        self.assertEqual(wb.get_dependents(name, "A1", transitive=True),
+                         [(name, "b1"), (name, "a2"), (name, "a3"),
+                          ("Other", "c3")])
+        self.assertEqual(wb.get_dependents(name, "D4", transitive=True),
+                         [(name, "b1"), (name, "a2"), (name, "a3"),
+                          ("Other", "c3")])
+        self.assertEqual(wb.get_dependents(name, "B2", transitive=True), [])
+
+    def test_cache_follows_edits(self):
+        wb, name = self.wb, self.name
+        wb.get_precedents("Other", "C3", transitive=True)
+        wb.get_precedents("Other", "C3", transitive=True)
+        self.assertEqual(wb.precedent_cache.hits, 1)
+
+        # A new cell in a range read along the way is a precedent
+        wb.set_cell_contents(name, "A4", "=B2")
+        self.assertNotIn((name, "b2"),
+                         wb.get_precedents("Other", "C3", transitive=True))
+        wb.set_cell_contents(name, "A3", "=SUM(A1:A4)")
+        self.assertIn((name, "b2"),
+                      wb.get_precedents("Other", "C3", transitive=True))
+
+        wb.set_cell_contents(name, "B1", "=A2")
+        self.assertEqual(wb.get_precedents("Other", "C3", transitive=True),
+                         [(name, "a1"), (name, "b1"), (name, "a2"),
+                          (name, "d4")])
+        self.assertEqual(wb.get_dependents(name, "B2", transitive=True),
+                         [(name, "a3"), (name, "a4")])
+
+    def test_cycles(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "=B1")
+        self.assertEqual(wb.get_dependents(name, "A1", transitive=True),
+                         [(name, "a1"), (name, "b1"), (name, "a2"),
+                          (name, "a3"), ("Other", "c3")])
+        self.assertIn((name, "a1"),
+                      wb.get_precedents(name, "A1", transitive=True))
+        self.assertEqual(wb.get_dependents(name, "B2", transitive=True), [])
+
+    def test_missing_sheet(self):
+        with self.assertRaises(KeyError):
+            self.wb.get_precedents("Nope", "A1")
+        with self.assertRaises(KeyError):
+            self.wb.get_dependents("Nope", "A1", transitive=True)
+        with self.assertRaises(ValueError):
+            self.wb.get_dependents(self.name, "A0")
+
+
+if __name__ == "__main__":
+    unittest.main()
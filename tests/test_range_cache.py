@@ -0,0 +1,59 @@
+from sheets.workbook import Workbook
+from decimal import Decimal
+import unittest
+
+
+class TestSharedRanges(unittest.TestCase):
+    def test_range_read_once(self):
+        for compile_formulas in (True, False):
+            wb = Workbook(compile_formulas=compile_formulas)
+            _, name = wb.new_sheet()
+            with wb.batch():
+                for r in range(1, 101):
+                    wb.set_cell_contents(name, f"A{r}", str(r))
+                for r in range(1, 51):
+                    wb.set_cell_contents(name, f"B{r}",
+                                         f"=SUM($A$1:$A$100)-A{r}")
+
+            reads = []
+            get_cell_value = wb.get_cell_value
+
+            def reading(sheet_name, location):
+                reads.append(location)
+                return get_cell_value(sheet_name, location)
+            wb.get_cell_value = reading
+            wb.set_cell_contents(name, "A1", "101")
+            wb.get_cell_value = get_cell_value
+
+            with self.subTest(compiled=compile_formulas):
+                self.assertEqual(wb.get_cell_value(name, "B1"),
+                                 Decimal(5049))
+                self.assertEqual(wb.get_cell_value(name, "B50"),
+                                 Decimal(5100))
+                self.assertEqual(len(reads), 150)
+                self.assertIsNone(wb.context.range_values)
+
+    def test_cells_evaluated_in_range(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cells_contents(name, {
+            "A1": "1", "A2": "=A1*2", "A3": "=SUM(A1:A2)",
+            "B1": "=SUM(A1:A2)+A3", "C1": "=A1"})
+        wb.set_cell_contents(name, "A1", "2")
+        self.assertEqual(wb.get_cell_value(name, "A3"), Decimal(6))
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(12))
+
+        # Evaluating a cell forgets the ranges holding it, and only those
+        a2, b1, c1 = (wb.get_cell_instance(name, loc)
+                      for loc in ("A2", "B1", "C1"))
+        with wb.sharing_ranges():
+            wb.evaluate_serial([b1], {})
+            self.assertIn((name, (1, 1, 1, 2)), wb.context.range_values)
+            wb.evaluate_serial([c1], {})
+            self.assertIn((name, (1, 1, 1, 2)), wb.context.range_values)
+            wb.evaluate_serial([a2], {})
+            self.assertEqual(wb.context.range_values, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
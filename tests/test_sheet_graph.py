@@ -0,0 +1,77 @@
+from sheets.workbook import Workbook
+from decimal import Decimal
+import unittest
+
+
+class TestSheetGraph(unittest.TestCase):
+    def setUp(self):
+        self.wb = Workbook()
+        for name in ("S1", "S2", "S3"):
+            self.wb.new_sheet(name)
+        self.s1, self.s2, self.s3 = self.wb.sheet_arr
+
+    def counts(self, sheet):
+        return self.wb.graph.sheet_graph.children.get(sheet, {})
+
+    def test_counts_follow_formulas(self):
+        wb, s1, s2 = self.wb, self.s1, self.s2
+        wb.set_cell_contents("S1", "A1", "1")
+        wb.set_cell_contents("S2", "A1", "=S1!A1+S1!B1")
+        wb.set_cell_contents("S2", "A2", "=SUM(S1!A1:A5)+A1")
+        wb.set_cell_contents("S2", "A3", "=INDIRECT(\"S1!C1\")")
+        wb.set_cell_contents("S1", "A2", "=A1")
+        self.assertEqual(self.counts(s1), {s2: 4})
+        self.assertEqual(wb.graph.sheet_graph.parents[s2], {s1: 4})
+        self.assertEqual(self.counts(s2), {})
+
+        # Counts go when the references do
+        wb.set_cell_contents("S2", "A1", "=A2")
+        wb.set_cell_contents("S2", "A2", None)
+        self.assertEqual(self.counts(s1), {s2: 1})
+        wb.set_cell_contents("S2", "A3", "3")
+        self.assertEqual(wb.graph.sheet_graph.children, {})
+        self.assertEqual(wb.graph.sheet_graph.parents, {})
+
+    def test_affected_sheets(self):
+        wb = self.wb
+        wb.set_cell_contents("S3", "A1", "=S2!A1")
+        wb.set_cell_contents("S2", "A1", "=s1!A1")
+        self.assertEqual(wb.get_affected_sheets("s1"), ["S1", "S2", "S3"])
+        self.assertEqual(wb.get_affected_sheets("S2"), ["S2", "S3"])
+        self.assertEqual(wb.get_affected_sheets("S3"), ["S3"])
+
+        wb.move_sheet("S3", 0)
+        wb.rename_sheet("S2", "Middle")
+        self.assertEqual(wb.get_affected_sheets("S1"),
+                         ["S3", "S1", "Middle"])
+        with self.assertRaises(KeyError):
+            wb.get_affected_sheets("S2")
+
+    def test_deleted_sheet_references(self):
+        wb, s1 = self.wb, self.s1
+        wb.set_cell_contents("S1", "A1", "5")
+        wb.set_cell_contents("S2", "A1", "=S1!A1+1")
+        wb.set_cell_contents("S2", "A2", "=SUM(S1!A1:B2)")
+        wb.del_sheet("S1")
+        self.assertNotIn(s1, wb.graph.sheet_graph.children)
+        self.assertEqual(wb.get_affected_sheets("S2"), ["S2"])
+
+        # Direct references to cells in the sheet find it again once it is
+        # created
+        wb.new_sheet("S1")
+        wb.set_cell_contents("S1", "A1", "7")
+        self.assertEqual(wb.get_cell_value("S2", "A1"), Decimal(8))
+        self.assertEqual(wb.get_cell_value("S2", "A2"), Decimal(7))
+
+    def test_rename_unreferenced_sheet(self):
+        wb = self.wb
+        wb.set_cell_contents("S1", "A1", "=S1!B1+1")
+        wb.set_cell_contents("S2", "A1", "=S1!A1")
+        wb.rename_sheet("S2", "Other")
+        wb.rename_sheet("S1", "First")
+        self.assertEqual(wb.get_cell_contents("First", "A1"), "=First!B1+1")
+        self.assertEqual(wb.get_cell_contents("Other", "A1"), "=First!A1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+from sheets.workbook import Workbook
+from sheets.error import CellError, CellErrorType
+from sheets.template import TemplateCache, canonicalize
+from decimal import Decimal
+import unittest
+
+
+class TestFormulaTemplates(unittest.TestCase):
+    def new_workbook(self, compile_formulas=True, maxsize=10000):
+        wb = Workbook(compile_formulas=compile_formulas)
+        wb.templates = TemplateCache(maxsize)
+        _, name = wb.new_sheet()
+        return wb, name
+
+    def test_canonicalize(self):
+        self.assertEqual(canonicalize("=A1+$B$2*C$3", (4, 1)),
+                         canonicalize("=b5+$B$2*d$3", (5, 5)))
+        self.assertNotEqual(canonicalize("=A1", (1, 1)),
+                            canonicalize("=A1", (1, 2)))
+        # References inside strings, sheet names and function names are
+        # plain text, not offsets
+        self.assertNotEqual(canonicalize("=\"A1\"&B1", (2, 1)),
+                            canonicalize("=\"A2\"&B2", (2, 2)))
+        self.assertEqual(canonicalize("=Sheet1!A1+LOG10(A1)", (2, 1)),
+                         canonicalize("=Sheet1!A2+LOG10(A2)", (2, 2)))
+        # Text can't be confused with a reference stored as an offset
+        self.assertNotEqual(canonicalize("=A1", (1, 1)),
+                            canonicalize("=R[0]C[0]", (1, 1)))
+        self.assertIsNone(canonicalize("=A1+AAAAA1", (1, 1)))
+
+    def test_filled_down_formulas_share_template(self):
+        for compile_formulas in (True, False):
+            wb, name = self.new_workbook(compile_formulas)
+            for i in range(1, 101):
+                wb.set_cell_contents(name, f"A{i}", str(i))
+                wb.set_cell_contents(name, f"B{i}", f"=A{i} * 2 + $A$1")
+
+            self.assertEqual(wb.templates.misses, 1)
+            self.assertEqual(wb.templates.hits, 99)
+            b1 = wb.get_cell_instance(name, "B1")
+            b50 = wb.get_cell_instance(name, "B50")
+            self.assertIs(b1.template, b50.template)
+            self.assertEqual(wb.get_cell_value(name, "B50"), Decimal(101))
+
+            wb.set_cell_contents(name, "A50", "0")
+            self.assertEqual(wb.get_cell_value(name, "B50"), Decimal(1))
+            wb.set_cell_contents(name, "A1", "10")
+            self.assertEqual(wb.get_cell_value(name, "B50"), Decimal(10))
+            self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(30))
+            self.assertEqual(wb.get_cell_contents(name, "B50"),
+                             "=A50 * 2 + $A$1")
+
+    def test_shared_ranges_and_sheets(self):
+        wb, name = self.new_workbook()
+        wb.new_sheet("Other")
+        for i in range(1, 6):
+            wb.set_cell_contents(name, f"A{i}", str(i))
+            wb.set_cell_contents("Other", f"A{i}", str(10 * i))
+        for i in range(1, 5):
+            wb.set_cell_contents(name, f"B{i}", f"=SUM(A{i}:A{i + 1})")
+            wb.set_cell_contents("Other", f"B{i}", f"=SUM(A{i}:A{i + 1})")
+
+        self.assertEqual(wb.templates.misses, 1)
+        self.assertEqual(wb.get_cell_value(name, "B3"), Decimal(7))
+        self.assertEqual(wb.get_cell_value("Other", "B3"), Decimal(70))
+
+    def test_moving_shared_formulas(self):
+        wb, name = self.new_workbook()
+        for i in range(1, 4):
+            wb.set_cell_contents(name, f"A{i}", str(i))
+            wb.set_cell_contents(name, f"B{i}", f"=A{i}+SUM(A{i}:A3)")
+
+        wb.copy_cells(name, "B1", "B3", "C2")
+        self.assertEqual(wb.get_cell_contents(name, "C2"), "=b2+SUM(b2:b4)")
+        self.assertEqual(wb.get_cell_contents(name, "C3"), "=b3+SUM(b3:b4)")
+        self.assertEqual(wb.get_cell_value(name, "C3"), Decimal(12))
+
+        # Copying leaves the source formulas alone
+        self.assertEqual(wb.get_cell_contents(name, "B1"), "=A1+SUM(A1:A3)")
+        wb.set_cell_contents(name, "A1", "10")
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(25))
+
+        wb.move_cells(name, "B1", "B2", "D9997")
+        self.assertEqual(wb.get_cell_contents(name, "D9997"),
+                         "=c9997+SUM(c9997:c9999)")
+        self.assertEqual(wb.get_cell_contents(name, "D9998"),
+                         "=c9998+SUM(c9998:c9999)")
+        wb.move_cells(name, "D9997", "D9997", "E9998")
+        self.assertEqual(wb.get_cell_contents(name, "E9998"),
+                         "=d9998+SUM(#REF!)")
+        self.assertIsNone(wb.get_cell_contents(name, "B1"))
+
+    def test_parse_errors_are_shared(self):
+        wb, name = self.new_workbook()
+        wb.set_cell_contents(name, "A1", "=B1 +* 2")
+        wb.set_cell_contents(name, "A2", "=B2 +* 2")
+
+        self.assertEqual(wb.templates.hits, 1)
+        for loc in ("A1", "A2"):
+            val = wb.get_cell_value(name, loc)
+            self.assertIsInstance(val, CellError)
+            self.assertEqual(val.get_type(), CellErrorType.PARSE_ERROR)
+
+    def test_eviction(self):
+        wb, name = self.new_workbook(maxsize=2)
+        for col in "BCDE":
+            wb.set_cell_contents(name, f"{col}1", f"=A1+{ord(col)}")
+        wb.set_cell_contents(name, "A1", "1")
+
+        self.assertEqual(len(wb.templates.templates), 2)
+        self.assertEqual(wb.templates.evictions, 2)
+        self.assertEqual(wb.get_cell_value(name, "B1"), Decimal(67))
+        self.assertEqual(wb.get_cell_value(name, "E1"), Decimal(70))
+
+
+if __name__ == "__main__":
+    unittest.main()
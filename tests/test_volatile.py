@@ -0,0 +1,91 @@
+from sheets.workbook import Workbook, CalculationMode
+from collections import Counter
+from datetime import datetime
+from decimal import Decimal
+import unittest
+
+
+class TestVolatileFunctions(unittest.TestCase):
+    def setUp(self):
+        self.wb = Workbook()
+        _, self.name = self.wb.new_sheet()
+        self.notifications = []
+        self.wb.notify_cells_changed(
+            lambda wb, cells: self.notifications.append(list(cells)))
+
+        # Count how often each cell is evaluated
+        self.evaluated = Counter()
+        evaluate_serial = self.wb.evaluate_serial
+
+        def counting(cells, initial_vals):
+            cells = list(cells)
+            self.evaluated.update(cells)
+            evaluate_serial(cells, initial_vals)
+        self.wb.evaluate_serial = counting
+
+    def test_now_and_rand(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "=NOW()")
+        wb.set_cell_contents(name, "A2", "=RAND()")
+
+        days = (datetime.now() - datetime(1899, 12, 30)).days
+        self.assertEqual(int(wb.get_cell_value(name, "A1")), days)
+        rand = wb.get_cell_value(name, "A2")
+        self.assertIsInstance(rand, Decimal)
+        self.assertTrue(0 <= rand < 1)
+
+    def test_recalculate_volatile(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "=RAND()")
+        wb.set_cell_contents(name, "A2", "=A1*0")
+        wb.set_cell_contents(name, "A3", "=A2+1")
+        wb.set_cell_contents(name, "B1", "5")
+        wb.set_cell_contents(name, "B2", "=B1*2")
+        a1 = wb.get_cell_instance(name, "A1")
+        self.assertEqual(wb.volatile_cells, {a1})
+        self.notifications.clear()
+        self.evaluated.clear()
+
+        val = wb.get_cell_value(name, "A1")
+        while wb.get_cell_value(name, "A1") == val:
+            wb.recalculate_volatile()
+
+        # Only the volatile cell and the cells depending on it are
+        # evaluated, and the change stops where it is absorbed
+        for loc in ("B1", "B2", "A3"):
+            cell = wb.get_cell_instance(name, loc)
+            self.assertEqual(self.evaluated[cell], 0)
+        self.assertEqual(self.evaluated[a1],
+                         self.evaluated[wb.get_cell_instance(name, "A2")])
+        self.assertEqual(self.notifications[-1], [(name, "a1")])
+
+    def test_volatile_cells_follow_formulas(self):
+        wb, name = self.wb, self.name
+        wb.set_cell_contents(name, "A1", "=IF(RAND()<2, 1, 0)")
+        wb.set_cell_contents(name, "A2", "=now()")
+        wb.set_cell_contents(name, "A3", "=A1+1")
+        self.assertEqual(len(wb.volatile_cells), 2)
+
+        wb.set_cell_contents(name, "A1", "=1")
+        wb.set_cell_contents(name, "A2", None)
+        self.assertEqual(wb.volatile_cells, set())
+        self.notifications.clear()
+        wb.recalculate_volatile()
+        self.assertEqual(self.notifications, [])
+
+    def test_lazy_mode(self):
+        wb = Workbook(calculation_mode=CalculationMode.LAZY)
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "=RAND()")
+        wb.set_cell_contents(name, "A2", "=A1+1")
+        wb.get_cell_value(name, "A2")
+
+        wb.recalculate_volatile()
+        self.assertTrue(wb.is_cell_stale(name, "A1"))
+        self.assertTrue(wb.is_cell_stale(name, "A2"))
+        self.assertEqual(wb.get_cell_value(name, "A2"),
+                         wb.get_cell_value(name, "A1") + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()